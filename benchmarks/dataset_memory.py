@@ -0,0 +1,95 @@
+"""
+Memory benchmark of the reference map loaders, on a synthetic dataset.
+
+Compares the memory held by the reference map (what stays resident for the
+whole life of the server) for:
+  - the original loader (`Dataset.build_reference_map`, full dataclasses),
+  - the compact loader (`Dataset.build_compact_reference_map`, slotted records),
+  - the compiled dataset (`LazyReferenceMap`, memory-mapped).
+
+Usage (from the root of the repo):
+    python benchmarks/dataset_memory.py --entries 20000
+"""
+import argparse, gc, json, os, random, sys, tempfile, time, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from utils.dataset import Dataset
+from utils.dataset_store import LazyReferenceMap, compile_dataset
+
+WORDS = "the a this that method class should be null check return value final static public private variable name test case".split()
+REPOS = [f"org{i}/project{i}" for i in range(200)]
+
+
+def sentence(rng: random.Random, n_words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n_words))
+
+
+def synthetic_dataset(n_entries: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    entries = []
+    for i in range(n_entries):
+        repo = rng.choice(REPOS)
+        entries.append(
+            {
+                "metadata": {
+                    "id": f"{i:032x}",
+                    "repo": repo,
+                    "pr_number": rng.randint(1, 20000),
+                    "pr_title": sentence(rng, 10),
+                    "pr_body": sentence(rng, rng.randint(50, 400)),
+                    "merge_commit_sha": f"{rng.getrandbits(160):040x}",
+                    "is_covered": True,
+                    "is_code_related": True,
+                    "successful": True,
+                    "build_system": rng.choice(["maven", "gradle"]),
+                    "reason_for_failure": "",
+                    "last_cmd_error_msg": sentence(rng, rng.randint(0, 800)),
+                    "selection": {"comment_suggests_change": True, "diff_after_address_change": True},
+                },
+                "comments": [
+                    {
+                        "body": sentence(rng, rng.randint(5, 40)),
+                        "file": f"src/main/java/{repo.split('/')[1]}/File{rng.randint(0, 50)}.java",
+                        "from_": 10,
+                        "to": 20,
+                        "paraphrases": [sentence(rng, rng.randint(5, 40)) for _ in range(5)],
+                    }
+                ],
+            }
+        )
+    return {"entries": entries}
+
+
+def measure(label: str, load) -> None:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    ref_map = load()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:<10} entries: {len(ref_map):>7}  load: {elapsed:6.2f}s  "
+        f"resident: {current / 2**20:8.1f} MiB  peak: {peak / 2**20:8.1f} MiB"
+    )
+    del ref_map
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--entries", type=int, default=20000, help="number of synthetic entries")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = os.path.join(tmp_dir, "dataset.json")
+        compiled_path = os.path.join(tmp_dir, "dataset.bin")
+        with open(json_path, "w") as f:
+            json.dump(synthetic_dataset(args.entries), f)
+        compile_dataset(json_path, compiled_path)
+        print(f"dataset.json: {os.path.getsize(json_path) / 2**20:.1f} MiB")
+
+        measure("original", lambda: Dataset.from_json(json_path).build_reference_map())
+        measure("compact", lambda: Dataset.from_json(json_path).build_compact_reference_map())
+        measure("compiled", lambda: LazyReferenceMap(compiled_path))
@@ -166,6 +166,13 @@ socket.on("complete", (data) => {
     }
 });
 
+socket.on("failed", (data) => {
+    progressContainer.classList.add("hidden");
+    statusStatusEl.classList.remove("hidden");
+    statusStatusEl.style.color = "red";
+    statusStatusEl.textContent = `Evaluation failed: ${data.message}`;
+});
+
 socket.on("successful-upload", () => {
     uploadStatusEl.classList.remove("hidden");
     uploadStatusEl.style.color = "green";
@@ -1,78 +1,116 @@
 # routes/answers.py
-from typing import Callable
+from typing import BinaryIO, Callable
 from flask import Blueprint, request, jsonify, current_app, url_for
+from utils.build_handlers import DEPS_CACHE, REPO_CACHE, TEST_SELECTOR
 from utils.dataset import CommentGenSubmission
-from utils.errors import InvalidJsonFormatError
-from utils.process_data import evaluate_comments, evaluate_refinement
-from utils.observer import SocketObserver, Status, Subject
-import functools, json, os
-
-from utils.queue_manager import QueueManager
+from utils.errors import InvalidJsonFormatError, NotAJsonObjectError, ValueTooLargeError
+from utils.json_stream import HashingReader, iter_object_items
+from utils.process_data import (
+    COMMENT_CACHE,
+    REFINEMENT_CACHE,
+    comment_pool_stats,
+    evaluate_comments,
+    evaluate_refinement,
+)
+from utils.observer import PENDING_DIR, RESULTS, SocketObserver, Status, Subject
+from utils.spool import SpooledSubmission
+import functools, os
+
+from utils.queue_manager import QueueManager, parse_lanes
 
 router = Blueprint('answers', __name__, url_prefix='/answers')
 
 ALLOWED_EXT = {'json'}
 
 
-def validate_json_format_for_comment_gen(data: str) -> dict[str, CommentGenSubmission]:
+def validate_json_format_for_comment_gen(stream: BinaryIO) -> SpooledSubmission:
+    spool = SpooledSubmission(CommentGenSubmission.json_parse, dir=PENDING_DIR)
     try:
-        obj = json.loads(data)
-        ret = {}
-        if not isinstance(obj, dict):
-            raise InvalidJsonFormatError("Submitted json doesn't contain an object")
-
-        for id, submission in obj.items():
+        for id, submission in iter_object_items(stream):
             if not isinstance(id, str):
                 raise InvalidJsonFormatError("The id of a particular submission must be a string")
             if not isinstance(submission, dict):
                 raise InvalidJsonFormatError(
                     "A particular submission must be a dictionary of type {'path' -> str, 'line_from' -> int, 'line_to' -> int, 'body' -> str}"
                 )
-            ret[id] = CommentGenSubmission.json_parse(submission)
-        return ret
+            CommentGenSubmission.json_parse(submission)
+            spool.append(id, submission)
+        return spool
     except InvalidJsonFormatError as e:
+        spool.close()
         raise e
+    except (NotAJsonObjectError, ValueTooLargeError) as e:
+        spool.close()
+        raise InvalidJsonFormatError(str(e))
     except Exception:
+        spool.close()
         raise InvalidJsonFormatError()
 
 
-def validate_json_format_for_code_refinement(data: str) -> dict[str, dict[str, str]]:
+def validate_json_format_for_code_refinement(stream: BinaryIO) -> SpooledSubmission:
+    spool = SpooledSubmission(dir=PENDING_DIR)
     try:
-        obj = json.loads(data)
-        if not isinstance(obj, dict):
-            raise InvalidJsonFormatError("Submitted json doesn't contain an object")
-
-        for _, submission in obj.items():
+        for id, submission in iter_object_items(stream):
             if not all(isinstance(content, str) for content in submission.values()):
                 raise InvalidJsonFormatError(
                     "Submitted json object must be str -> {str -> str}. Namely id -> {filename -> content of file}"
                 )
-        return obj
+            spool.append(id, submission)
+        return spool
 
     except InvalidJsonFormatError as e:
+        spool.close()
         raise e
+    except (NotAJsonObjectError, ValueTooLargeError) as e:
+        spool.close()
+        raise InvalidJsonFormatError(str(e))
     except Exception:
+        spool.close()
         raise InvalidJsonFormatError()
 
 
-QUEUE_MANAGER = QueueManager(int(os.environ["MAX_WORKERS"]))
+QUEUE_MANAGER = QueueManager(parse_lanes(os.environ["QUEUE_LANES"]), int(os.environ["MAX_WORKERS"]))
+
+# type of submission -> (its evaluation, the decoding of its spooled entries)
+TASKS = {
+    "comment": (evaluate_comments, CommentGenSubmission.json_parse),
+    "refinement": (evaluate_refinement, lambda x: x),
+}
+
+
+def resume_interrupted():
+    """Queues again the submissions that were waiting or processing when the server stopped"""
+    for subject in Subject.interrupted:
+        task, decode = TASKS[subject.type]
+        subject.task = task
+        payload = SpooledSubmission.reopen(subject.payload_path(), decode)
+        print(f"[INFO] Resuming {subject.id} ({len(subject.done_entries())}/{len(payload)} entries done)")
+        QUEUE_MANAGER.submit(subject, payload, cost=max(1, len(payload) - len(subject.done_entries())))
+    Subject.interrupted.clear()
 
 
 def handler(type_: str, validate_json: Callable, evaluate_submission: Callable):
     file = request.files.get('file')
     if file is None or file.filename is None or file.filename.split('.')[-1] not in ALLOWED_EXT:
         return jsonify({'error': 'Only JSON files are allowed'}), 400
-    data = file.read().decode()
+    # the upload is parsed and validated while it's read, one entry at a time
+    stream = HashingReader(file.stream)
     try:
-        validated = validate_json(data)
+        validated = validate_json(stream)
     except InvalidJsonFormatError as e:
         return jsonify({'error': 'Invalid JSON format', 'message': str(e)}), 400
 
-    subject = Subject(type_, evaluate_submission)
+    # the exact same file was already submitted: reuse its evaluation
+    subject, created = Subject.get_or_create(type_, evaluate_submission, stream.hexdigest())
     process_id = subject.id
-    Subject.id2subject[process_id] = subject
 
-    QUEUE_MANAGER.submit(subject, validated)
+    if created:
+        subject.keep(validated)   # resumed after a restart until it's complete
+        # the clients share the lane of the submission fairly, by number of entries
+        client = request.access_route[0] if request.access_route else (request.remote_addr or "")
+        QUEUE_MANAGER.submit(subject, validated, client=client, cost=max(1, len(validated)))
+    else:
+        validated.close()
     url = url_for(f".status", id=process_id, _external=True)
     return jsonify(
         {
@@ -95,6 +133,26 @@ def submit_comments(task):
     return handler(task, validator, evaluator)
 
 
+@router.route('/cache')
+def cache_stats():
+    return jsonify(
+        {
+            "comment": COMMENT_CACHE.stats(),
+            "refinement": REFINEMENT_CACHE.stats(),
+            "comment_pool": comment_pool_stats(),
+            "repos": REPO_CACHE.stats(),
+            "deps": DEPS_CACHE.stats(),
+            "test_selection": TEST_SELECTOR.stats(),
+            "results": RESULTS.stats(),
+        }
+    )
+
+
+@router.route('/queue')
+def queue_stats():
+    return jsonify(QUEUE_MANAGER.stats())
+
+
 @router.route('/status/<id>')
 def status(id):
     if id not in Subject.id2subject:
@@ -108,6 +166,9 @@ def status(id):
         else:
             return jsonify({"status": "complete", "type": subject.type, "results": subject.results})
 
+    if subject.status == Status.FAILED:
+        return jsonify({"status": "failed", "error": "Evaluation failed", "message": subject.error}), 500
+
     socketio = current_app.extensions['socketio']
     sid = request.headers.get('X-Socket-Id')
     socket_emit = functools.partial(socketio.emit, to=sid)
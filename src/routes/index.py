@@ -1,5 +1,8 @@
 # routes/index.py
-from flask import Blueprint, jsonify, current_app
+from flask import Blueprint, jsonify, current_app, request
+from utils.build_handlers import CONTAINER_POOL, JANITOR
+from utils.process_data import BROKER_CLIENT, BUILD_SLOTS, REFERENCES
+import hmac, os
 
 
 router = Blueprint('index', __name__)
@@ -13,3 +16,48 @@ def welcome():
 @router.route('/api/hello')
 def hello():
     return jsonify({'message': 'Hello from the backend!'})
+
+
+@router.route('/api/health')
+def health():
+    # not ready until the reference dataset is loaded, so that no traffic is routed here before
+    status = REFERENCES.status()
+    if not status["ready"]:
+        return jsonify({"status": "loading", "dataset": status}), 503
+    return jsonify({"status": "ready", "dataset": status})
+
+
+@router.route('/api/reload', methods=['POST'])
+def reload_dataset():
+    token = os.environ["ADMIN_TOKEN"]
+    if not token or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+        return jsonify({"error": "forbidden", "message": "Invalid or missing admin token"}), 403
+
+    started = REFERENCES.reload_async()
+    return (
+        jsonify(
+            {
+                "reloading": started,
+                "message": "Reload started" if started else "A reload is already in progress",
+                "dataset": REFERENCES.status(),
+            }
+        ),
+        202,
+    )
+
+
+@router.route('/api/containers')
+def containers():
+    return jsonify({**CONTAINER_POOL.stats(), "janitor": JANITOR.stats()})
+
+
+@router.route('/api/builds')
+def builds():
+    return jsonify(BUILD_SLOTS.stats())
+
+
+@router.route('/api/broker')
+def broker():
+    if BROKER_CLIENT is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **BROKER_CLIENT.stats()})
@@ -0,0 +1,288 @@
+"""
+Broker between the web process, which schedules the builds of the refinement
+entries and aggregates their outcomes, and the build workers (see
+build_worker), which run them, possibly on other machines.
+
+A job is queued, claimed by a worker, which reports its progress (steps done
+and lines of build output) and heartbeats while it runs, then finished with
+its result. A job whose worker stopped heartbeating is queued again.
+"""
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from dataclasses import asdict
+import json, os, sqlite3, sys, threading, time, uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.build_jobs import BuildJob
+
+LEASE_TIMEOUT = 120   # seconds without heartbeat after which a running job is queued again
+MAX_ATTEMPTS = 3   # claims of a job before it's failed (it may be what kills the workers)
+
+
+class Broker(ABC):
+    @abstractmethod
+    def submit(self, job: BuildJob) -> str:
+        """Queues the job, returns its id"""
+        ...
+
+    @abstractmethod
+    def claim(self, worker: str) -> Optional[Tuple[str, BuildJob]]:
+        """The oldest queued job (id, job), now running on `worker`, None if there's none"""
+        ...
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        """False if the job isn't running on `worker` anymore (it was queued again)"""
+        ...
+
+    @abstractmethod
+    def report(self, job_id: str, steps: int = 0, lines: Optional[List[str]] = None) -> None:
+        """Adds `steps` done and `lines` of build output to the progress of the job"""
+        ...
+
+    @abstractmethod
+    def finish(self, job_id: str, worker: str, result: Optional[dict], error: Optional[str] = None) -> None:
+        """Ignored if the job isn't running on `worker` anymore"""
+        ...
+
+    @abstractmethod
+    def poll(self, job_ids: List[str], after_seq: int) -> Tuple[Dict[str, dict], List[Tuple[int, str, int, List[str]]]]:
+        """
+        The state of the jobs ({"state", "result", "error"}) and the reports
+        (seq, job id, steps, lines) made after `after_seq`
+        """
+        ...
+
+    @abstractmethod
+    def forget(self, job_ids: List[str]) -> None:
+        """Removes finished jobs and their reports"""
+        ...
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+
+class SqliteBroker(Broker):
+    """
+    Broker in a sqlite database, for the web process and the workers of the
+    same machine (or sharing a filesystem with working locks, which network
+    filesystems often don't have)
+    """
+
+    def __init__(self, path: str) -> None:
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.local = threading.local()   # a connection per thread
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, job TEXT NOT NULL, state TEXT NOT NULL,"
+            " worker TEXT, attempts INTEGER NOT NULL DEFAULT 0, submitted_at REAL NOT NULL,"
+            " heartbeat_at REAL, result TEXT, error TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, submitted_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS reports (seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL,"
+            " steps INTEGER NOT NULL, lines TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS reports_job ON reports (job_id)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # autocommit, the transactions that need to be are explicit
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.conn = conn
+        return conn
+
+    def submit(self, job: BuildJob) -> str:
+        job_id = uuid.uuid4().hex
+        self._conn().execute(
+            "INSERT INTO jobs (id, job, state, submitted_at) VALUES (?, ?, 'queued', ?)",
+            (job_id, json.dumps(asdict(job)), time.time()),
+        )
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Tuple[str, BuildJob]]:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # the jobs of the workers that are gone
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', error = 'Its workers kept dying' "
+                "WHERE state = 'running' AND heartbeat_at < ? AND attempts >= ?",
+                (now - LEASE_TIMEOUT, MAX_ATTEMPTS),
+            )
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', worker = NULL WHERE state = 'running' AND heartbeat_at < ?",
+                (now - LEASE_TIMEOUT,),
+            )
+            row = conn.execute(
+                "SELECT id, job FROM jobs WHERE state = 'queued' ORDER BY submitted_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, heartbeat_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, now, row[0]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row[0], BuildJob(**json.loads(row[1]))
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        cursor = self._conn().execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND state = 'running' AND worker = ?",
+            (time.time(), job_id, worker),
+        )
+        return cursor.rowcount > 0
+
+    def report(self, job_id: str, steps: int = 0, lines: Optional[List[str]] = None) -> None:
+        self._conn().execute(
+            "INSERT INTO reports (job_id, steps, lines) VALUES (?, ?, ?)",
+            (job_id, steps, json.dumps(lines or [])),
+        )
+
+    def finish(self, job_id: str, worker: str, result: Optional[dict], error: Optional[str] = None) -> None:
+        self._conn().execute(
+            "UPDATE jobs SET state = ?, result = ?, error = ? WHERE id = ? AND state = 'running' AND worker = ?",
+            ("failed" if error is not None else "done", json.dumps(result), error, job_id, worker),
+        )
+
+    def poll(self, job_ids: List[str], after_seq: int) -> Tuple[Dict[str, dict], List[Tuple[int, str, int, List[str]]]]:
+        conn = self._conn()
+        states = {}
+        reports = []
+        for i in range(0, len(job_ids), 500):   # under the limit of sqlite variables
+            chunk = job_ids[i : i + 500]
+            marks = ",".join("?" * len(chunk))
+            for job_id, state, result, error in conn.execute(
+                f"SELECT id, state, result, error FROM jobs WHERE id IN ({marks})", chunk
+            ):
+                states[job_id] = {
+                    "state": state,
+                    "result": json.loads(result) if result is not None else None,
+                    "error": error,
+                }
+            for seq, job_id, steps, lines in conn.execute(
+                f"SELECT seq, job_id, steps, lines FROM reports WHERE seq > ? AND job_id IN ({marks})",
+                [after_seq, *chunk],
+            ):
+                reports.append((seq, job_id, steps, json.loads(lines)))
+        reports.sort()
+        return states, reports
+
+    def forget(self, job_ids: List[str]) -> None:
+        conn = self._conn()
+        for i in range(0, len(job_ids), 500):
+            chunk = job_ids[i : i + 500]
+            marks = ",".join("?" * len(chunk))
+            conn.execute(f"DELETE FROM reports WHERE job_id IN ({marks})", chunk)
+            conn.execute(f"DELETE FROM jobs WHERE id IN ({marks})", chunk)
+
+    def stats(self) -> dict:
+        counts = dict(self._conn().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        workers = self._conn().execute(
+            "SELECT COUNT(DISTINCT worker) FROM jobs WHERE state = 'running'"
+        ).fetchone()[0]
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "busy_workers": workers,
+        }
+
+
+def make_broker(url: str) -> Broker:
+    """The broker at `url`, e.g. sqlite:///var/lib/crab/broker.sqlite"""
+    scheme, sep, location = url.partition("://")
+    if sep and scheme == "sqlite":
+        return SqliteBroker(location)
+    raise ValueError(f"Unknown build broker {url!r}, expected sqlite://<path>")
+
+
+class BrokerClient:
+    """
+    Web process side of the broker: submits the jobs and polls their
+    progress, passed to the callbacks given with each job, and outcome
+    """
+
+    def __init__(self, broker: Broker, poll_interval: float = 0.5) -> None:
+        self.broker = broker
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        # job id -> (future, steps_cb, log_cb)
+        self.jobs: Dict[str, Tuple[Future, Callable[[int], None], Callable[[List[str]], None]]] = {}
+        self.last_seq = 0
+        self.poller: Optional[threading.Thread] = None
+
+    def submit(
+        self,
+        job: BuildJob,
+        steps_cb: Callable[[int], None] = lambda _: None,
+        log_cb: Callable[[List[str]], None] = lambda _: None,
+    ) -> Future:
+        """A future of the result of the job (None if it couldn't be evaluated)"""
+        future: Future = Future()
+        job_id = self.broker.submit(job)
+        with self.lock:
+            self.jobs[job_id] = (future, steps_cb, log_cb)
+            if self.poller is None:
+                self.poller = threading.Thread(target=self._poll, daemon=True)
+                self.poller.start()
+        return future
+
+    def _poll(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            with self.lock:
+                job_ids = list(self.jobs)
+            if not job_ids:
+                continue
+            try:
+                states, reports = self.broker.poll(job_ids, self.last_seq)
+            except Exception as e:
+                print(f"[WARNING] Couldn't poll the build broker {type(e)}: {e}", file=sys.stderr)
+                continue
+            for seq, job_id, steps, lines in reports:
+                self.last_seq = max(self.last_seq, seq)
+                with self.lock:
+                    job = self.jobs.get(job_id)
+                if job is None:
+                    continue   # a report of a job that isn't ours (anymore)
+                _, steps_cb, log_cb = job
+                # a failing callback mustn't stop the poller: the futures would never resolve
+                try:
+                    if steps:
+                        steps_cb(steps)
+                    if lines:
+                        log_cb(lines)
+                except Exception as e:
+                    print(
+                        f"[WARNING] Couldn't report the progress of build job {job_id} {type(e)}: {e}", file=sys.stderr
+                    )
+
+            finished = [job_id for job_id, state in states.items() if state["state"] in ("done", "failed")]
+            for job_id in finished:
+                with self.lock:
+                    future, _, _ = self.jobs.pop(job_id)
+                state = states[job_id]
+                if state["error"] is not None:
+                    print(f"[ERROR] Build job {job_id} failed: {state['error']}", file=sys.stderr)
+                future.set_result(state["result"])
+            if finished:
+                try:
+                    self.broker.forget(finished)
+                except Exception as e:
+                    print(f"[WARNING] Couldn't forget the finished build jobs {type(e)}: {e}", file=sys.stderr)
+
+    def stats(self) -> dict:
+        with self.lock:
+            pending = len(self.jobs)
+        return {"pending": pending, **self.broker.stats()}
@@ -1,12 +1,20 @@
 from abc import ABC, abstractmethod
-import os, re, docker, signal, javalang, time
-from bs4 import BeautifulSoup
-from typing import Iterable, Optional, Tuple, Iterator
-import xml.etree.ElementTree as ET
-from javalang.tree import PackageDeclaration
+import os, re, sys, docker, javalang, threading, time
+from typing import Callable, Iterable, Optional, Tuple, Iterator
 import tarfile
 import tempfile
-from shutil import rmtree
+import uuid
+from shutil import move
+from docker.errors import APIError
+from utils.build_limits import BuildTimeouts
+from utils.build_log import BuildOutput, LineBatcher, LogCleaner
+from utils.coverage_index import line_coverage, package_of
+from utils.container_pool import CONTAINER_REPO_PATH, ContainerPool, Lease
+from utils.deps_cache import DepsCache
+from utils.janitor import Janitor, owned_prefix
+from utils.repo_cache import RepoCache, detach_file
+from utils.test_selection import TestSelector
+from utils.test_results import TestClassResult, collect_results, totals
 
 REPORT_SIZE_THRESHOLD = 400   # less than 400 bytes (charcaters), we don't care about it
 
@@ -14,73 +22,244 @@ REPORT_SIZE_THRESHOLD = 400   # less than 400 bytes (charcaters), we don't care
 USER_ID = os.getuid()   # for container user
 GROUP_ID = os.getgid()
 
+# the repos are extracted there, and the working directories of the build containers live there
+WORKSPACE_ROOT = os.path.abspath(os.environ["WORKSPACE_ROOT"])
+
+# only the end of a build output is kept in memory (and in the error messages), the whole
+# (cleaned) output is written in a gzip file in BUILD_LOGS_DIR if it's set
+BUILD_LOG_TAIL_LINES = int(os.environ["BUILD_LOG_TAIL_LINES"])
+BUILD_LOGS_DIR = os.environ["BUILD_LOGS_DIR"]
+
+# build each archive once unmodified and compile the entries incrementally on top of it
+BASELINE_BUILDS = os.environ["BASELINE_BUILDS"].lower() in ("1", "true", "yes")
+
+# nothing is built, the build handler just waits (see MockBuildHander)
+MOCK_BUILD_HANDLER = os.environ["MOCK_BUILD_HANDLER"].lower() in ("1", "true", "yes")
+
+
+def get_docker_client() -> docker.DockerClient:
+    if BuildHandler.DOCKER_CLIENT is None:
+        BuildHandler.DOCKER_CLIENT = docker.from_env()
+    return BuildHandler.DOCKER_CLIENT
+
 
 class BuildHandler(ABC):
     DOCKER_CLIENT: Optional[docker.DockerClient] = None
 
-    def __init__(self, repo_path: str, build_file: str, updates: dict) -> None:
+    # in the output of a build that failed because it was offline and missed a dependency
+    OFFLINE_MISS = "offline mode"
+    # in the output of a test run that failed because a module had none of the selected tests
+    NO_MATCHING_TESTS: Optional[str] = None
+    # the lines of the test output `extract_test_numbers_from_output` needs (the rest isn't kept)
+    TEST_SUMMARY: Optional[re.Pattern] = None
+    TEST_SUMMARY_LINES = 1
+
+    def __init__(
+        self, repo_path: str, build_file: str, updates: Optional[dict] = None, archive: Optional[str] = None
+    ) -> None:
         super().__init__()
         self.path: str = os.path.abspath(repo_path)
         self.build_file: str = build_file
-        self.updates = updates
+        self.updates = updates if updates is not None else {}
+        # test class -> its results, from the last test run
+        self.test_classes: dict[str, TestClassResult] = {}
+        self.archive_path = archive   # where the repo comes from
+        self.archive = os.path.basename(archive) if archive is not None else None
+        self.changed_files: list[str] = []
+        self.timeouts = BUILD_TIMEOUTS.for_archive(self.archive)
+        # receives the lines of the build output as they come, in batches
+        self.log_cb: Optional[Callable[[list[str]], None]] = None
+        # once the dependencies of the archive are in the cache, builds don't need the network
+        self.offline = DEPS_CACHE.is_warmed(archive)
+        self.fell_back_online = False
+        # the outputs of the baseline build are in the repo: compile incrementally
+        self.has_baseline = False
 
     def __enter__(self):
-        if BuildHandler.DOCKER_CLIENT is None:
-            BuildHandler.DOCKER_CLIENT = docker.from_env()
-        self.container = BuildHandler.DOCKER_CLIENT.containers.run(
-            image=self.container_name(),
-            command="tail -f /dev/null",  # to keep the container alive
-            volumes={os.path.abspath(self.path): {"bind": "/repo", "mode": "rw"}},
-            user=f"{USER_ID}:{GROUP_ID}",
-            detach=True,
-            tty=True,
-        )
+        DEPS_CACHE.acquire()
+        lease: Optional[Lease] = None
+        try:
+            lease = CONTAINER_POOL.lease(self.container_name())
+            # the repo goes in the working directory of the container (a rename,
+            # they are on the same filesystem)
+            move(self.path, lease.repo_path)
+        except BaseException:
+            # __exit__ won't be called: nothing may stay acquired (an eviction of
+            # the dependency cache would wait for this build forever)
+            if lease is not None:
+                JANITOR.remove_tree(lease.repo_path)   # what was moved of the repo
+                CONTAINER_POOL.release(lease)
+            DEPS_CACHE.release(self.offline)
+            self.discard()
+            raise
+        self.lease: Lease = lease
+        self.container = lease.container
+        self.path = lease.repo_path
 
     def __exit__(self, *args):
-        self.container.kill()
-        self.container.remove()
-        rmtree(self.path)
+        # the working directory is emptied right away, so the container can be reused
+        JANITOR.remove_tree(self.path)
+        CONTAINER_POOL.release(self.lease)
+        DEPS_CACHE.release(self.offline, self.fell_back_online)
+
+    def discard(self) -> None:
+        """Removes the repo of a handler that won't be used (i.e. entered)"""
+        JANITOR.remove_tree(self.path)
+
+    def deadline(self, step: str) -> float:
+        """When `step` (one of build_limits.STEPS) started now must be done"""
+        return time.time() + self.timeouts[step]
+
+    def _log_path(self) -> Optional[str]:
+        if not BUILD_LOGS_DIR:
+            return None
+        os.makedirs(BUILD_LOGS_DIR, exist_ok=True)
+        stem = (self.archive or "repo").removesuffix(".tar.gz")
+        name = f"{stem}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.log.gz"
+        return os.path.join(BUILD_LOGS_DIR, name)
+
+    def exec(self, cmd: str, deadline: Optional[float] = None) -> BuildOutput:
+        """
+        Runs `cmd` in the container, its output is cleaned as it's streamed
+        (see LogCleaner). If it's still running at `deadline`, the container is
+        killed (an exec can't be) and BuildTimeoutError is raised; the pool then
+        replaces the container.
+        """
+        api = get_docker_client().api
+        exec_id = api.exec_create(self.container.id, cmd, workdir=CONTAINER_REPO_PATH)["Id"]
+        batcher = LineBatcher(self.log_cb) if self.log_cb is not None else None
+        cleaner = LogCleaner(
+            BUILD_LOG_TAIL_LINES,
+            markers=[marker for marker in (self.OFFLINE_MISS, self.NO_MATCHING_TESTS) if marker],
+            line_cb=batcher,
+            spool_path=self._log_path(),
+            summary_pattern=self.TEST_SUMMARY,
+            summary_window=self.TEST_SUMMARY_LINES,
+        )
+        cleaner.feed(f"[CRAB] $ {cmd}\n".encode())
+
+        timed_out = threading.Event()
+        watchdog = None
+        if deadline is not None:
+
+            def kill():
+                timed_out.set()
+                try:
+                    self.container.kill()
+                except APIError:
+                    pass   # already stopped
+
+            watchdog = threading.Timer(max(0.0, deadline - time.time()), kill)
+            watchdog.daemon = True
+            watchdog.start()
 
-    def compile_repo(self) -> None:
         try:
-            exec_result = self.container.exec_run(self.compile_cmd())
-            output = clean_output(exec_result.output)
-            if exec_result.exit_code != 0:
-                raise FailedToCompileError(output)
-        except TimeoutError:
-            self.updates["compiled_successfully"] = False
-            self.updates[
-                "error_msg"
-            ] = "Compile process killed due to exceeding the 1-hour time limit"
+            for chunk in api.exec_start(exec_id, stream=True):
+                cleaner.feed(chunk)
+        except Exception:
+            if not timed_out.is_set():
+                raise   # otherwise, the stream was cut by the kill
         finally:
-            signal.alarm(0)  # Cancel the alarm
+            if watchdog is not None:
+                watchdog.cancel()
+            cleaner.close()
+            if batcher is not None:
+                batcher.flush()
+
+        output = BuildOutput(
+            exit_code=-1,
+            tail=cleaner.text(),
+            found=cleaner.found,
+            summary="\n".join(cleaner.summary),
+            log_path=cleaner.spool_path,
+        )
+        if timed_out.is_set():
+            raise BuildTimeoutError(
+                f"`{cmd}` killed after exceeding its time limit, last output:\n{output.error_msg()}"
+            )
+        output.exit_code = api.exec_inspect(exec_id)["ExitCode"]
+        return output
 
-    def test_repo(self) -> None:
-        try:
-            exec_result = self.container.exec_run(self.test_cmd())
-            output = clean_output(exec_result.output)
-            if exec_result.exit_code != 0:
-                raise FailedToTestError(output)
+    def exec_build(self, get_cmd: Callable[[], str], deadline: Optional[float] = None) -> BuildOutput:
+        """
+        Runs a build command (`get_cmd` builds it, it depends on `self.offline`),
+        again online if it failed offline because of a dependency missing from the cache
+        """
+        result = self.exec(get_cmd(), deadline)
+        if result.exit_code != 0 and self.offline and self.OFFLINE_MISS in result.found:
+            print(f"[WARNING] {self.archive} is missing dependencies in the cache, building online")
+            self.offline = False
+            self.fell_back_online = True
+            DEPS_CACHE.unmark_warmed(self.archive)
+            result = self.exec(get_cmd(), deadline)
+        return result
+
+    def warm_deps(self) -> None:
+        """Downloads the dependencies of the repo in the cache, then marks the archive as warmed"""
+        self.offline = False
+        result = self.exec(self.warm_deps_cmd(), self.deadline("compile"))
+        if result.exit_code != 0:
+            raise FailedToWarmDepsError(result.error_msg())
+        DEPS_CACHE.mark_warmed(self.archive, self.get_type())
 
-            self.extract_test_numbers(output)
+    def build_baseline(self) -> bool:
+        """Builds the (unmodified) repo, to reuse its outputs in incremental builds"""
+        return self.exec_build(self.baseline_cmd, self.deadline("compile")).exit_code == 0
 
-        except TimeoutError:
-            self.updates["tested_successfully"] = False
-            self.updates["error_msg"] = "Test process killed due to exceeding the 1-hour time limit"
-            return
+    def compile_repo(self) -> None:
+        deadline = self.deadline("compile")
+        exec_result = self.exec_build(self.compile_cmd, deadline)
+        if exec_result.exit_code != 0 and self.has_baseline:
+            # might be an artifact of the incremental build, a clean build decides
+            print(f"[WARNING] Incremental compilation of {self.archive} failed, compiling from scratch")
+            self.has_baseline = False
+            exec_result = self.exec_build(self.compile_cmd, deadline)
+        if exec_result.exit_code != 0:
+            raise FailedToCompileError(exec_result.error_msg())
+
+    def _run_tests(self, tests: Optional[list[str]], deadline: float) -> BuildOutput:
+        start = time.time()
+        exec_result = self.exec_build(lambda: self.test_cmd(tests), deadline)
+        TEST_SELECTOR.record_run(tests is not None, time.time() - start)
+        return exec_result
 
-        finally:
-            signal.alarm(0)  # Cancel the alarm
+    def test_repo(self) -> None:
+        deadline = self.deadline("test")
+        # the reports older than that aren't from this run (with some slack for the mtime resolution)
+        since = time.time() - 1
+        # only the test classes affected by the injected changes, if test selection is on
+        tests = TEST_SELECTOR.select(self.archive_path, self.path, self.changed_files)
+        if tests is not None:
+            exec_result = self._run_tests(tests, deadline)
+            if self.NO_MATCHING_TESTS is not None and self.NO_MATCHING_TESTS in exec_result.found:
+                tests = None
+            elif TEST_SELECTOR.mode == "verify":
+                # the full run gets its own budget, it's what the selected run is compared to
+                full_result = self._run_tests(None, self.deadline("test"))
+                TEST_SELECTOR.record_verification(
+                    self.archive, tests, exec_result.exit_code == 0, full_result.exit_code == 0
+                )
+                exec_result = full_result   # the full run decides
+        if tests is None:
+            exec_result = self._run_tests(None, deadline)
+        if exec_result.exit_code != 0:
+            raise FailedToTestError(exec_result.error_msg())
+        if not self.offline:
+            # compiled and tested online: everything needed was downloaded
+            DEPS_CACHE.mark_warmed(self.archive, self.get_type())
+
+        self.extract_test_numbers(exec_result.summary, since)
 
     def generate_coverage_report(self, already_injected_manually: bool = False):
-        result = self.container.exec_run(self.generate_coverage_report_cmd())
+        result = self.exec(self.generate_coverage_report_cmd(), self.deadline("test"))
         if result.exit_code != 0:
             if already_injected_manually:
-                raise CantExecJacoco(clean_output(result.output))
+                raise CantExecJacoco(result.error_msg())
 
             build_file_path = os.path.join(self.path, self.build_file)
             if not os.path.exists(build_file_path):
                 raise CantInjectJacoco("pom.xml not found")
+            detach_file(build_file_path)   # it may be shared with the repo cache
             with open(build_file_path, "r") as f:
                 og_content = f.read()
             try:
@@ -101,13 +280,15 @@ class BuildHandler(ABC):
         """
         found_at_least_one = False
         candidates = []
+        fully_qualified_class = None
         for coverage_report_path in self.get_jacoco_report_paths():
             if not os.path.exists(coverage_report_path):
                 raise NoCoverageReportFound(
                     f"Coverage report file '{coverage_report_path}' does not exist"
                 )
 
-            fully_qualified_class = self._extract_fully_qualified_class(filename)
+            if fully_qualified_class is None:
+                fully_qualified_class = self._extract_fully_qualified_class(filename)
             candidates.append({"report_file": coverage_report_path, "fqc": fully_qualified_class})
             # if coverage_report_path[:len(src_dir)] != src_dir:
             #     continue
@@ -130,33 +311,28 @@ class BuildHandler(ABC):
         if not os.path.exists(os.path.join(self.path, filepath)):
             raise FileNotFoundInRepoError(f"File '{filepath}' not found in repo")
 
-        with open(os.path.join(self.path, filepath)) as f:
-            try:
-                parsed_tree = javalang.parse.parse(f.read())
-            except javalang.parser.JavaSyntaxError as e:
-                raise NotJavaFileError(
-                    f"File '{filepath}' has a syntax error and could not be parsed by javalang, raised error: '{e}'"
-                )
-
-            package_name = None
-            for _, node in parsed_tree.filter(PackageDeclaration):
-                package_name = node.name   # type: ignore
-                break  # Stop after finding the first package declaration
+        try:
+            package_name = package_of(os.path.join(self.path, filepath))
+        except javalang.tokenizer.LexerError as e:
+            raise NotJavaFileError(
+                f"File '{filepath}' could not be tokenized by javalang, raised error: '{e}'"
+            )
 
-            if package_name is None:
-                raise NoPackageFoundError(
-                    f"File '{filepath}' did not have a packaged name recognized by javalang"
-                )
+        if package_name is None:
+            raise NoPackageFoundError(
+                f"File '{filepath}' did not have a packaged name recognized by javalang"
+            )
 
-            fully_qualified_class = package_name.replace('.', '/')
-            # src_dir = filepath[:filepath.index(fully_qualified_class)]
-            fully_qualified_class += "/" + os.path.basename(filepath)[:-5]   # -5 to remove '.java'
-            return fully_qualified_class
+        fully_qualified_class = package_name.replace('.', '/')
+        # src_dir = filepath[:filepath.index(fully_qualified_class)]
+        fully_qualified_class += "/" + os.path.basename(filepath)[:-5]   # -5 to remove '.java'
+        return fully_qualified_class
 
     def clean_repo(self) -> None:
-        self.container.exec_run(self.clean_cmd())
+        self.exec(self.clean_cmd(), self.deadline("compile"))
 
     def inject_changes(self, changes: dict[str, str]):
+        self.changed_files = list(changes)
         for file_path, change in changes.items():
             full_path = os.path.abspath(os.path.join(self.path, file_path))
             assert (
@@ -168,6 +344,7 @@ class BuildHandler(ABC):
             if not os.path.exists(dirname):
                 print(f"[INFO] Creating directory {dirname}")
                 os.makedirs(dirname)
+            detach_file(full_path)   # it may be shared with the repo cache
             with open(full_path, "w") as f:
                 f.write(change)
 
@@ -180,15 +357,36 @@ class BuildHandler(ABC):
         pass
 
     @abstractmethod
-    def test_cmd(self) -> str:
+    def test_cmd(self, tests: Optional[list[str]] = None) -> str:
+        """Runs all the tests, or only the given (fully qualified) test classes"""
         pass
 
+    def extract_test_numbers(self, output: str, since: Optional[float] = None) -> None:
+        """
+        Sets the n_tests* updates and `test_classes` from the JUnit XML reports
+        (written after `since`) of all the modules, or from the test output if
+        there's none
+        """
+        self.test_classes = collect_results(self.path, since)
+        if not self.test_classes:
+            self.extract_test_numbers_from_output(output)
+            return
+        self.updates.update(totals(self.test_classes))
+
+    def extract_test_numbers_from_output(self, output: str) -> None:
+        """`output` is made of the groups of lines of the test output that matched TEST_SUMMARY"""
+        raise NoTestResultsToExtractError("No JUnit XML test reports found")
+
     @abstractmethod
-    def extract_test_numbers(self, output: str) -> None:
+    def clean_cmd(self) -> str:
         pass
 
     @abstractmethod
-    def clean_cmd(self) -> str:
+    def warm_deps_cmd(self) -> str:
+        pass
+
+    @abstractmethod
+    def baseline_cmd(self) -> str:
         pass
 
     @abstractmethod
@@ -205,32 +403,59 @@ class BuildHandler(ABC):
 
 
 class MavenHandler(BuildHandler):
-    def __init__(self, repo_path: str, build_file: str, updates: dict = {}) -> None:
-        super().__init__(repo_path, build_file, updates)
-        self.base_cmd = "mvn -B -Dstyle.color=never -Dartifact.download.skip=true"
+    def __init__(
+        self, repo_path: str, build_file: str, updates: Optional[dict] = None, archive: Optional[str] = None
+    ) -> None:
+        super().__init__(repo_path, build_file, updates, archive)
+
+    @property
+    def base_cmd(self) -> str:
+        cmd = (
+            "mvn -B -Dstyle.color=never -Dartifact.download.skip=true"
+            f" -Dmaven.repo.local={DepsCache.container_path('maven')}"
+        )
         # -B (Batch Mode): Runs Maven in non-interactive mode, reducing output and removing download progress bars.
         # -Dstyle.color=never: Disables ANSI colors.
         # -Dartifact.download.skip=true: Prevents Maven from printing download logs (but still downloads dependencies when needed).
+        # -Dmaven.repo.local: The local repository is the shared dependency cache.
+        return f"{cmd} -o" if self.offline else cmd
+
+    TEST_SUMMARY = re.compile(r"\[INFO\] Results:\n\[INFO\]\s*\n\[INFO\] Tests run: .*")
+    TEST_SUMMARY_LINES = 3
 
     def get_type(self) -> str:
         return "maven"
 
     def compile_cmd(self) -> str:
+        if self.has_baseline:
+            return f"{self.base_cmd} compile"
         return f"{self.base_cmd} clean compile"
 
-    def test_cmd(self) -> str:
+    def test_cmd(self, tests: Optional[list[str]] = None) -> str:
+        if tests:
+            # the modules with none of the tests mustn't fail
+            return (
+                f"{self.base_cmd} test -Dtest={','.join(tests)}"
+                " -Dsurefire.failIfNoSpecifiedTests=false -DfailIfNoTests=false"
+            )
         return f"{self.base_cmd} test"
 
     def clean_cmd(self) -> str:
         return f"{self.base_cmd} clean"
 
+    def warm_deps_cmd(self) -> str:
+        return f"{self.base_cmd} dependency:go-offline test -DskipTests"
+
+    def baseline_cmd(self) -> str:
+        return f"{self.base_cmd} clean test-compile"
+
     def generate_coverage_report_cmd(self):
         return f"{self.base_cmd} jacoco:report-aggregate"
 
     def container_name(self) -> str:
         return "crab-maven"
 
-    def extract_test_numbers(self, output: str) -> None:
+    def extract_test_numbers_from_output(self, output: str) -> None:
         pattern = r"\[INFO\] Results:\n\[INFO\]\s*\n\[INFO\] Tests run: (\d+), Failures: (\d+), Errors: (\d+), Skipped: (\d+)"
 
         matches = re.findall(pattern, output)
@@ -316,78 +541,47 @@ class MavenHandler(BuildHandler):
 
 
 class GradleHandler(BuildHandler):
-    def __init__(self, repo_path: str, build_file: str, updates: dict = {}) -> None:
-        super().__init__(repo_path, build_file, updates)
-        self.base_cmd = "gradle --no-daemon --console=plain"
+    # a subproject (or the project) without any of the selected tests
+    NO_MATCHING_TESTS = "No tests found for given includes"
+
+    def __init__(
+        self, repo_path: str, build_file: str, updates: Optional[dict] = None, archive: Optional[str] = None
+    ) -> None:
+        super().__init__(repo_path, build_file, updates, archive)
+
+    @property
+    def base_cmd(self) -> str:
+        cmd = f"gradle --no-daemon --console=plain --gradle-user-home {DepsCache.container_path('gradle')}"
+        return f"{cmd} --offline" if self.offline else cmd
 
     def get_type(self) -> str:
         return "gradle"
 
     def compile_cmd(self) -> str:
-        return f"{self.base_cmd} compileJava"
+        if self.has_baseline:
+            return f"{self.base_cmd} compileJava"
+        return f"{self.base_cmd} clean compileJava"
 
-    def test_cmd(self) -> str:
+    def test_cmd(self, tests: Optional[list[str]] = None) -> str:
+        if tests:
+            return f"{self.base_cmd} test " + " ".join(f"--tests {test}" for test in tests)
         return f"{self.base_cmd} test"
 
     def clean_cmd(self) -> str:
         return f"{self.base_cmd} clean"
 
+    def warm_deps_cmd(self) -> str:
+        return f"{self.base_cmd} testClasses"
+
+    def baseline_cmd(self) -> str:
+        return f"{self.base_cmd} clean testClasses"
+
     def generate_coverage_report_cmd(self) -> str:
         return f"{self.base_cmd} jacocoTestReport"
 
     def container_name(self) -> str:
         return "crab-gradle"
 
-    def extract_test_numbers(self, output: str) -> None:
-        self.updates["n_tests"] = -1
-        self.updates["n_tests_passed"] = -1
-        self.updates["n_tests_failed"] = -1
-        self.updates["n_tests_errors"] = -1
-        self.updates["n_tests_skipped"] = -1
-
-        test_results_path = os.path.join(self.path, "build/reports/tests/test/index.html")
-        if not os.path.exists(test_results_path):
-            raise NoTestResultsToExtractError(
-                "No test results found (prolly a repo with sub-projects)"
-            )
-
-        # Load the HTML file
-        with open(test_results_path, "r") as file:
-            soup = BeautifulSoup(file, "html.parser")
-
-            # test_div = soup.select_one("div", class_="infoBox", id="tests")
-            test_div = soup.select_one("div.infoBox#tests")
-            if test_div is None:
-                raise NoTestResultsToExtractError("No test results found (no div.infoBox#tests)")
-
-            # counter_div = test_div.find("div", class_="counter")
-            counter_div = test_div.select_one("div.counter")
-            if counter_div is None:
-                raise NoTestResultsToExtractError(
-                    "No test results found (not div.counter for tests)"
-                )
-
-            self.updates["n_tests"] = int(counter_div.text.strip())
-
-            # failures_div = soup.find("div", class_="infoBox", id="failures")
-            failures_div = soup.select_one("div.infoBox#failures")
-            if failures_div is None:
-                raise NoTestResultsToExtractError("No test results found (no div.infoBox#failures)")
-
-            # counter_div = failures_div.find("div", class_="counter")
-            counter_div = failures_div.select_one("div.counter")
-            if counter_div is None:
-                raise NoTestResultsToExtractError(
-                    "No test results found (not div.counter for failures)"
-                )
-
-            self.updates["n_tests_failed"] = int(counter_div.text.strip())
-
-            # Calculate passed tests
-            self.updates["n_tests_passed"] = (
-                self.updates["n_tests"] - self.updates["n_tests_failed"]
-            )
-
     def get_jacoco_report_paths(self) -> Iterable[str]:
         found_at_least_one = False
         for root, _, files in os.walk(os.path.join(self.path)):
@@ -468,6 +662,14 @@ class NoTestResultsToExtractError(HandlerException):
     reason_for_failure = "Failed to extract test results"
 
 
+class FailedToWarmDepsError(HandlerException):
+    reason_for_failure = "Failed to download the dependencies"
+
+
+class BuildTimeoutError(HandlerException):
+    reason_for_failure = "Killed for exceeding its time limit"
+
+
 class CantExecJacoco(HandlerException):
     reason_for_failure = "Couldn't execute jacoco"
 
@@ -500,88 +702,68 @@ class FileNotFoundInRepoError(HandlerException):
     reason_for_failure = "Commented file not found in repo (likely renamed or deleted)"
 
 
-def merge_download_lines(lines: list) -> list:
-    """
-    Merges lines that are part of the same download block in Maven output.
-
-    Args:
-        lines (list): The lines to merge.
-
-    Returns:
-        list: The merged lines.
-    """
-    downloading_block = False
-    cleaned_lines = []
-    for line in lines:
-        if re.match(r"\[INFO\] Download(ing|ed) from", line):
-            if not downloading_block:
-                cleaned_lines.append("[CRAB] Downloading stuff")
-                downloading_block = True
-        else:
-            cleaned_lines.append(line)
-            downloading_block = False
-    return cleaned_lines
-
-
-def merge_unapproved_licences(lines: list) -> list:
-    """
-    Merges lines that are part of the same unapproved licences block in Maven output.
-
-    Args:
-        lines (list): The lines to merge.
-
-    Returns:
-        list: The merged lines.
-    """
-    licenses_block = False
-    cleaned_lines = []
-    for line in lines:
-        if re.match(r"\[WARNING\] Files with unapproved licenses:", line):
-            cleaned_lines.append(line)
-            cleaned_lines.append("[CRAB] List of all the unapproved licenses...")
-            licenses_block = True
-        elif licenses_block and not re.match(r"\s+\?\/\.m2\/repository", line):
-            licenses_block = False
-
-        if not licenses_block:
-            cleaned_lines.append(line)
-    return cleaned_lines
-
-
 def clean_output(output: bytes) -> str:
-    output_lines = output.decode().split("\n")
-
-    cleaned_lines = merge_download_lines(output_lines)
-    cleaned_lines = merge_unapproved_licences(cleaned_lines)
-
-    return "\n".join(cleaned_lines)
+    """Cleans a whole build output at once (see LogCleaner)"""
+    cleaner = LogCleaner(tail_lines=None)
+    cleaner.feed(output)
+    cleaner.close()
+    return cleaner.text()
 
 
 def get_coverage_for_file(xml_file: str, target_fully_qualified_class: str, basename: str) -> float:
-    # Parse the XML file
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-
-    # Find coverage for the target file
-    for package in root.findall(".//package"):
-        for class_ in package.findall("class"):
-            if (
-                class_.get("sourcefilename") == basename
-                and class_.get("name") == target_fully_qualified_class
-            ):
-                # Extract line coverage data
-                line_counter = class_.find("counter[@type='LINE']")
-                if line_counter is not None:
-                    counter = line_counter.get("missed")
-                    assert isinstance(counter, str)
-                    missed = int(counter)
-                    counter = line_counter.get("covered")
-                    assert isinstance(counter, str)
-                    covered = int(counter)
-                    total = missed + covered
-                    coverage = (covered / total) * 100 if total > 0 else 0
-                    return coverage
-    return -1
+    """Line coverage (in %) of the class in the JaCoCo report, -1 if it isn't in it (see coverage_index)"""
+    return line_coverage(xml_file, target_fully_qualified_class, basename)
+
+
+REPO_CACHE = RepoCache(
+    os.path.abspath(os.environ["REPO_CACHE_DIR"]),
+    max_bytes=int(os.environ["REPO_CACHE_SIZE_MB"]) * 2**20,
+    strategy=os.environ["REPO_CACHE_STRATEGY"],
+)
+
+BUILD_TIMEOUTS = BuildTimeouts(
+    {"compile": float(os.environ["COMPILE_TIMEOUT"]), "test": float(os.environ["TEST_TIMEOUT"])},
+    os.environ["BUILD_TIMEOUTS_PATH"],
+)
+
+DEPS_CACHE = DepsCache(
+    os.path.abspath(os.environ["DEPS_CACHE_DIR"]),
+    max_bytes=int(os.environ["DEPS_CACHE_SIZE_MB"]) * 2**20,
+)
+
+TEST_SELECTOR = TestSelector(
+    os.environ["TEST_SELECTION"],
+    REPO_CACHE,
+    os.path.join(os.environ["CACHE_DIR"], "test_selection_verify.jsonl"),
+)
+
+
+def container_limits() -> dict:
+    """Arguments of `containers.run`: the user, and the CPU and memory quotas of a build container"""
+    kwargs: dict = {"user": f"{USER_ID}:{GROUP_ID}"}
+    cpus = float(os.environ["CONTAINER_CPUS"])
+    if cpus > 0:
+        kwargs["nano_cpus"] = int(cpus * 1e9)
+    if os.environ["CONTAINER_MEMORY"]:
+        kwargs["mem_limit"] = os.environ["CONTAINER_MEMORY"]
+        kwargs["memswap_limit"] = os.environ["CONTAINER_MEMORY"]   # no swap on top
+    return kwargs
+
+
+JANITOR = Janitor(WORKSPACE_ROOT, int(os.environ["JANITOR_WORKERS"]))
+if not MOCK_BUILD_HANDLER:
+    JANITOR.sweep_async(get_docker_client)
+
+CONTAINER_POOL = ContainerPool(
+    get_docker_client,
+    WORKSPACE_ROOT,
+    size=int(os.environ["CONTAINER_POOL_SIZE"]),
+    max_uses=int(os.environ["CONTAINER_MAX_USES"]),
+    idle_timeout=float(os.environ["CONTAINER_IDLE_TIMEOUT"]),
+    run_kwargs=container_limits(),
+    volumes=DEPS_CACHE.volumes(),
+    janitor=JANITOR,
+)
 
 
 class MockBuildHander(BuildHandler):
@@ -597,15 +779,24 @@ class MockBuildHander(BuildHandler):
     def compile_cmd(self) -> str:
         ...
 
-    def test_cmd(self) -> str:
+    def test_cmd(self, tests: Optional[list[str]] = None) -> str:
         ...
 
-    def extract_test_numbers(self, output: str) -> None:
+    def extract_test_numbers(self, output: str, since: Optional[float] = None) -> None:
         ...
 
     def clean_cmd(self) -> str:
         ...
 
+    def warm_deps_cmd(self) -> str:
+        ...
+
+    def warm_deps(self) -> None:
+        ...
+
+    def baseline_cmd(self) -> str:
+        ...
+
     def inject_changes(self, changes: dict[str, str]):
         ...
 
@@ -627,6 +818,67 @@ class MockBuildHander(BuildHandler):
     def __exit__(self, *args):
         ...
 
+    def discard(self) -> None:
+        ...
+
+
+def _handler_for(tmp_dir: str, path: str, verbose: bool = False) -> Optional[BuildHandler]:
+    """The handler of the repo extracted in `tmp_dir`, None if there's no build file"""
+    for entry in os.scandir(tmp_dir):
+        if entry.is_file() and entry.name in {"pom.xml", "build.gradle"}:
+            if verbose:
+                print(f"Found {entry.name!r} in {path!r}, returning handler")
+
+            if entry.name == "build.gradle":
+                return GradleHandler(tmp_dir, entry.name, archive=path)
+            else:
+                return MavenHandler(tmp_dir, entry.name, archive=path)
+    return None
+
+
+def ensure_baseline(root: str, repo: str) -> None:
+    """
+    Builds the archive `repo` unmodified, once, and stores the build outputs in
+    the repo cache, they're then part of its working copies
+    """
+    path = os.path.join(root, repo)
+    if REPO_CACHE.max_bytes <= 0:
+        return   # nowhere to keep it
+    with REPO_CACHE.baseline_lock(path):
+        if REPO_CACHE.baseline(path) is not None:
+            return   # already built (or failed to)
+
+        start = time.time()
+        tmp_dir = tempfile.mkdtemp(prefix=owned_prefix("crab_repo_"), dir=WORKSPACE_ROOT)
+        try:
+            REPO_CACHE.checkout(path, tmp_dir)
+            build_handler = _handler_for(tmp_dir, path)
+        except Exception:
+            JANITOR.remove_tree(tmp_dir)
+            raise
+        if build_handler is None:
+            JANITOR.remove_tree(tmp_dir)
+            return
+        try:
+            with build_handler:
+                try:
+                    ok, timed_out = build_handler.build_baseline(), False
+                except BuildTimeoutError:
+                    ok, timed_out = False, True
+                info = {
+                    "ok": ok,
+                    "timed_out": timed_out,
+                    "build_system": build_handler.get_type(),
+                    "built_at": time.time(),
+                    "seconds": time.time() - start,
+                }
+                REPO_CACHE.store_baseline(path, build_handler.path, info)
+        except Exception as e:
+            # not recorded, it's attempted again next time
+            print(f"[WARNING] Baseline build of {repo} couldn't run {type(e)}: {e}", file=sys.stderr)
+            return
+        print(f"[INFO] Baseline build of {repo} {'done' if ok else 'failed'} in {info['seconds']:.0f}s")
+
 
 def get_build_handler(root: str, repo: str, verbose: bool = False) -> BuildHandler:
     """
@@ -637,32 +889,31 @@ def get_build_handler(root: str, repo: str, verbose: bool = False) -> BuildHandl
         an instance of GradleHandler or MavenHandler
     """
     path = os.path.join(root, repo)
-    if bool(os.environ["MOCK_BUILD_HANDLER"]):
-        return MockBuildHander("NO REPO PATH", "NO BUILD FILE", {})
+    if MOCK_BUILD_HANDLER:
+        return MockBuildHander("NO REPO PATH", "NO BUILD FILE", {}, path)
 
-    # 1) If it's a tarball, extract it
+    # 1) If it's a tarball, get a working copy of it (extracted once, then cached)
     if os.path.isfile(path) and tarfile.is_tarfile(path):
         if verbose:
-            print(f"Archive detected: extracting {path}…")
-        tmp_dir = tempfile.mkdtemp(prefix="crab_repo_")
-        with tarfile.open(path, "r:gz") as tar:
-            tar.extractall(tmp_dir)
+            print(f"Archive detected: checking out {path}…")
+        os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+        if BASELINE_BUILDS:
+            ensure_baseline(root, repo)
+        tmp_dir = tempfile.mkdtemp(prefix=owned_prefix("crab_repo_"), dir=WORKSPACE_ROOT)
+        try:
+            has_baseline = REPO_CACHE.checkout(path, tmp_dir)
+        except BaseException:
+            JANITOR.remove_tree(tmp_dir)
+            raise
     else:
         raise NotValidDirectory(f"The path {path!r} is neither a directory nor a tar archive.")
 
     # 2) Now scan for build files
     to_keep = {"pom.xml", "build.gradle"}
-    for entry in os.scandir(tmp_dir):
-        if entry.is_file() and entry.name in to_keep:
-            if verbose:
-                print(f"Found {entry.name!r} in {path!r}, returning handler")
-
-            if entry.name == "build.gradle":
-                return GradleHandler(tmp_dir, entry.name)
-            else:
-                return MavenHandler(tmp_dir, entry.name)
-
-    if os.path.exists(path) and os.path.isdir(path):
-        rmtree(path)
+    build_handler = _handler_for(tmp_dir, path, verbose)
+    if build_handler is not None:
+        build_handler.has_baseline = has_baseline
+        return build_handler
 
+    JANITOR.remove_tree(tmp_dir)
     raise CantFindBuildFile(f"Could not find any of {sorted(to_keep)} in {path!r}")
@@ -0,0 +1,90 @@
+"""
+The build of a refinement entry, the same wherever it runs: on the build
+executor of the web process, or in a build worker (see build_worker).
+"""
+from contextlib import ExitStack
+from dataclasses import dataclass
+import sys
+from typing import Callable, Optional
+
+from utils.build_handlers import BuildTimeoutError, get_build_handler
+
+REFINEMENT_STEPS = 4   # creating build handler + injecting the files in the repo + compilation + testing
+
+
+@dataclass
+class BuildJob:
+    id: str   # of the entry
+    archive_name: str
+    changes: dict[str, str]
+    label: str   # for the logs, e.g. "apache/commons-lang #PR 42"
+
+
+def run_build_job(
+    job: BuildJob,
+    archives_root: str,
+    step: Callable[[], None] = lambda: None,
+    log_cb: Callable[[list[str]], None] = lambda _: None,
+) -> Optional[dict]:
+    """
+    Builds and tests the entry with the submitted changes injected, calling
+    `step` after each of the REFINEMENT_STEPS that succeeds and passing the
+    lines of the build output to `log_cb` as they come. Returns None if the
+    entry couldn't be evaluated.
+    """
+    # print(f"[INFO] {job.id} info: {job.label}")
+    try:
+        build_handler = get_build_handler(archives_root, job.archive_name)
+        build_handler.log_cb = log_cb
+        step()
+    except Exception as e:
+        print(f"[ERROR] {job.id} ({job.label}) {type(e)}: {e}", file=sys.stderr)
+        return None
+
+    result = {}
+    try:
+        build_handler.inject_changes(job.changes)
+    except Exception as e:
+        build_handler.discard()
+        result["changes_injection"] = False
+        result["changes_injection_error_msg"] = str(e)
+        print(f"[ERROR] {job.id} ({job.label}) {type(e)}: {e}", file=sys.stderr)
+        return result
+
+    step()
+
+    with ExitStack() as stack:
+        try:
+            stack.enter_context(build_handler)
+        except Exception as e:
+            # no container to build it in (docker down, image missing, disk full, ...)
+            build_handler.discard()
+            print(f"[ERROR] {job.id} ({job.label}) {type(e)}: {e}", file=sys.stderr)
+            return None
+        steps = [
+            ("compilation", build_handler.compile_repo),
+            ("test", build_handler.test_repo),
+        ]
+        for task, action in steps:
+            try:
+                # print(f"[INFO] Executing {task}...")
+                action()
+                # print(f"[INFO] {task} executed successfully on {job.id}")
+                result[task] = True
+                step()
+            except Exception as e:
+                result[task] = False
+                result[task + "_error_msg"] = str(e)
+                if isinstance(e, BuildTimeoutError):
+                    result[task + "_timeout"] = True
+                print(f"[ERROR] {job.id} ({job.label}) {type(e)}: {e}", file=sys.stderr)
+                break
+    return result
+
+
+def is_cacheable(result: Optional[dict]) -> bool:
+    """Whether the outcome is a property of the submission (and can be cached)"""
+    if result is None or "changes_injection" in result:
+        return False
+    # a timeout may be due to the load at the time, it's not a property of the submission
+    return not any(key.endswith("_timeout") for key in result)
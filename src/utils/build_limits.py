@@ -0,0 +1,52 @@
+import json, os, sys, threading
+from typing import Dict, Optional
+
+STEPS = ("compile", "test")
+
+
+class BuildTimeouts:
+    """
+    Wall-clock budget (in seconds) of the build steps, per archive.
+
+    The defaults can be overridden per repo in the json file at
+    `overrides_path`, reloaded whenever it changes:
+
+        {"apache/commons-lang": {"test": 7200}, "<archive name>": {"compile": 600}}
+
+    A repo key applies to all the archives of that repo, an archive name only
+    to that archive (and wins over its repo).
+    """
+
+    def __init__(self, defaults: Dict[str, float], overrides_path: Optional[str] = None) -> None:
+        self.defaults = defaults
+        self.overrides_path = overrides_path
+        self.overrides: Dict[str, Dict[str, float]] = {}
+        self.overrides_mtime: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def _load_overrides(self) -> Dict[str, Dict[str, float]]:
+        if not self.overrides_path or not os.path.exists(self.overrides_path):
+            return {}
+        mtime = os.path.getmtime(self.overrides_path)
+        with self.lock:
+            if mtime != self.overrides_mtime:
+                try:
+                    with open(self.overrides_path) as f:
+                        overrides = json.load(f)
+                    self.overrides = {key.replace("/", "_"): budgets for key, budgets in overrides.items()}
+                except (OSError, ValueError) as e:
+                    print(f"[WARNING] Ignoring the build timeouts in {self.overrides_path}: {e}", file=sys.stderr)
+                self.overrides_mtime = mtime
+            return self.overrides
+
+    def for_archive(self, archive: Optional[str]) -> Dict[str, float]:
+        budgets = dict(self.defaults)
+        if archive is None:
+            return budgets
+        overrides = self._load_overrides()
+        # the archives are named <owner>_<repo>_<pr number>_<state>.tar.gz
+        repo_keys = [key for key in overrides if archive.startswith(key + "_")]
+        for key in sorted(repo_keys, key=len):
+            budgets.update(overrides[key])
+        budgets.update(overrides.get(archive, {}))
+        return budgets
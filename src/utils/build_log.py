@@ -0,0 +1,152 @@
+from collections import deque
+from dataclasses import dataclass
+import codecs, gzip, re, threading, time
+from typing import Callable, Iterable, List, Optional, Pattern, Set
+
+DOWNLOAD_LINE = re.compile(r"\[INFO\] Download(ing|ed) from")
+UNAPPROVED_LICENSES_LINE = re.compile(r"\[WARNING\] Files with unapproved licenses:")
+UNAPPROVED_LICENSE_FILE = re.compile(r"\s+\?\/\.m2\/repository")
+
+
+@dataclass
+class BuildOutput:
+    """What's kept of the output of a build command"""
+
+    exit_code: int
+    tail: str   # last cleaned lines
+    found: Set[str]   # markers present in the output
+    summary: str   # groups of lines matching the summary pattern
+    log_path: Optional[str] = None   # full (cleaned) log, gzipped
+
+    def error_msg(self) -> str:
+        if self.log_path is None:
+            return self.tail
+        return f"{self.tail}\n[CRAB] Full log: {self.log_path}"
+
+
+class LogCleaner:
+    """
+    Cleans a build output line by line, as it's streamed, in a single pass:
+      - a block of Maven download lines is replaced by one line,
+      - the list of files with unapproved licenses is replaced by one line.
+
+    Only the last `tail_lines` cleaned lines are kept in memory (all of them
+    if None). The cleaned lines can also be written to a gzip file
+    (`spool_path`) and passed to `line_cb` as they come. `markers` are strings whose presence in the output
+    is recorded in `found`, and the groups of `summary_window` consecutive
+    lines that match `summary_pattern` are kept in `summary`.
+    """
+
+    def __init__(
+        self,
+        tail_lines: Optional[int],
+        markers: Iterable[str] = (),
+        line_cb: Optional[Callable[[str], None]] = None,
+        spool_path: Optional[str] = None,
+        summary_pattern: Optional[Pattern] = None,
+        summary_window: int = 1,
+    ) -> None:
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.partial = ""
+        self.tail: deque[str] = deque(maxlen=tail_lines)
+        self.markers = list(markers)
+        self.found: set[str] = set()
+        self.line_cb = line_cb
+        self.spool = gzip.open(spool_path, "wt", encoding="utf-8") if spool_path else None
+        self.spool_path = spool_path
+        self.summary_pattern = summary_pattern
+        self.window: deque[str] = deque(maxlen=summary_window)
+        self.summary: List[str] = []
+        self.n_lines = 0
+
+        self.in_download_block = False
+        self.in_licenses_block = False
+
+    def feed(self, chunk: bytes) -> None:
+        text = self.partial + self.decoder.decode(chunk)
+        lines = text.split("\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self._line(line)
+
+    def close(self) -> None:
+        text = self.partial + self.decoder.decode(b"", final=True)
+        self.partial = ""
+        if text:
+            self._line(text)
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+    def _line(self, line: str) -> None:
+        for marker in self.markers:
+            if marker in line:
+                self.found.add(marker)
+        if self.summary_pattern is not None:
+            self.window.append(line)
+            if len(self.window) == self.window.maxlen:
+                joined = "\n".join(self.window)
+                if self.summary_pattern.fullmatch(joined):
+                    self.summary.append(joined)
+
+        if DOWNLOAD_LINE.match(line):
+            if not self.in_download_block:
+                self.in_download_block = True
+                self._merged_downloads("[CRAB] Downloading stuff")
+        else:
+            self.in_download_block = False
+            self._merged_downloads(line)
+
+    def _merged_downloads(self, line: str) -> None:
+        if UNAPPROVED_LICENSES_LINE.match(line):
+            self._emit(line)
+            self._emit("[CRAB] List of all the unapproved licenses...")
+            self.in_licenses_block = True
+            return
+        if self.in_licenses_block and not UNAPPROVED_LICENSE_FILE.match(line):
+            self.in_licenses_block = False
+        if not self.in_licenses_block:
+            self._emit(line)
+
+    def _emit(self, line: str) -> None:
+        self.n_lines += 1
+        self.tail.append(line)
+        if self.spool is not None:
+            self.spool.write(line + "\n")
+        if self.line_cb is not None:
+            self.line_cb(line)
+
+    def text(self) -> str:
+        """The kept (last) cleaned lines"""
+        return "\n".join(self.tail)
+
+
+class LineBatcher:
+    """
+    Groups lines to pass them to `batch_cb` at most every `interval` seconds
+    (or `max_lines` at a time), so that a chatty build doesn't flood it
+    """
+
+    def __init__(self, batch_cb: Callable[[List[str]], None], interval: float = 0.5, max_lines: int = 200) -> None:
+        self.batch_cb = batch_cb
+        self.interval = interval
+        self.max_lines = max_lines
+        self.lines: List[str] = []
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+
+    def __call__(self, line: str) -> None:
+        with self.lock:
+            self.lines.append(line)
+            if len(self.lines) < self.max_lines and time.time() - self.last_flush < self.interval:
+                return
+            lines, self.lines = self.lines, []
+            self.last_flush = time.time()
+        self.batch_cb(lines)
+
+    def flush(self) -> None:
+        with self.lock:
+            lines, self.lines = self.lines, []
+            self.last_flush = time.time()
+        if lines:
+            self.batch_cb(lines)
@@ -0,0 +1,202 @@
+"""
+Number of builds run at the same time, adapted to the load of the host.
+
+Every build holds a slot while it runs. The number of slots moves between a
+minimum and a maximum: one more when the host has room for another build and
+builds are waiting for a slot, one less when it's under pressure. The load is
+read from the pressure stall information of the kernel (/proc/pressure), or
+from the load average and the available memory where there's none, and the
+memory used by the running builds from the cgroups of their containers.
+"""
+from collections import deque
+import os, sys, threading, time
+from typing import Callable, Dict, Iterable, List, Optional
+
+PRESSURE_DIR = "/proc/pressure"
+CONTROL_INTERVAL = 10   # seconds between two decisions
+COOLDOWN = 30   # seconds after a change before the next one, for its effect to show
+MAX_DECISIONS = 50   # changes kept for the status
+
+# % of the time (avg10) some tasks were stalled on the resource
+HIGH_PRESSURE = {"memory": 10.0, "io": 40.0, "cpu": 80.0}   # over that, one slot less
+LOW_PRESSURE = {"memory": 1.0, "io": 15.0, "cpu": 50.0}   # under that (for all), room for one more
+HIGH_MEMORY_FULL = 2.0   # % of the time all the tasks were stalled on memory: thrashing
+MEMORY_HEADROOM = 1.5   # an extra build needs this many times the memory of an average build
+DEFAULT_BUILD_MEMORY = 2 * 2**30   # until a build was measured
+
+# where docker puts the cgroup of a container (cgroup v2 with systemd or cgroupfs, cgroup v1)
+CONTAINER_MEMORY_FILES = (
+    "/sys/fs/cgroup/system.slice/docker-{id}.scope/memory.current",
+    "/sys/fs/cgroup/docker/{id}/memory.current",
+    "/sys/fs/cgroup/memory/docker/{id}/memory.usage_in_bytes",
+    "/sys/fs/cgroup/memory/system.slice/docker-{id}.scope/memory.usage_in_bytes",
+)
+
+
+def read_pressure() -> Optional[Dict[str, Dict[str, float]]]:
+    """{"cpu"|"memory"|"io": {"some": avg10, "full": avg10}}, None without PSI"""
+    pressure = {}
+    try:
+        for resource in ("cpu", "memory", "io"):
+            values = {}
+            with open(os.path.join(PRESSURE_DIR, resource)) as f:
+                for line in f:
+                    kind, *fields = line.split()
+                    values[kind] = float(dict(field.split("=") for field in fields)["avg10"])
+            pressure[resource] = values
+    except (OSError, ValueError, KeyError):
+        return None
+    return pressure
+
+
+def read_available_memory() -> Optional[int]:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def container_memory(container_id: str) -> Optional[int]:
+    for pattern in CONTAINER_MEMORY_FILES:
+        try:
+            with open(pattern.format(id=container_id)) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+class BuildSlots:
+    """
+    Resizable semaphore of the builds, between `min_slots` and `max_slots`.
+    The slots are adapted by a controller thread (started by `start`) when
+    the bounds differ, otherwise it's a plain semaphore of `max_slots`.
+    `running_containers` gives the ids of the containers of the running
+    builds, to measure their memory.
+    """
+
+    def __init__(
+        self,
+        min_slots: int,
+        max_slots: int,
+        running_containers: Callable[[], Iterable[str]] = lambda: (),
+    ) -> None:
+        self.min_slots = max(1, min(min_slots, max_slots))
+        self.max_slots = max(1, max_slots)
+        self.limit = self.min_slots if self.adaptive else self.max_slots
+        self.running_containers = running_containers
+        self.cond = threading.Condition()
+        self.in_use = 0
+        self.waiting = 0
+        self.last_change = 0.0
+        self.build_memory = DEFAULT_BUILD_MEMORY   # estimated memory of a build
+        self.last_sample: dict = {}
+        self.decisions: deque = deque(maxlen=MAX_DECISIONS)
+        self.controller: Optional[threading.Thread] = None
+
+    @property
+    def adaptive(self) -> bool:
+        return self.min_slots < self.max_slots
+
+    def acquire(self) -> None:
+        with self.cond:
+            self.waiting += 1
+            while self.in_use >= self.limit:
+                self.cond.wait()
+            self.waiting -= 1
+            self.in_use += 1
+
+    def release(self) -> None:
+        with self.cond:
+            self.in_use -= 1
+            self.cond.notify()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+    def start(self) -> None:
+        """Starts adapting the slots to the load (if the bounds allow it)"""
+        with self.cond:
+            if not self.adaptive or self.controller is not None:
+                return
+            self.controller = threading.Thread(target=self._control, daemon=True)
+            self.controller.start()
+
+    def _control(self) -> None:
+        while True:
+            time.sleep(CONTROL_INTERVAL)
+            try:
+                self.adjust()
+            except Exception as e:
+                print(f"[WARNING] Couldn't adapt the build slots {type(e)}: {e}", file=sys.stderr)
+
+    def _measure_builds(self) -> List[int]:
+        memory = [m for m in (container_memory(cid) for cid in self.running_containers()) if m is not None]
+        if memory:
+            # the estimate follows the builds, slowly, and isn't lowered by the ones that just started
+            self.build_memory = int(0.8 * self.build_memory + 0.2 * max(memory))
+        return memory
+
+    def adjust(self) -> None:
+        """Decides (now) whether to change the number of slots"""
+        pressure = read_pressure()
+        available = read_available_memory()
+        builds_memory = self._measure_builds()
+        sample = {
+            "pressure": pressure,
+            "load": os.getloadavg()[0] / (os.cpu_count() or 1),
+            "available_memory": available,
+            "builds_memory": builds_memory,
+            "build_memory_estimate": self.build_memory,
+        }
+
+        delta, reason = 0, "steady"
+        if pressure is not None:
+            high = [r for r, threshold in HIGH_PRESSURE.items() if pressure[r]["some"] > threshold]
+            if pressure["memory"].get("full", 0) > HIGH_MEMORY_FULL:
+                delta, reason = -1, f"memory thrashing (full {pressure['memory']['full']:.1f}%)"
+            elif high:
+                delta, reason = -1, "high pressure: " + ", ".join(f"{r} {pressure[r]['some']:.1f}%" for r in high)
+            elif all(pressure[r]["some"] < threshold for r, threshold in LOW_PRESSURE.items()):
+                delta, reason = 1, "low pressure"
+        elif sample["load"] > 1.0:
+            delta, reason = -1, f"high load ({sample['load']:.2f} per cpu)"
+        elif sample["load"] < 0.7:
+            delta, reason = 1, "low load"
+
+        with self.cond:
+            sample["time"] = time.time()
+            self.last_sample = sample
+            if delta > 0:
+                if self.waiting == 0:
+                    return   # no demand for another one
+                if available is not None and available < MEMORY_HEADROOM * self.build_memory:
+                    return   # it wouldn't fit
+            new_limit = min(self.max_slots, max(self.min_slots, self.limit + delta))
+            if new_limit == self.limit or time.time() - self.last_change < COOLDOWN:
+                return
+            self.decisions.append({"time": time.time(), "from": self.limit, "to": new_limit, "reason": reason})
+            print(f"[INFO] Build slots {self.limit} -> {new_limit}: {reason}")
+            self.limit = new_limit
+            self.last_change = time.time()
+            self.cond.notify_all()
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "adaptive": self.adaptive,
+                "limit": self.limit,
+                "min": self.min_slots,
+                "max": self.max_slots,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "last_sample": self.last_sample,
+                "decisions": list(self.decisions),
+            }
@@ -0,0 +1,122 @@
+"""
+Build worker: runs the builds of the refinement entries queued by the web
+process on the build broker (see build_broker). Start as many as needed, on
+any machine that has docker, the build images, the archives (ARCHIVES_ROOT)
+and access to the broker.
+
+Usage (from `src/`):
+    python -m utils.build_worker [--broker URL] [--builds N]
+"""
+import argparse, os, socket, sys, threading, time, traceback
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.build_broker import Broker
+    from utils.build_slots import BuildSlots
+
+IDLE_POLL_INTERVAL = 1.0   # seconds between two claims when the queue is empty
+
+
+def _heartbeat(broker: "Broker", job_id: str, worker: str, done: threading.Event, interval: float) -> None:
+    while not done.wait(interval):
+        try:
+            broker.heartbeat(job_id, worker)
+        except Exception as e:
+            print(f"[WARNING] {worker} couldn't heartbeat {job_id} {type(e)}: {e}", file=sys.stderr)
+
+
+def _work(broker: "Broker", worker: str, archives_root: str, slots: "BuildSlots") -> None:
+    # imported once the environment is set (see __main__)
+    from utils.build_broker import LEASE_TIMEOUT
+    from utils.build_jobs import run_build_job
+    from utils.build_log import LineBatcher
+
+    while True:
+        # a job is only claimed once it can run, so that it can be run by another worker meanwhile
+        slots.acquire()
+        try:
+            claimed = broker.claim(worker)
+        except Exception as e:
+            print(f"[WARNING] {worker} couldn't claim a job {type(e)}: {e}", file=sys.stderr)
+            claimed = None
+        if claimed is None:
+            slots.release()
+            time.sleep(IDLE_POLL_INTERVAL)
+            continue
+
+        job_id, job = claimed
+        print(f"[INFO] {worker} building {job.id} ({job.label})")
+        done = threading.Event()
+
+        threading.Thread(
+            target=_heartbeat, args=(broker, job_id, worker, done, LEASE_TIMEOUT / 4), daemon=True
+        ).start()
+        # the lines are batched a second time, one report per batch is enough
+        batcher = LineBatcher(lambda lines: broker.report(job_id, lines=lines), interval=1.0, max_lines=1000)
+
+        def log(lines: list[str]):
+            for line in lines:
+                batcher(line)
+
+        try:
+            result = run_build_job(
+                job, archives_root, step=lambda: broker.report(job_id, steps=1), log_cb=log
+            )
+            batcher.flush()
+            broker.finish(job_id, worker, result)
+        except Exception as e:
+            traceback.print_exc()
+            batcher.flush()
+            broker.finish(job_id, worker, None, f"{type(e)}: {e}")
+        finally:
+            done.set()
+            slots.release()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from utils.env_defaults import set_env_defaults
+
+    set_env_defaults()
+    load_dotenv(override=True)
+
+    from utils.build_broker import make_broker
+    from utils.build_handlers import CONTAINER_POOL
+    from utils.build_slots import BuildSlots
+
+    parser = argparse.ArgumentParser(description="Run the builds queued on the build broker")
+    parser.add_argument("--broker", default=os.environ["BUILD_BROKER"], help="e.g. sqlite:///path/to/broker.sqlite")
+    parser.add_argument(
+        "--builds",
+        type=int,
+        default=int(os.environ["MAX_CONCURRENT_BUILDS"]),
+        help="maximum number of entries built at the same time by this worker",
+    )
+    parser.add_argument(
+        "--min-builds",
+        type=int,
+        default=int(os.environ["MIN_CONCURRENT_BUILDS"]),
+        help="if lower than --builds, the number of builds is adapted to the load between the two",
+    )
+    args = parser.parse_args()
+    if not args.broker:
+        parser.error("no broker, set BUILD_BROKER or pass --broker")
+
+    broker = make_broker(args.broker)
+    archives_root = os.environ["ARCHIVES_ROOT"]
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    slots = BuildSlots(args.min_builds or args.builds, args.builds, CONTAINER_POOL.leased_containers)
+    slots.start()
+    threads = [
+        threading.Thread(target=_work, args=(broker, f"{name}/{i}", archives_root, slots), daemon=True)
+        for i in range(args.builds)
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"[INFO] Build worker {name} running {args.builds} builds at a time from {args.broker}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        # the jobs that were running are queued again once their lease expires
+        sys.exit(0)
@@ -0,0 +1,90 @@
+"""
+Scoring of the comment generation submissions. It's what the worker
+processes of the comment pool run: importing it has no side effect (nothing
+is loaded or started), since they import it again.
+"""
+import sys
+from typing import List, Optional, Tuple
+from utils.dataset import CommentGenSubmission, CompactComment
+from utils.references import References
+
+_WORKER_REFERENCES: Optional[References] = None   # set in the worker processes of the pool
+
+
+def comment_distance(submission: CommentGenSubmission, entry: CompactComment):
+    if entry.from_ is None and entry.to is None:
+        return "NA"
+    if submission.from_ is None and submission.to is None:
+        return "NA"
+
+    # Collapse missing endpoints to the one defined endpoint
+    # For entry:
+    start1 = entry.from_ if entry.from_ is not None else entry.to
+    end1 = entry.to if entry.to is not None else entry.from_
+    # For submission:
+    start2 = submission.from_ if submission.from_ is not None else submission.to
+    end2 = submission.to if submission.to is not None else submission.from_
+
+    # Now both start1,end1 and start2,end2 are non-None
+    # Normalize in case from > to (just in case):
+    if start1 > end1:
+        start1, end1 = end1, start1
+    if start2 > end2:
+        start2, end2 = end2, start2
+
+    # Check for overlap
+    if end1 >= start2 and end2 >= start1:
+        return 0
+
+    # Otherwise compute gap
+    if end1 < start2:
+        return start2 - end1
+    else:  # end2 < start1
+        return start1 - end2
+
+
+def evaluate_comment(
+    id_: str, submission: CommentGenSubmission, references: References
+) -> Optional[dict]:
+    """
+    Evaluates a single comment submission against the reference of entry `id_`.
+    Returns None if the entry is not present in the dataset.
+    """
+    if id_ not in references.reference_map:
+        print(f"[WARNING] skipping {id_} since it is not present in dataset", file=sys.stderr)
+        return None
+    entry = references.reference_map[id_]
+    # print(f"[INFO] Processing paraphrases...")
+    scores = references.index.bleu_scores(id_, submission.body)
+    max_score = max([0] + scores)
+
+    correct_file = submission.path == entry.comments[0].file
+    # print(f"[INFO] Getting distance...")
+    if correct_file:
+        distance = comment_distance(submission, entry.comments[0])
+    else:
+        distance = "NA"
+
+    return {
+        'max_bleu_score': max_score,
+        'bleu_scores': scores,
+        'proposed_comment': submission.__dict__,
+        'correct_file': correct_file,
+        'distance': distance,
+    }
+
+
+def init_worker(references: References) -> None:
+    # runs once in each worker process of the pool, when the pool starts
+    global _WORKER_REFERENCES
+    _WORKER_REFERENCES = references
+
+
+def evaluate_shard(shard: List[Tuple[str, CommentGenSubmission]]) -> dict:
+    assert _WORKER_REFERENCES is not None
+    results = {}
+    for id_, submission in shard:
+        result = evaluate_comment(id_, submission, _WORKER_REFERENCES)
+        if result is not None:
+            results[id_] = result
+    return results
@@ -0,0 +1,226 @@
+from dataclasses import dataclass, field
+import os, sys, tempfile, threading, time
+from collections import defaultdict
+from shutil import rmtree
+from typing import Callable, Optional
+
+import docker
+from docker.errors import APIError
+from docker.models.containers import Container
+
+from utils.janitor import OWNER_LABEL, Janitor, owned_prefix, owner_label
+
+# where the working directory of a leased container is mounted, the repo being
+# evaluated is moved in `CONTAINER_WORKSPACE/repo`
+CONTAINER_WORKSPACE = "/workspace"
+CONTAINER_REPO_PATH = f"{CONTAINER_WORKSPACE}/repo"
+
+
+@dataclass
+class Lease:
+    container: Container
+    image: str
+    slot_dir: str   # host directory mounted at CONTAINER_WORKSPACE
+    uses: int = 0
+    started_at: float = field(default_factory=time.time)
+    idle_since: float = field(default_factory=time.time)
+
+    @property
+    def repo_path(self) -> str:
+        """Host path of the working directory of the lease"""
+        return os.path.join(self.slot_dir, "repo")
+
+
+class ContainerPool:
+    """
+    Pool of pre-started build containers, per image.
+
+    A container is leased for one entry and returned afterwards. Each container
+    has its own (empty) working directory on the host, mounted at
+    CONTAINER_WORKSPACE, in which the repo of the entry is moved for the
+    duration of the lease. A container is recycled after `max_uses` leases,
+    evicted after `idle_timeout` seconds without being leased and discarded if
+    it's not running anymore. With `size` = 0, every lease starts a new
+    container that is removed when it's returned. The containers are removed
+    by the `janitor` if there's one, in the background.
+    """
+
+    def __init__(
+        self,
+        get_client: Callable[[], docker.DockerClient],
+        workspace_root: str,
+        size: int,
+        max_uses: int,
+        idle_timeout: float,
+        run_kwargs: Optional[dict] = None,
+        volumes: Optional[dict] = None,
+        janitor: Optional[Janitor] = None,
+    ) -> None:
+        self.get_client = get_client
+        self.workspace_root = workspace_root
+        self.size = size
+        self.max_uses = max_uses
+        self.idle_timeout = idle_timeout
+        self.run_kwargs = run_kwargs or {}
+        self.volumes = volumes or {}   # mounted in every container, besides its working directory
+        self.janitor = janitor
+        self.idle: dict[str, list[Lease]] = defaultdict(list)
+        self.leased: set[str] = set()   # ids of the leased containers
+        self.starting: dict[str, int] = defaultdict(int)
+        self.lock = threading.Lock()
+        self.reaper: Optional[threading.Thread] = None
+
+        self.n_leases = 0
+        self.n_hits = 0
+        self.n_started = 0
+        self.n_recycled = 0
+        self.n_evicted_idle = 0
+        self.n_unhealthy = 0
+        self.total_start_time = 0.0
+        self.max_start_time = 0.0
+
+    def _start(self, image: str) -> Lease:
+        os.makedirs(self.workspace_root, exist_ok=True)
+        slot_dir = tempfile.mkdtemp(prefix=owned_prefix("crab_slot_"), dir=self.workspace_root)
+        start = time.time()
+        container = self.get_client().containers.run(
+            image=image,
+            command="tail -f /dev/null",  # to keep the container alive
+            volumes={**self.volumes, slot_dir: {"bind": CONTAINER_WORKSPACE, "mode": "rw"}},
+            working_dir=CONTAINER_WORKSPACE,
+            detach=True,
+            tty=True,
+            labels={OWNER_LABEL: owner_label()},   # to sweep it if this process crashes
+            **self.run_kwargs,
+        )
+        elapsed = time.time() - start
+        with self.lock:
+            self.n_started += 1
+            self.total_start_time += elapsed
+            self.max_start_time = max(self.max_start_time, elapsed)
+        return Lease(container, image, slot_dir)
+
+    def _discard(self, lease: Lease) -> None:
+        if self.janitor is not None:
+            self.janitor.remove_container(lease.container, lease.slot_dir)
+            return
+        try:
+            lease.container.kill()
+        except APIError:
+            pass   # already stopped
+        try:
+            lease.container.remove(force=True)
+        except APIError as e:
+            print(f"[WARNING] couldn't remove container {lease.container.id}: {e}", file=sys.stderr)
+        rmtree(lease.slot_dir, ignore_errors=True)
+
+    def _is_healthy(self, lease: Lease) -> bool:
+        try:
+            lease.container.reload()
+        except APIError:
+            return False
+        return lease.container.status == "running"
+
+    def _top_up(self, image: str) -> None:
+        """Starts containers in the background until `size` are idle (or starting) for `image`"""
+        with self.lock:
+            missing = self.size - len(self.idle[image]) - self.starting[image]
+            self.starting[image] += max(0, missing)
+        for _ in range(missing):
+            threading.Thread(target=self._start_idle, args=(image,), daemon=True).start()
+
+    def _start_idle(self, image: str) -> None:
+        try:
+            lease = self._start(image)
+        except Exception as e:
+            print(f"[WARNING] couldn't pre-start a {image} container: {e}", file=sys.stderr)
+            return
+        finally:
+            with self.lock:
+                self.starting[image] -= 1
+        with self.lock:
+            self.idle[image].append(lease)
+
+    def _reap(self) -> None:
+        while True:
+            time.sleep(max(1, min(self.idle_timeout / 2, 30)))
+            now = time.time()
+            expired = []
+            with self.lock:
+                for image, leases in self.idle.items():
+                    for lease in [l for l in leases if now - l.idle_since > self.idle_timeout]:
+                        leases.remove(lease)
+                        expired.append(lease)
+                self.n_evicted_idle += len(expired)
+            for lease in expired:
+                self._discard(lease)
+
+    def lease(self, image: str) -> Lease:
+        """Returns a running container of `image` with an empty working directory"""
+        with self.lock:
+            self.n_leases += 1
+            if self.size > 0 and self.reaper is None:
+                self.reaper = threading.Thread(target=self._reap, daemon=True)
+                self.reaper.start()
+
+        while True:
+            with self.lock:
+                lease = self.idle[image].pop() if self.idle[image] else None
+            if lease is None:
+                lease = self._start(image)
+                break
+            if self._is_healthy(lease):
+                with self.lock:
+                    self.n_hits += 1
+                break
+            with self.lock:
+                self.n_unhealthy += 1
+            self._discard(lease)
+
+        lease.uses += 1
+        with self.lock:
+            self.leased.add(lease.container.id)
+        if self.size > 0:
+            self._top_up(image)
+        return lease
+
+    def release(self, lease: Lease) -> None:
+        """Gives back a leased container, its working directory must have been emptied"""
+        lease.idle_since = time.time()
+        with self.lock:
+            self.leased.discard(lease.container.id)
+            keep = len(self.idle[lease.image]) < self.size
+            if keep and lease.uses >= self.max_uses:
+                self.n_recycled += 1
+                keep = False
+            if keep and os.listdir(lease.slot_dir):
+                keep = False   # shouldn't happen, but the next entry must start clean
+        if keep and self._is_healthy(lease):
+            with self.lock:
+                self.idle[lease.image].append(lease)
+            return
+        self._discard(lease)
+        if self.size > 0:
+            self._top_up(lease.image)
+
+    def leased_containers(self) -> list[str]:
+        with self.lock:
+            return list(self.leased)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": self.size,
+                "idle": {image: len(leases) for image, leases in self.idle.items()},
+                "leases": self.n_leases,
+                "hits": self.n_hits,
+                "hit_rate": self.n_hits / self.n_leases if self.n_leases > 0 else 0,
+                "started": self.n_started,
+                "avg_start_seconds": (
+                    self.total_start_time / self.n_started if self.n_started > 0 else 0
+                ),
+                "max_start_seconds": self.max_start_time,
+                "recycled": self.n_recycled,
+                "evicted_idle": self.n_evicted_idle,
+                "unhealthy": self.n_unhealthy,
+            }
@@ -0,0 +1,109 @@
+"""
+Lookups in JaCoCo coverage reports, and of the package of Java files, each
+report and file being read once (while it doesn't change) and indexed.
+"""
+from collections import OrderedDict
+import os, threading
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+import javalang
+
+REPORTS_MEMORY_SIZE = 16   # coverage report indexes kept in memory
+PACKAGES_MEMORY_SIZE = 4096   # packages of java files kept in memory
+
+# (fully qualified class with slashes, source file name) -> (missed, covered) lines
+CoverageIndex = Dict[Tuple[str, str], Tuple[int, int]]
+
+T = TypeVar("T")
+
+
+class _FileCache(Generic[T]):
+    """LRU cache of what's computed from a file, recomputed when the file changes"""
+
+    def __init__(self, compute: Callable[[str], T], max_size: int) -> None:
+        self.compute = compute
+        self.max_size = max_size
+        self.entries: OrderedDict[str, Tuple[Tuple[int, int], T]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path: str) -> T:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(path)
+                return entry[1]
+        value = self.compute(path)   # concurrent misses may both compute, the result is the same
+        with self.lock:
+            self.entries[path] = (version, value)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+
+
+def index_report(report_path: str) -> CoverageIndex:
+    """
+    The line counters of the classes of the JaCoCo xml report, streamed: the
+    elements are dropped once read (the per-line data of the source files is
+    most of a report)
+    """
+    index: CoverageIndex = {}
+    for _, elem in ET.iterparse(report_path, events=("end",)):
+        if elem.tag == "class":
+            line_counter = elem.find("counter[@type='LINE']")
+            name, source = elem.get("name"), elem.get("sourcefilename")
+            if line_counter is not None and name is not None and source is not None:
+                index[(name, source)] = (int(line_counter.get("missed", 0)), int(line_counter.get("covered", 0)))
+            elem.clear()
+        elif elem.tag in ("sourcefile", "package"):
+            elem.clear()
+    return index
+
+
+def read_package(java_path: str) -> Optional[str]:
+    """
+    The package declared by the java file, None if there's none. Only the
+    tokens up to the declaration are read, the file isn't parsed
+    """
+    with open(java_path, encoding="utf-8", errors="replace") as f:
+        source = f.read()
+    tokens = javalang.tokenizer.tokenize(source)
+    depth = 0   # in the arguments of an annotation, e.g. `@Foo(Bar.class)`
+    for token in tokens:
+        if token.value == "(":
+            depth += 1
+        elif token.value == ")":
+            depth -= 1
+        if depth > 0 or not isinstance(token, javalang.tokenizer.Keyword):
+            continue   # annotations of the package (in package-info.java)
+        if token.value != "package":
+            return None   # import, class, public, ...: there's no package declaration
+        parts = []
+        for token in tokens:
+            if token.value == ";":
+                break
+            parts.append(token.value)
+        return "".join(parts)
+    return None
+
+
+REPORTS = _FileCache(index_report, REPORTS_MEMORY_SIZE)
+PACKAGES = _FileCache(read_package, PACKAGES_MEMORY_SIZE)
+
+
+def line_coverage(report_path: str, fully_qualified_class: str, basename: str) -> float:
+    """Line coverage (in %) of the class in the report, -1 if it isn't in it"""
+    counters = REPORTS.get(report_path).get((fully_qualified_class, basename))
+    if counters is None:
+        return -1
+    missed, covered = counters
+    total = missed + covered
+    return (covered / total) * 100 if total > 0 else 0
+
+
+def package_of(java_path: str) -> Optional[str]:
+    return PACKAGES.get(java_path)
@@ -1,7 +1,7 @@
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Any, Dict, List, Optional, Union
-import json, uuid
+from typing import Any, Dict, List, Optional, Tuple, Union
+import json, sys, uuid
 
 from utils.errors import InvalidJsonFormatError
 
@@ -77,6 +77,109 @@ class DatasetEntry:
     metadata: Metadata
     comments: List[Comment]
 
+    @staticmethod
+    def from_dict(entry_data: dict) -> "DatasetEntry":
+        metadata_data = dict(entry_data["metadata"])
+        selection_data = metadata_data["selection"] if "selection" in metadata_data else None
+        metadata_data["selection"] = Selection(**selection_data) if selection_data else None
+        return DatasetEntry(
+            metadata=Metadata(**metadata_data),
+            comments=[Comment(**comment) for comment in entry_data["comments"]],
+        )
+
+
+def _intern(s: Optional[str]) -> Optional[str]:
+    return None if s is None else sys.intern(s)
+
+
+class CompactComment:
+    """Evaluation-time, slotted version of `Comment`"""
+
+    __slots__ = ("body", "file", "from_", "to", "paraphrases")
+
+    def __init__(
+        self, body: str, file: str, from_: int, to: int, paraphrases: Tuple[str, ...] = ()
+    ) -> None:
+        self.body = body
+        self.file = _intern(file)   # many comments are on the same files
+        self.from_ = from_
+        self.to = to
+        self.paraphrases = tuple(paraphrases)
+
+
+class CompactMetadata:
+    """
+    Evaluation-time, slotted version of `Metadata`: only keeps what the
+    evaluation reads, with the repeated strings interned.
+    """
+
+    __slots__ = ("id", "repo", "pr_number", "build_system", "successful")
+
+    def __init__(
+        self,
+        id: str,
+        repo: str,
+        pr_number: int,
+        build_system: str = "",
+        successful: Optional[bool] = None,
+    ) -> None:
+        self.id = id
+        self.repo = _intern(repo)
+        self.pr_number = pr_number
+        self.build_system = _intern(build_system)
+        self.successful = successful
+
+    archive_name = Metadata.archive_name
+
+
+class CompactEntry:
+    """Evaluation-time, slotted version of `DatasetEntry`, as held in the reference map"""
+
+    __slots__ = ("metadata", "comments")
+
+    def __init__(self, metadata: CompactMetadata, comments: Tuple[CompactComment, ...]) -> None:
+        self.metadata = metadata
+        self.comments = comments
+
+    @staticmethod
+    def from_dict(entry_data: dict) -> "CompactEntry":
+        metadata = entry_data["metadata"]
+        return CompactEntry(
+            metadata=CompactMetadata(
+                id=metadata["id"],
+                repo=metadata["repo"],
+                pr_number=metadata["pr_number"],
+                build_system=metadata.get("build_system", ""),
+                successful=metadata.get("successful"),
+            ),
+            comments=tuple(
+                CompactComment(
+                    body=comment["body"],
+                    file=comment["file"],
+                    from_=comment["from_"],
+                    to=comment["to"],
+                    paraphrases=comment.get("paraphrases", ()),
+                )
+                for comment in entry_data["comments"]
+            ),
+        )
+
+    @staticmethod
+    def from_entry(entry: DatasetEntry) -> "CompactEntry":
+        return CompactEntry(
+            metadata=CompactMetadata(
+                id=entry.metadata.id,
+                repo=entry.metadata.repo,
+                pr_number=entry.metadata.pr_number,
+                build_system=entry.metadata.build_system,
+                successful=entry.metadata.successful,
+            ),
+            comments=tuple(
+                CompactComment(c.body, c.file, c.from_, c.to, c.paraphrases)
+                for c in entry.comments
+            ),
+        )
+
 
 class OutputType(Enum):
     FULL = "full"
@@ -100,26 +203,16 @@ class Dataset:
 
         entries = []
         for entry_data in data["entries"]:
-            metadata_data = entry_data["metadata"]
-            selection_data = metadata_data["selection"] if "selection" in metadata_data else None
-            selection = Selection(**selection_data) if selection_data else None
-            metadata_data["selection"] = selection
-            if "id" not in metadata_data:
-                metadata_data["id"] = uuid.uuid4().hex
-            metadata = Metadata(**metadata_data)
+            if "id" not in entry_data["metadata"]:
+                entry_data["metadata"]["id"] = uuid.uuid4().hex
+            entry = DatasetEntry.from_dict(entry_data)
 
             if (
                 not keep_still_in_progress
-                and metadata.reason_for_failure == "Was still being processed"
+                and entry.metadata.reason_for_failure == "Was still being processed"
             ):
                 continue
 
-            comments = [Comment(**comment) for comment in entry_data["comments"]]
-
-            entry = DatasetEntry(
-                metadata=metadata,
-                comments=comments,
-            )
             entries.append(entry)
 
         return Dataset(entries=entries)
@@ -131,3 +224,11 @@ class Dataset:
         for entry in self.entries:
             ref_map[entry.metadata.id] = entry
         return ref_map
+
+    def build_compact_reference_map(self) -> Dict[str, CompactEntry]:
+        """Build a reference map for the dataset, with only what the evaluation needs"""
+
+        ref_map = {}
+        for entry in self.entries:
+            ref_map[entry.metadata.id] = CompactEntry.from_entry(entry)
+        return ref_map
@@ -0,0 +1,160 @@
+"""
+Compiled (binary) version of `dataset.json`, loaded lazily through mmap.
+
+Layout of the file (little endian):
+    header:  magic (8 bytes) | number of entries (u64) | offset of the index (u64)
+    data:    the entries, each one as compact json (utf-8)
+    index:   one record per entry, sorted by id:
+             id offset (u64) | id length (u32) | entry offset (u64) | entry length (u32)
+    ids:     the ids (utf-8)
+
+Usage (from `src/`):
+    python -m utils.dataset_store ../data/dataset.json ../data/dataset.bin
+"""
+from collections.abc import Mapping
+import argparse, json, mmap, os, struct, uuid
+from typing import Iterator, Optional, Tuple
+
+from utils.dataset import CompactEntry, Dataset
+
+MAGIC = b"CRABDS01"
+HEADER = struct.Struct("<8sQQ")
+RECORD = struct.Struct("<QIQI")
+
+
+def compile_dataset(json_path: str, out_path: str, keep_still_in_progress: bool = False) -> int:
+    """
+    Converts `json_path` into the compiled format at `out_path`, applying the
+    same filtering as `Dataset.from_json`. Returns the number of entries written.
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    entries: dict[bytes, bytes] = {}
+    for entry_data in data["entries"]:
+        metadata = entry_data["metadata"]
+        if "id" not in metadata:
+            metadata["id"] = uuid.uuid4().hex
+        if (
+            not keep_still_in_progress
+            and metadata.get("reason_for_failure") == "Was still being processed"
+        ):
+            continue
+        entries[metadata["id"].encode()] = json.dumps(entry_data, separators=(",", ":")).encode()
+
+    ids = sorted(entries)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0, 0))   # rewritten once the offsets are known
+
+        data_offsets = {}
+        for id in ids:
+            data_offsets[id] = f.tell()
+            f.write(entries[id])
+
+        index_offset = f.tell()
+        id_offset = index_offset + RECORD.size * len(ids)
+        for id in ids:
+            f.write(RECORD.pack(id_offset, len(id), data_offsets[id], len(entries[id])))
+            id_offset += len(id)
+        for id in ids:
+            f.write(id)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(ids), index_offset))
+    os.replace(tmp_path, out_path)
+    return len(ids)
+
+
+class LazyReferenceMap(Mapping):
+    """
+    Read-only mapping id -> CompactEntry over a compiled dataset. The file is
+    memory-mapped (so its pages are shared between processes) and an entry is
+    only decoded when it's accessed. Lookups are a binary search in the index.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_entries, self.index_offset = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path!r} is not a compiled dataset")
+
+    def __reduce__(self):
+        # an mmap can't be pickled, the other process maps the file again
+        return (LazyReferenceMap, (self.path,))
+
+    def _record(self, i: int) -> Tuple[int, int, int, int]:
+        return RECORD.unpack_from(self.mm, self.index_offset + i * RECORD.size)
+
+    def _key(self, i: int) -> bytes:
+        key_offset, key_len, _, _ = self._record(i)
+        return self.mm[key_offset : key_offset + key_len]
+
+    def _find(self, id: str) -> Optional[int]:
+        target = id.encode()
+        lo, hi = 0, self.n_entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_entries and self._key(lo) == target:
+            return lo
+        return None
+
+    def __contains__(self, id: object) -> bool:
+        return isinstance(id, str) and self._find(id) is not None
+
+    def __getitem__(self, id: str) -> CompactEntry:
+        i = self._find(id)
+        if i is None:
+            raise KeyError(id)
+        _, _, offset, length = self._record(i)
+        return CompactEntry.from_dict(json.loads(self.mm[offset : offset + length]))
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self.n_entries):
+            yield self._key(i).decode()
+
+    def __len__(self) -> int:
+        return self.n_entries
+
+
+class CompiledDataset:
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def build_reference_map(self) -> LazyReferenceMap:
+        """Build a (lazy) reference map for the dataset"""
+        return LazyReferenceMap(self.path)
+
+
+def load_reference_map(json_path: str, compiled_path: str) -> Mapping[str, CompactEntry]:
+    """
+    Returns the lazy reference map of the compiled dataset if it exists and is
+    at least as recent as `json_path`, otherwise loads the json entirely.
+    """
+    if os.path.exists(compiled_path) and (
+        not os.path.exists(json_path) or os.path.getmtime(compiled_path) >= os.path.getmtime(json_path)
+    ):
+        print(f"Using compiled dataset {compiled_path}")
+        return CompiledDataset(compiled_path).build_reference_map()
+    return Dataset.from_json(json_path).build_compact_reference_map()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile dataset.json for lazy loading")
+    parser.add_argument("dataset", help="path to dataset.json")
+    parser.add_argument("output", help="path of the compiled dataset to write")
+    parser.add_argument(
+        "--keep-still-in-progress",
+        action="store_true",
+        help="keep the entries that were still being processed",
+    )
+    args = parser.parse_args()
+
+    n = compile_dataset(args.dataset, args.output, args.keep_still_in_progress)
+    print(f"Wrote {n} entries to {args.output}")
@@ -0,0 +1,291 @@
+"""
+Maven/Gradle dependency cache shared by the build containers.
+
+The cache lives on the host (`DEPS_CACHE_DIR`) and is mounted in every build
+container at CONTAINER_DEPS_PATH: Maven uses `<root>/maven` as its local
+repository and Gradle `<root>/gradle` as its user home. An archive is
+"warmed" once its dependencies are known to be in the cache, either by the
+warm-up command or by an evaluation that compiled and tested successfully
+online; the builds of a warmed archive then run offline, i.e. read only.
+
+Usage (from `src/`):
+    python -m utils.deps_cache report
+    python -m utils.deps_cache warm [ARCHIVE ...] [--all]
+"""
+import argparse, fcntl, json, os, shutil, sys, threading, time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+CONTAINER_DEPS_PATH = "/deps"
+BUILD_SYSTEMS = ("maven", "gradle")
+SIZE_CHECK_INTERVAL = 300   # seconds between two checks of the size of the cache
+EVICT_TO = 0.9   # when over the limit, evicts down to this fraction of it
+
+
+class DepsCache:
+    """
+    Size-bounded dependency cache with a manifest of the warmed archives.
+
+    When the cache grows over `max_bytes`, the least recently downloaded
+    artifacts are evicted and, since any archive might have needed them, all
+    the archives of that build system go back to being built online. The
+    running builds may be reading any artifact, so the eviction is deferred
+    until the cache isn't used: it runs when the last build releases it (new
+    builds wait for the eviction). Only the server evicts, the warm-up CLI
+    doesn't.
+    """
+
+    def __init__(self, root: str, max_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        for build_system in BUILD_SYSTEMS:
+            os.makedirs(os.path.join(root, build_system), exist_ok=True)
+        self.manifest_path = os.path.join(root, "warmed.json")
+        self.lock_path = os.path.join(root, ".lock")
+
+        self.cond = threading.Condition()
+        self.active = 0   # builds using the cache
+        self.evicting = False
+        self.eviction_pending = False   # over the limit, waiting for the running builds to finish
+        self.last_size_check = 0.0
+        self.sizes: Dict[str, int] = {}
+
+        self.offline_runs = 0
+        self.online_runs = 0
+        self.offline_fallbacks = 0
+        self.evictions = 0
+
+    def host_path(self, build_system: str) -> str:
+        return os.path.join(self.root, build_system)
+
+    @staticmethod
+    def container_path(build_system: str) -> str:
+        return f"{CONTAINER_DEPS_PATH}/{build_system}"
+
+    def volumes(self) -> dict:
+        return {self.root: {"bind": CONTAINER_DEPS_PATH, "mode": "rw"}}
+
+    # manifest of the warmed archives, shared with the warm-up CLI (another process)
+
+    @contextmanager
+    def _locked_manifest(self) -> Iterator[Dict[str, dict]]:
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                manifest = self.warmed()
+                yield manifest
+                tmp_path = self.manifest_path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(manifest, f, indent=2, sort_keys=True)
+                os.replace(tmp_path, self.manifest_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def warmed(self) -> Dict[str, dict]:
+        """archive name -> {"build_system", "warmed_at"} of the warmed archives"""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def is_warmed(self, archive: Optional[str]) -> bool:
+        return archive is not None and archive in self.warmed()
+
+    def mark_warmed(self, archive: Optional[str], build_system: str) -> None:
+        if archive is None:
+            return
+        with self._locked_manifest() as manifest:
+            manifest[archive] = {"build_system": build_system, "warmed_at": time.time()}
+
+    def unmark_warmed(self, archive: Optional[str]) -> None:
+        if archive is None:
+            return
+        with self._locked_manifest() as manifest:
+            manifest.pop(archive, None)
+
+    # builds
+
+    def acquire(self) -> None:
+        """To call before a build uses the cache, waits while it's being evicted"""
+        with self.cond:
+            while self.evicting:
+                self.cond.wait()
+            self.active += 1
+
+    def release(self, offline: bool, fell_back: bool = False) -> None:
+        with self.cond:
+            self.active -= 1
+            if offline:
+                self.offline_runs += 1
+            else:
+                self.online_runs += 1
+            if fell_back:
+                self.offline_fallbacks += 1
+            evict = self.eviction_pending and self.active == 0
+            if evict:
+                self.eviction_pending = False
+                self.evicting = True
+            self.cond.notify_all()
+        if evict:
+            threading.Thread(target=self._evict, daemon=True).start()
+        elif not offline:   # only online builds make the cache grow
+            self.check_size_async()
+
+    # size and eviction
+
+    def check_size_async(self, force: bool = False) -> None:
+        with self.cond:
+            if not force and time.time() - self.last_size_check < SIZE_CHECK_INTERVAL:
+                return
+            self.last_size_check = time.time()
+        threading.Thread(target=self.check_size, daemon=True).start()
+
+    def check_size(self) -> None:
+        sizes = {build_system: _dir_size(self.host_path(build_system)) for build_system in BUILD_SYSTEMS}
+        with self.cond:
+            self.sizes = sizes
+        if self.max_bytes <= 0 or sum(sizes.values()) <= self.max_bytes:
+            return
+
+        with self.cond:
+            if self.evicting:
+                return
+            if self.active > 0:
+                self.eviction_pending = True   # evicted by the last release()
+                return
+            self.evicting = True
+        self._evict()
+
+    def _evict(self) -> None:
+        """Evicts down to EVICT_TO of the limit, `evicting` must be set (and no build running)"""
+        with self.cond:
+            sizes = dict(self.sizes)
+        try:
+            units = {
+                build_system: list(_eviction_units(self.host_path(build_system))) for build_system in BUILD_SYSTEMS
+            }
+            sizes = {build_system: _dir_size(self.host_path(build_system)) for build_system in BUILD_SYSTEMS}
+            total = sum(sizes.values())
+            candidates = sorted(
+                ((mtime, build_system, path) for build_system, paths in units.items() for mtime, path in paths)
+            )
+            touched = set()
+            for _, build_system, path in candidates:
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                size = _dir_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                sizes[build_system] -= size
+                touched.add(build_system)
+                self.evictions += 1
+            with self._locked_manifest() as manifest:
+                for archive in [a for a, info in manifest.items() if info["build_system"] in touched]:
+                    del manifest[archive]
+            print(f"[INFO] Dependency cache evicted down to {total / 2**20:.0f} MB ({sorted(touched)} unwarmed)")
+        finally:
+            with self.cond:
+                self.sizes = sizes
+                self.evicting = False
+                self.cond.notify_all()
+
+    def stats(self) -> dict:
+        warmed = self.warmed()
+        with self.cond:
+            return {
+                "size_bytes": dict(self.sizes),
+                "max_bytes": self.max_bytes,
+                "warmed": {
+                    build_system: sum(1 for info in warmed.values() if info["build_system"] == build_system)
+                    for build_system in BUILD_SYSTEMS
+                },
+                "offline_runs": self.offline_runs,
+                "online_runs": self.online_runs,
+                "offline_fallbacks": self.offline_fallbacks,
+                "evictions": self.evictions,
+                "eviction_pending": self.eviction_pending,
+            }
+
+
+def _eviction_units(path: str) -> Iterator[Tuple[float, str]]:
+    """
+    Yields (mtime, path) of the directories that can be evicted on their own:
+    the version directories of the maven repository (they contain the .pom),
+    and the group/module/version directories of the gradle module cache
+    """
+    gradle_files = os.path.join(path, "caches", "modules-2", "files-2.1")
+    if os.path.isdir(gradle_files):
+        for group in os.scandir(gradle_files):
+            for module in os.scandir(group.path):
+                for version in os.scandir(module.path):
+                    yield version.stat().st_mtime, version.path
+        return
+    for root, dirs, files in os.walk(path):
+        if any(name.endswith(".pom") for name in files):
+            dirs.clear()
+            yield os.path.getmtime(root), root
+
+
+def _dir_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass   # removed in the meantime
+    return size
+
+
+def _archives(archives_root: str) -> List[str]:
+    return sorted(name for name in os.listdir(archives_root) if name.endswith("_merged.tar.gz"))
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from utils.env_defaults import set_env_defaults
+
+    set_env_defaults()
+    load_dotenv(override=True)
+
+    from utils.build_handlers import DEPS_CACHE, get_build_handler
+
+    parser = argparse.ArgumentParser(description="Manage the shared Maven/Gradle dependency cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("report", help="list which archives are warmed")
+    warm_parser = subparsers.add_parser("warm", help="pre-seed the cache with the dependencies of archives")
+    warm_parser.add_argument("archives", nargs="*", help="archive names (in ARCHIVES_ROOT)")
+    warm_parser.add_argument("--all", action="store_true", help="warm all the archives that aren't yet")
+    args = parser.parse_args()
+
+    archives_root = os.environ["ARCHIVES_ROOT"]
+    warmed = DEPS_CACHE.warmed()
+
+    if args.command == "report":
+        all_archives = _archives(archives_root)
+        for archive in all_archives:
+            info = warmed.get(archive)
+            status = f"warmed ({info['build_system']}, {time.ctime(info['warmed_at'])})" if info else "not warmed"
+            print(f"{archive}: {status}")
+        n_warmed = sum(1 for archive in all_archives if archive in warmed)
+        print(f"{n_warmed}/{len(all_archives)} archives warmed")
+        for build_system in BUILD_SYSTEMS:
+            print(f"{build_system} cache: {_dir_size(DEPS_CACHE.host_path(build_system)) / 2**20:.0f} MB")
+        sys.exit(0)
+
+    to_warm = args.archives or []
+    if args.all:
+        to_warm += [archive for archive in _archives(archives_root) if archive not in warmed]
+    failed = 0
+    for i, archive in enumerate(to_warm, 1):
+        print(f"[{i}/{len(to_warm)}] warming {archive}...")
+        try:
+            build_handler = get_build_handler(archives_root, archive)
+            with build_handler:
+                build_handler.warm_deps()
+        except Exception as e:
+            failed += 1
+            print(f"[ERROR] {archive} {type(e)}: {e}", file=sys.stderr)
+    print(f"{len(to_warm) - failed}/{len(to_warm)} archives warmed")
+    sys.exit(1 if failed else 0)
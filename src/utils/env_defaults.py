@@ -1,4 +1,4 @@
-import os
+import os, tempfile
 from typing import Any
 
 
@@ -9,8 +9,40 @@ def set(k: str, v: Any):
 def set_env_defaults():
     set("PORT", 45003)
     set("MAX_WORKERS", 5)
+    set("QUEUE_LANES", "comment:2,refinement:3")
+    set("COMMENT_EVAL_PROCESSES", 1)
+    set("MAX_CONCURRENT_BUILDS", 4)
+    set("MIN_CONCURRENT_BUILDS", 0)
+    set("JAVA_PRECHECK_PROCESSES", 2)
+    set("BUILD_BROKER", "")
     set("RESULTS_DIR", "submission_results")
+    set("RESULTS_CACHE_MB", 256)
+    set("CACHE_DIR", "cache")
+    set("COMMENT_CACHE_SIZE", 200_000)
+    set("REFINEMENT_CACHE_SIZE", 20_000)
     set("MOCK_BUILD_HANDLER", False)
     set("DATA_PATH", "data")
     set("DATASET_PATH", os.path.join(os.environ["DATA_PATH"], "dataset.json"))
+    set("COMPILED_DATASET_PATH", os.path.join(os.environ["DATA_PATH"], "dataset.bin"))
+    set("DATASET_WATCH_INTERVAL", 30)
+    set("ADMIN_TOKEN", "")
     set("ARCHIVES_ROOT", os.path.join(os.environ["DATA_PATH"], "archives"))
+    set("WORKSPACE_ROOT", os.path.join(tempfile.gettempdir(), "crab_workspace"))
+    set("REPO_CACHE_DIR", os.path.join(os.environ["WORKSPACE_ROOT"], "repo_cache"))
+    set("REPO_CACHE_SIZE_MB", 20_000)
+    set("REPO_CACHE_STRATEGY", "auto")
+    set("BASELINE_BUILDS", True)
+    set("TEST_SELECTION", "off")
+    set("DEPS_CACHE_DIR", os.path.join(os.environ["CACHE_DIR"], "deps"))
+    set("DEPS_CACHE_SIZE_MB", 30_000)
+    set("COMPILE_TIMEOUT", 3600)
+    set("TEST_TIMEOUT", 3600)
+    set("BUILD_TIMEOUTS_PATH", os.path.join(os.environ["DATA_PATH"], "build_timeouts.json"))
+    set("BUILD_LOG_TAIL_LINES", 300)
+    set("BUILD_LOGS_DIR", "")
+    set("CONTAINER_CPUS", 0)
+    set("CONTAINER_MEMORY", "")
+    set("CONTAINER_POOL_SIZE", 2)
+    set("CONTAINER_MAX_USES", 20)
+    set("CONTAINER_IDLE_TIMEOUT", 600)
+    set("JANITOR_WORKERS", 2)
@@ -2,3 +2,21 @@ class InvalidJsonFormatError(Exception):
     def __init__(self, message='JSON must be an object mapping strings to strings'):
         super().__init__(message)
         self.name = 'InvalidJsonFormatError'
+
+
+class NotAJsonObjectError(ValueError):
+    def __init__(self, message="Submitted json doesn't contain an object"):
+        super().__init__(message)
+        self.name = 'NotAJsonObjectError'
+
+
+class ValueTooLargeError(ValueError):
+    def __init__(self, message="A value of the submitted json is too large"):
+        super().__init__(message)
+        self.name = 'ValueTooLargeError'
+
+
+class DatasetUnavailableError(Exception):
+    def __init__(self, message="The reference dataset isn't loaded"):
+        super().__init__(message)
+        self.name = 'DatasetUnavailableError'
@@ -0,0 +1,178 @@
+"""
+Removal, in the background, of what the builds leave behind: the working
+copies of the repos (up to hundreds of thousands of files) and the build
+containers. The evaluation threads hand them over and move on.
+
+At startup, what was left by processes that crashed is swept. Everything the
+janitor may sweep is tagged with the process that created it (the pid in the
+directory names, the OWNER_LABEL of the containers), so that a process never
+sweeps what belongs to a live one (e.g. the warm-up CLI next to the server).
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os, shutil, socket, sys, threading, uuid
+from typing import Callable, Optional
+
+import docker
+from docker.errors import APIError, ImageNotFound, NotFound
+from docker.models.containers import Container
+
+OWNER_LABEL = "crab.owner"
+TRASH_PREFIX = "crab_trash_"
+# the directories of the workspace created by the builds (see `owned_prefix`)
+SWEPT_PREFIXES = ("crab_repo_", "crab_slot_", TRASH_PREFIX)
+IMAGE_PREFIX = "crab-"   # the build images
+
+
+def owned_prefix(prefix: str) -> str:
+    """Prefix of the directories created by this process, that can be swept once it's gone"""
+    return f"{prefix}{os.getpid()}_"
+
+
+def owner_label() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True   # someone else's
+    return True
+
+
+def _dir_owner(name: str) -> Optional[int]:
+    """The pid in the name of a workspace directory, None if it has none (created before they had one)"""
+    for prefix in SWEPT_PREFIXES:
+        if name.startswith(prefix):
+            pid, sep, _ = name[len(prefix):].partition("_")
+            return int(pid) if sep and pid.isdigit() else None
+    return None
+
+
+class Janitor:
+    """
+    Removes directories and containers on a pool of `max_workers` threads. A
+    directory is first renamed into `root` (same filesystem as the workspace),
+    so that it's gone from where it was right away.
+    """
+
+    def __init__(self, root: str, max_workers: int) -> None:
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="janitor")
+        self.lock = threading.Lock()
+
+        self.pending = 0
+        self.removed_dirs = 0
+        self.removed_containers = 0
+        self.swept_dirs = 0
+        self.swept_containers = 0
+        self.failures = 0
+
+    def _submit(self, fn: Callable, *args) -> None:
+        with self.lock:
+            self.pending += 1
+        self.executor.submit(self._run, fn, *args)
+
+    def _run(self, fn: Callable, *args) -> None:
+        try:
+            fn(*args)
+        except Exception as e:
+            with self.lock:
+                self.failures += 1
+            print(f"[WARNING] Janitor couldn't {fn.__name__.strip('_')} {args[0]} {type(e)}: {e}", file=sys.stderr)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def remove_tree(self, path: str) -> None:
+        """Moves `path` out of the way and removes it in the background"""
+        os.makedirs(self.root, exist_ok=True)
+        trash = os.path.join(self.root, f"{owned_prefix(TRASH_PREFIX)}{uuid.uuid4().hex[:12]}")
+        try:
+            os.rename(path, trash)
+        except FileNotFoundError:
+            return
+        except OSError:
+            trash = path   # on another filesystem, removed where it is
+        self._submit(self._remove_tree, trash)
+
+    def _remove_tree(self, path: str) -> None:
+        shutil.rmtree(path)
+        with self.lock:
+            self.removed_dirs += 1
+
+    def remove_container(self, container: Container, slot_dir: Optional[str] = None) -> None:
+        """Kills and removes `container` in the background, then its working directory"""
+        self._submit(self._remove_container, container, slot_dir)
+
+    def _remove_container(self, container: Container, slot_dir: Optional[str] = None) -> None:
+        try:
+            container.kill()
+        except APIError:
+            pass   # already stopped
+        try:
+            container.remove(force=True)
+        except NotFound:
+            pass
+        with self.lock:
+            self.removed_containers += 1
+        if slot_dir is not None:
+            self._remove_tree(slot_dir)
+
+    # leftovers of crashed processes
+
+    def sweep(self, get_client: Optional[Callable[[], docker.DockerClient]] = None) -> None:
+        """Removes the workspace directories and build containers whose process is gone"""
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                if not name.startswith(SWEPT_PREFIXES):
+                    continue
+                pid = _dir_owner(name)
+                if pid is not None and (pid == os.getpid() or _is_alive(pid)):
+                    continue
+                with self.lock:
+                    self.swept_dirs += 1
+                self._submit(self._remove_tree, os.path.join(self.root, name))
+
+        if get_client is None:
+            return
+        host = socket.gethostname()
+        for container in get_client().containers.list(all=True):
+            owner = container.labels.get(OWNER_LABEL)
+            if owner is None:
+                # started before they were labelled: any container of a build image
+                try:
+                    tags = container.image.tags if container.image is not None else []
+                except (ImageNotFound, APIError):
+                    continue
+                if not any(tag.startswith(IMAGE_PREFIX) for tag in tags):
+                    continue
+            else:
+                owner_host, _, pid = owner.rpartition(":")
+                if owner_host != host or not pid.isdigit() or int(pid) == os.getpid() or _is_alive(int(pid)):
+                    continue
+            with self.lock:
+                self.swept_containers += 1
+            self._submit(self._remove_container, container)
+
+    def sweep_async(self, get_client: Optional[Callable[[], docker.DockerClient]] = None) -> None:
+        def sweep():
+            try:
+                self.sweep(get_client)
+            except Exception as e:
+                print(f"[WARNING] Couldn't sweep the leftovers of previous runs {type(e)}: {e}", file=sys.stderr)
+
+        threading.Thread(target=sweep, daemon=True).start()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "pending": self.pending,
+                "removed_dirs": self.removed_dirs,
+                "removed_containers": self.removed_containers,
+                "swept_dirs": self.swept_dirs,
+                "swept_containers": self.swept_containers,
+                "failures": self.failures,
+            }
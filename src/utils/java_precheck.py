@@ -0,0 +1,53 @@
+"""
+Precheck of the java files of a refinement submission, before anything is
+extracted or built: a file that can't be tokenized (an unterminated string or
+comment, a character that isn't java) won't compile either.
+
+The files are only tokenized, not parsed: javalang only knows the syntax of
+Java 8, so a parser error may well be valid newer java (`var`, switch
+expressions, records, ...), which the build decides. A file is also only
+rejected if its original version (from the pristine tree of the repo cache)
+can be tokenized. Otherwise (a new file, or an archive that isn't cached yet)
+the build decides too.
+"""
+import os
+from typing import Optional
+
+import javalang
+
+
+def lexer_error(source: str) -> Optional[str]:
+    """Why javalang can't tokenize the java source, None if it can"""
+    try:
+        for _ in javalang.tokenizer.tokenize(source):
+            pass
+    except javalang.tokenizer.LexerError as e:
+        return str(e)
+    return None
+
+
+def precheck_changes(changes: dict[str, str], tree: Optional[str]) -> Optional[str]:
+    """
+    The error message of the first java file of `changes` that can't be
+    tokenized while its original version in `tree` can, None if there's none
+    """
+    if tree is None:
+        return None
+    tree = os.path.abspath(tree)
+    for file_path, change in changes.items():
+        if not file_path.endswith(".java"):
+            continue
+        original_path = os.path.abspath(os.path.join(tree, file_path))
+        if os.path.commonpath([tree, original_path]) != tree:
+            continue   # rejected when the changes are injected
+        error = lexer_error(change)
+        if error is None:
+            continue
+        try:
+            with open(original_path, encoding="utf-8", errors="replace") as f:
+                original = f.read()
+        except OSError:
+            continue   # new file (or the tree was evicted in the meantime)
+        if lexer_error(original) is None:
+            return f"[CRAB] {file_path} can't be tokenized: {error}"
+    return None
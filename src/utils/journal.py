@@ -0,0 +1,50 @@
+import json, os, threading
+from typing import Any, Optional
+
+
+class EntryJournal:
+    """
+    Append-only journal of the results of the entries of a submission (one
+    json line per entry), written as they complete, so that an evaluation
+    interrupted by a restart resumes from the entries that are left. A line
+    cut by a crash is dropped when the journal is opened again.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        # entries evaluated before the journal was (re)opened, id -> result
+        self.done: dict[str, Optional[Any]] = self._load()
+        self.file = open(path, "ab")
+
+    def _load(self) -> dict[str, Optional[Any]]:
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        valid = 0   # length of the complete lines
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    id, result = json.loads(line)
+                except ValueError:
+                    break
+                done[id] = result
+                valid += len(line)
+        if valid < os.path.getsize(self.path):
+            os.truncate(self.path, valid)   # the next entry would be appended to the cut line
+        return done
+
+    def append(self, id: str, result: Optional[Any]) -> None:
+        line = json.dumps([id, result]).encode() + b"\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def remove(self) -> None:
+        with self.lock:
+            self.file.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
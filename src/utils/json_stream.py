@@ -0,0 +1,130 @@
+import codecs, hashlib, json
+from json.decoder import scanstring
+from typing import Any, BinaryIO, Iterator, Tuple
+
+from utils.errors import NotAJsonObjectError, ValueTooLargeError
+
+WHITESPACE = " \t\n\r"
+CHUNK_SIZE = 1 << 16
+MAX_VALUE_SIZE = 64 << 20   # characters of a single value (an entry of a submission)
+
+
+class HashingReader:
+    """Wraps a binary stream and hashes (sha256) everything that is read from it"""
+
+    def __init__(self, stream: BinaryIO) -> None:
+        self.stream = stream
+        self.hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.hash.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+
+class _Reader:
+    def __init__(self, stream: BinaryIO, max_value_size: int) -> None:
+        self.stream = stream
+        self.max_value_size = max_value_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, min_size: int = CHUNK_SIZE) -> bool:
+        """Reads at least `min_size` more bytes (unless EOF), returns False if nothing was read"""
+        if self.eof:
+            return False
+        # drop what was already consumed, so that the buffer only holds the current value
+        self.buf = self.buf[self.pos :]
+        self.pos = 0
+        if len(self.buf) >= self.max_value_size:
+            # invalid JSON can't be told from an incomplete value, it would be read until EOF
+            raise ValueTooLargeError(f"A value is over {self.max_value_size} characters")
+        chunk = self.stream.read(max(min_size, CHUNK_SIZE))
+        if not chunk:
+            self.eof = True
+            self.buf += self.decoder.decode(b"", final=True)
+            return False
+        self.buf += self.decoder.decode(chunk)
+        return True
+
+    def skip_whitespace(self) -> None:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return
+
+    def peek(self) -> str:
+        self.skip_whitespace()
+        if self.pos >= len(self.buf):
+            raise json.JSONDecodeError("Unexpected end of file", self.buf, self.pos)
+        return self.buf[self.pos]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buf, self.pos)
+        self.pos += 1
+
+    def read_key(self) -> str:
+        self.expect('"')
+        while True:
+            try:
+                key, end = scanstring(self.buf, self.pos)
+                self.pos = end
+                return key
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+
+    def read_value(self, decoder: json.JSONDecoder) -> Any:
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer might continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # grow geometrically, so that a big value isn't re-parsed once per chunk
+            self.fill(len(self.buf) - self.pos)
+
+
+def iter_object_items(stream: BinaryIO, max_value_size: int = MAX_VALUE_SIZE) -> Iterator[Tuple[str, Any]]:
+    """
+    Incrementally parses a JSON document made of a single object from a binary
+    stream, and yields its (key, value) pairs as soon as they are parsed. Only
+    the value being parsed is held in memory.
+
+    Raises NotAJsonObjectError if the document is not an object,
+    ValueTooLargeError if a key or value is over `max_value_size` characters
+    and json.JSONDecodeError if it isn't valid JSON.
+    """
+    reader = _Reader(stream, max_value_size)
+    decoder = json.JSONDecoder()
+    if reader.peek() != "{":
+        raise NotAJsonObjectError()
+    reader.pos += 1
+
+    if reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.read_key()
+            reader.expect(":")
+            yield key, reader.read_value(decoder)
+            if reader.peek() == "}":
+                reader.pos += 1
+                break
+            reader.expect(",")
+
+    reader.skip_whitespace()
+    if reader.pos < len(reader.buf):
+        raise json.JSONDecodeError("Extra data", reader.buf, reader.pos)
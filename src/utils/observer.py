@@ -1,10 +1,20 @@
 from abc import ABC, abstractmethod
-from datetime import datetime, timedelta
+from datetime import timedelta
 from enum import Enum
-import os, tempfile, threading, json
-from typing import Callable, Optional, Set
+import json, os, sys, tempfile, threading, time
+from typing import Any, Callable, Optional, Set
+from utils.journal import EntryJournal
+from utils.results_store import ResultsStore
+from utils.spool import SpooledSubmission
 
 RESULTS_DIR = os.environ["RESULTS_DIR"]
+# maps "<type>:<sha256 of the uploaded file>" to the id of the subject that evaluates it
+HASH_INDEX_PATH = os.path.join(RESULTS_DIR, ".hash_index.json")
+# payloads and entry journals of the subjects that aren't complete, to resume them after a restart
+PENDING_DIR = os.path.join(RESULTS_DIR, ".pending")
+RESULTS = ResultsStore(RESULTS_DIR, int(os.environ["RESULTS_CACHE_MB"]) * 2**20)
+RESULTS_RETENTION = timedelta(weeks=1).total_seconds()
+EXPIRY_INTERVAL = 3600   # seconds between two removals of the expired results
 
 
 class Status(Enum):
@@ -12,6 +22,7 @@ class Status(Enum):
     WAITING = "waiting"
     PROCESSING = "processing"
     COMPLETE = "complete"
+    FAILED = "failed"
 
 
 class Observer(ABC):
@@ -27,6 +38,14 @@ class Observer(ABC):
     def updateComplete(self, results: dict):
         ...
 
+    @abstractmethod
+    def updateLog(self, entry_id: str, lines: list[str]):
+        ...
+
+    @abstractmethod
+    def updateFailed(self, message: str):
+        ...
+
 
 class SocketObserver(Observer):
     socket2obs: dict[str, "SocketObserver"] = {}
@@ -47,43 +66,110 @@ class SocketObserver(Observer):
         self.socket_emit("complete", results)
         SocketObserver.socket2obs.pop(self.sid)
 
+    def updateLog(self, entry_id: str, lines: list[str]):
+        self.socket_emit("build-log", {'id': entry_id, 'lines': lines})
+
+    def updateFailed(self, message: str):
+        self.socket_emit("failed", {'message': message})
+        SocketObserver.socket2obs.pop(self.sid)
+
 
 class Subject:
     obs2subject: dict[Observer, "Subject"] = {}
     id2subject: dict[str, "Subject"] = {}
+    hash2id: dict[str, str] = {}
+    hash_lock = threading.Lock()
+    # subjects that were waiting or processing when the server stopped, in order of submission
+    interrupted: list["Subject"] = []
 
     @classmethod
     def setup(cls):
         if not os.path.exists(RESULTS_DIR):
             os.mkdir(RESULTS_DIR)
+        os.makedirs(PENDING_DIR, exist_ok=True)
 
-        for file in os.listdir(RESULTS_DIR):
-            file_path = os.path.join(RESULTS_DIR, file)
-            if os.path.getsize(file_path) == 0:
-                # submission was still being processed before the server stopped
-                # the file was created but never written to, therefore must be removed
-                os.remove(file_path)
+        # only the index is read, the results are loaded when they're asked for
+        index = RESULTS.scan()
+        for id, meta in sorted(index.items(), key=lambda item: item[1]["created"]):
+            if meta["status"] == "complete":
+                cls.id2subject[id] = Subject(meta["type"], lambda: None, id=id, status=Status.COMPLETE)
                 continue
+            # submission was still queued or being processed before the server stopped
+            subject = Subject(meta["type"], lambda: None, id=id)   # its task is set when it's resumed
+            if os.path.exists(subject.payload_path()):
+                subject.journal = EntryJournal(subject.journal_path())
+                cls.id2subject[id] = subject
+                cls.interrupted.append(subject)
+            else:
+                # its payload is gone (its task failed), it can't be resumed
+                RESULTS.remove(id)
+
+        # payloads of the uploads and of the subjects that completed while the server stopped
+        resumed = {path for subject in cls.interrupted for path in (subject.payload_path(), subject.journal_path())}
+        for file in os.listdir(PENDING_DIR):
+            if os.path.join(PENDING_DIR, file) not in resumed:
+                os.remove(os.path.join(PENDING_DIR, file))
+        cls._load_hash_index()
+        cls._expire()
+        threading.Thread(target=cls._expire_periodically, daemon=True).start()
+
+    @classmethod
+    def _expire(cls):
+        for id in RESULTS.expired(RESULTS_RETENTION):
+            subject = cls.id2subject.get(id)
+            if subject is not None:
+                subject._rm_results_file()
+            else:
+                RESULTS.remove(id)
+
+    @classmethod
+    def _expire_periodically(cls):
+        # a single thread for all the results, instead of a timer per subject
+        while True:
+            time.sleep(EXPIRY_INTERVAL)
+            try:
+                cls._expire()
+            except Exception as e:
+                print(f"[WARNING] Couldn't remove the expired results {type(e)}: {e}", file=sys.stderr)
+
+    @classmethod
+    def _load_hash_index(cls):
+        if not os.path.exists(HASH_INDEX_PATH):
+            return
+        with open(HASH_INDEX_PATH, "r") as f:
+            index = json.load(f)
+        # submissions that were in-flight when the server stopped don't exist anymore
+        cls.hash2id = {key: id for key, id in index.items() if id in cls.id2subject}
+        for key, id in cls.hash2id.items():
+            cls.id2subject[id].hash_key = key
+        cls._save_hash_index()
 
-            _, type_, *_ = file.split("_")
-            with open(file_path, "r") as f:
-                subject = Subject(
-                    type_, lambda: None, id=file, status=Status.COMPLETE, results=json.load(f)
-                )
-                cls.id2subject[file] = subject
-                # calculate one week from the file's creation time
-                creation_time = os.path.getctime(file_path)
-                created_dt = datetime.fromtimestamp(creation_time)
-                one_week_later = created_dt + timedelta(weeks=1)
-                if one_week_later < datetime.now():
-                    # file is older than one week, remove it
-                    os.remove(file_path)
-                else:
-                    timer = threading.Timer(
-                        (one_week_later - datetime.now()).total_seconds(), subject._rm_results_file
-                    )
-                    timer.daemon = True
-                    timer.start()
+    @classmethod
+    def _save_hash_index(cls):
+        tmp_path = HASH_INDEX_PATH + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cls.hash2id, f)
+        os.replace(tmp_path, HASH_INDEX_PATH)
+
+    @classmethod
+    def get_or_create(cls, type_: str, task: Callable, digest: str) -> tuple["Subject", bool]:
+        """
+        Returns the subject evaluating (or that evaluated) the submission of
+        type `type_` whose content hashes to `digest`, creating a new one if
+        there is none. The boolean tells whether the subject was created.
+        """
+        key = f"{type_}:{digest}"
+        with cls.hash_lock:
+            id = cls.hash2id.get(key)
+            if id is not None and id in cls.id2subject:
+                return cls.id2subject[id], False
+
+            subject = Subject(type_, task)
+            subject.hash_key = key
+            cls.id2subject[subject.id] = subject
+            cls.hash2id[key] = subject.id
+            cls._save_hash_index()
+            return subject, True
 
     def __init__(
         self,
@@ -91,23 +177,51 @@ class Subject:
         task: Callable,
         id: Optional[str] = None,
         status: Status = Status.CREATED,
-        results: Optional[dict] = None,
     ) -> None:
         self.type = type_
         self.observers: Set[Observer] = set()
         self.status: Status = status
-        self.results: Optional[dict] = results
         self.task = task
         self.percent: float = -1
+        self.hash_key: Optional[str] = None
+        self.journal: Optional[EntryJournal] = None
+        self.error: Optional[str] = None   # why its task failed
         if id is None:
             _, self.full_path = tempfile.mkstemp(
                 prefix=f"crab_{type_}_", dir=RESULTS_DIR, text=True
             )
             self.id = os.path.basename(self.full_path)
+            RESULTS.add(self.id, type_)
         else:
             self.full_path = os.path.abspath(os.path.join(RESULTS_DIR, id))
             self.id = id
 
+    @property
+    def results(self) -> Optional[dict]:
+        """Loaded from the results store when it's asked for, None until it's complete"""
+        if self.status != Status.COMPLETE:
+            return None
+        return RESULTS.get(self.id)
+
+    def payload_path(self) -> str:
+        return os.path.join(PENDING_DIR, self.id + ".jsonl")
+
+    def journal_path(self) -> str:
+        return os.path.join(PENDING_DIR, self.id + ".journal")
+
+    def keep(self, payload: SpooledSubmission) -> None:
+        """
+        Keeps the payload of the subject, and a journal of the results of its
+        entries, until it completes, so that it's resumed after a restart.
+        `payload` must be spooled in PENDING_DIR.
+        """
+        payload.move(self.payload_path())
+        self.journal = EntryJournal(self.journal_path())
+
+    def done_entries(self) -> dict[str, Any]:
+        """Results of the entries evaluated before the restart it's resumed from"""
+        return self.journal.done if self.journal is not None else {}
+
     def registerObserver(self, observer: Observer) -> None:
         self.observers.add(observer)
         Subject.obs2subject[observer] = self
@@ -123,24 +237,53 @@ class Subject:
 
     def notifyPercentage(self, percentage: float):
         self.percent = percentage
-        for observer in self.observers:
+        # called from the build threads, while observers may (un)register
+        for observer in list(self.observers):
             observer.updatePercentage(percentage)
 
+    def notifyLog(self, entry_id: str, lines: list[str]):
+        # called from the build threads, while observers may (un)register
+        for observer in list(self.observers):
+            observer.updateLog(entry_id, lines)
+
+    def notifyEntry(self, entry_id: str, result: Any):
+        if self.journal is not None:
+            self.journal.append(entry_id, result)
+
     def notifyComplete(self, results: dict):
+        # stored before the status changes, so that they're there for the status requests,
+        # and before the journal is removed, so that one of them is there whenever the server stops
+        RESULTS.put(self.id, results)
+        if self.journal is not None:
+            self.journal.remove()
+            self.journal = None
         self.status = Status.COMPLETE
-        for observer in self.observers:
+        for observer in list(self.observers):
             observer.updateComplete({"type": self.type, "results": results})
             Subject.obs2subject.pop(observer)
         self.observers.clear()
-        self.results = results
-        with open(self.full_path, "w") as f:
-            json.dump(results, f)
-        delay_seconds = timedelta(weeks=1).total_seconds()
 
-        timer = threading.Timer(delay_seconds, self._rm_results_file)
-        timer.daemon = True
-        timer.start()
+    def notifyFailed(self, message: str):
+        # a new upload of the same file gets a new subject, and it isn't resumed after a restart
+        self._forget_hash()
+        if self.journal is not None:
+            self.journal.remove()
+            self.journal = None
+        RESULTS.remove(self.id)
+        self.error = message
+        self.status = Status.FAILED
+        for observer in list(self.observers):
+            observer.updateFailed(message)
+            Subject.obs2subject.pop(observer)
+        self.observers.clear()
+
+    def _forget_hash(self):
+        with Subject.hash_lock:
+            if self.hash_key is not None and Subject.hash2id.get(self.hash_key) == self.id:
+                Subject.hash2id.pop(self.hash_key)
+                Subject._save_hash_index()
 
     def _rm_results_file(self):
-        if os.path.exists(self.full_path):
-            os.remove(self.full_path)
+        RESULTS.remove(self.id)
+        Subject.id2subject.pop(self.id, None)
+        self._forget_hash()
@@ -1,161 +1,457 @@
-import os
-import sys
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    process,
+    as_completed,
+    wait,
+)
+import math, multiprocessing, os, sys, threading
+from typing import Optional
 from typing_extensions import Callable
-from utils.build_handlers import get_build_handler
-from sacrebleu import sentence_bleu as bleu
-from utils.dataset import ArchiveState, Comment, CommentGenSubmission, Dataset
+from utils.build_broker import BrokerClient, make_broker
+from utils.build_handlers import CONTAINER_POOL, MOCK_BUILD_HANDLER, REPO_CACHE
+from utils.build_jobs import REFINEMENT_STEPS, BuildJob, is_cacheable, run_build_job
+from utils.build_slots import BuildSlots
+from utils.comment_scoring import evaluate_comment, evaluate_shard, init_worker
+from utils.dataset import ArchiveState, CommentGenSubmission
+from utils.java_precheck import precheck_changes
+from utils.references import References, ReferenceStore
+from utils.score_cache import ScoreCache
 
-REFERENCE_MAP = Dataset.from_json(os.environ["DATASET_PATH"]).build_reference_map()
+# loaded in the background, evaluations wait for it (see /api/health)
+REFERENCES = ReferenceStore(os.environ["DATASET_PATH"], os.environ["COMPILED_DATASET_PATH"])
+REFERENCES.reload_async()
+if float(os.environ["DATASET_WATCH_INTERVAL"]) > 0:
+    REFERENCES.watch(float(os.environ["DATASET_WATCH_INTERVAL"]))
 
 ARCHIVES_ROOT = os.environ["ARCHIVES_ROOT"]
 
+COMMENT_EVAL_PROCESSES = int(os.environ["COMMENT_EVAL_PROCESSES"])
+COMMENT_EVAL_MIN_SHARD = 50   # below this, shipping the shard costs more than scoring it
+_COMMENT_POOL: Optional[ProcessPoolExecutor] = None
+_COMMENT_POOL_VERSION: Optional[int] = None   # version of the references given to the pool
+_COMMENT_POOL_LOCK = threading.Lock()
+_COMMENT_POOL_BREAKS = 0   # pools discarded since the start, because a worker died
 
-def comment_distance(submission: CommentGenSubmission, entry: Comment):
-    if entry.from_ is None and entry.to is None:
-        return "NA"
-    if submission.from_ is None and submission.to is None:
-        return "NA"
+CACHE_DIR = os.environ["CACHE_DIR"]
+COMMENT_CACHE = ScoreCache(
+    os.path.join(CACHE_DIR, "comment_scores.sqlite"), int(os.environ["COMMENT_CACHE_SIZE"])
+)
+REFINEMENT_CACHE = ScoreCache(
+    os.path.join(CACHE_DIR, "refinement_outcomes.sqlite"), int(os.environ["REFINEMENT_CACHE_SIZE"])
+)
 
-    # Collapse missing endpoints to the one defined endpoint
-    # For entry:
-    start1 = entry.from_ if entry.from_ is not None else entry.to
-    end1 = entry.to if entry.to is not None else entry.from_
-    # For submission:
-    start2 = submission.from_ if submission.from_ is not None else submission.to
-    end2 = submission.to if submission.to is not None else submission.from_
+# global cap on the number of entries being built (i.e. containers running) at the same time,
+# across all the refinement submissions
+MAX_CONCURRENT_BUILDS = int(os.environ["MAX_CONCURRENT_BUILDS"])
+BUILD_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_BUILDS, thread_name_prefix="build")
+# the builds actually running at the same time, between MIN_CONCURRENT_BUILDS and
+# MAX_CONCURRENT_BUILDS depending on the load of the host
+BUILD_SLOTS = BuildSlots(
+    int(os.environ["MIN_CONCURRENT_BUILDS"]) or MAX_CONCURRENT_BUILDS,
+    MAX_CONCURRENT_BUILDS,
+    CONTAINER_POOL.leased_containers,
+)
+BUILD_SLOTS.start()
+# if set, the entries are built by build workers (see build_worker) instead of the build executor
+BROKER_CLIENT = BrokerClient(make_broker(os.environ["BUILD_BROKER"])) if os.environ["BUILD_BROKER"] else None
 
-    # Now both start1,end1 and start2,end2 are non-None
-    # Normalize in case from > to (just in case):
-    if start1 > end1:
-        start1, end1 = end1, start1
-    if start2 > end2:
-        start2, end2 = end2, start2
+# the submitted java files are parsed there before their entry gets on the build executor
+# (forkserver, like the comment pool: a forked worker could inherit a lock held by a thread)
+JAVA_PRECHECK_PROCESSES = int(os.environ["JAVA_PRECHECK_PROCESSES"])
+PRECHECK_EXECUTOR = (
+    ProcessPoolExecutor(
+        max_workers=JAVA_PRECHECK_PROCESSES, mp_context=multiprocessing.get_context("forkserver")
+    )
+    if JAVA_PRECHECK_PROCESSES > 0
+    else None
+)
 
-    # Check for overlap
-    if end1 >= start2 and end2 >= start1:
-        return 0
 
-    # Otherwise compute gap
-    if end1 < start2:
-        return start2 - end1
-    else:  # end2 < start1
-        return start1 - end2
+def _get_comment_pool(references: References) -> ProcessPoolExecutor:
+    global _COMMENT_POOL, _COMMENT_POOL_VERSION
+    with _COMMENT_POOL_LOCK:
+        if _COMMENT_POOL is not None and _COMMENT_POOL_VERSION != references.version:
+            # the dataset was reloaded: the shards already submitted to the old
+            # pool still complete, then its processes exit
+            _COMMENT_POOL.shutdown(wait=False)
+            _COMMENT_POOL = None
+        if _COMMENT_POOL is None:
+            # forkserver: the server is multithreaded, a forked worker could inherit a lock
+            # held by another thread. The reference data is sent to each worker once
+            # (a compiled dataset is mapped again, not copied)
+            _COMMENT_POOL = ProcessPoolExecutor(
+                max_workers=COMMENT_EVAL_PROCESSES,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=init_worker,
+                initargs=(references,),
+            )
+            _COMMENT_POOL_VERSION = references.version
+        return _COMMENT_POOL
+
+
+def _discard_comment_pool(pool: ProcessPoolExecutor) -> None:
+    """Drops the pool (if it's still the current one), the next evaluation starts a new one"""
+    global _COMMENT_POOL
+    with _COMMENT_POOL_LOCK:
+        if _COMMENT_POOL is pool:
+            _COMMENT_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def comment_pool_stats() -> dict:
+    with _COMMENT_POOL_LOCK:
+        return {
+            "processes": COMMENT_EVAL_PROCESSES,
+            "running": _COMMENT_POOL is not None,
+            "dataset_version": _COMMENT_POOL_VERSION if _COMMENT_POOL is not None else None,
+            "breaks": _COMMENT_POOL_BREAKS,
+        }
+
+
+def _evaluate_comments_parallel(
+    answers: dict[str, CommentGenSubmission],
+    references: References,
+    progress_cb: Callable[[int], None],
+) -> dict:
+    global _COMMENT_POOL_BREAKS
+    total = len(answers)
+    items = list(answers.items())
+    # a few shards per process, so that the progress keeps moving
+    shard_size = max(COMMENT_EVAL_MIN_SHARD, math.ceil(total / (COMMENT_EVAL_PROCESSES * 4)))
+    shards = [items[i : i + shard_size] for i in range(0, total, shard_size)]
+    pool = _get_comment_pool(references)
+
+    merged = {}
+    done = 0
+    scored = set()   # indexes of the shards scored by the pool
+    try:
+        futures = {pool.submit(evaluate_shard, shard): i for i, shard in enumerate(shards)}
+        for future in as_completed(futures):
+            merged.update(future.result())
+            scored.add(futures[future])
+            done += len(shards[futures[future]])
+            progress_cb(done)
+    except process.BrokenProcessPool as e:
+        # a worker died (e.g. killed by the OOM killer): the pool can't be used anymore
+        print(f"[WARNING] The comment pool broke, scoring the rest here {type(e)}: {e}", file=sys.stderr)
+        _COMMENT_POOL_BREAKS += 1
+        _discard_comment_pool(pool)
+        for i, shard in enumerate(shards):
+            if i in scored:
+                continue
+            for id_, submission in shard:
+                result = evaluate_comment(id_, submission, references)
+                if result is not None:
+                    merged[id_] = result
+                done += 1
+                progress_cb(done)
+    return merged
+
+
+def _evaluate_comments_serial(
+    answers: dict[str, CommentGenSubmission],
+    references: References,
+    progress_cb: Callable[[int], None],
+) -> dict:
+    results = {}
+    for i, (id_, submission) in enumerate(answers.items(), 1):
+        # print(f"[INFO] Processing {id_} ({i}/{len(answers)}: {i/len(answers):.2%})...")
+        result = evaluate_comment(id_, submission, references)
+        if result is None:
+            continue
+        results[id_] = result
+        progress_cb(i)
+    return results
+
+
+def _comment_cache_key(
+    id_: str, submission: CommentGenSubmission, references: References
+) -> str:
+    # the reference is part of the key, so that a reloaded dataset doesn't
+    # return stale scores for the entries whose reference changed
+    entry = references.reference_map.get(id_)
+    reference = None
+    if entry is not None:
+        comment = entry.comments[0]
+        reference = [comment.body, comment.paraphrases, comment.file, comment.from_, comment.to]
+    return ScoreCache.key(id_, [submission.__dict__, reference])
 
 
 def evaluate_comments(
     answers: dict[str, CommentGenSubmission],
     percent_cb: Callable[[float], None] = lambda _: None,
     complete_cb: Callable[[dict], None] = lambda _: None,
+    log_cb: Callable[[str, list[str]], None] = lambda *_: None,   # nothing is built
+    # not journaled: the scores are cached, a resumed submission gets them from the cache
+    entry_cb: Callable[[str, Optional[dict]], None] = lambda *_: None,
+    done: Optional[dict] = None,
 ):
     # print("Started processing comments...")
+    references = REFERENCES.current()   # kept for the whole evaluation, even if reloaded
     total = len(answers)
+    keys = {
+        id_: _comment_cache_key(id_, submission, references) for id_, submission in answers.items()
+    }
+    hits = COMMENT_CACHE.get_many(keys.values())
+    cached = {id_: hits[key] for id_, key in keys.items() if key in hits}
+    to_evaluate = {id_: answers[id_] for id_, key in keys.items() if key not in hits}
+
+    def progress_cb(n_evaluated: int):
+        percent_cb(int((len(cached) + n_evaluated) / total * 100))
+
+    if COMMENT_EVAL_PROCESSES > 1 and len(to_evaluate) > COMMENT_EVAL_MIN_SHARD:
+        evaluated = _evaluate_comments_parallel(to_evaluate, references, progress_cb)
+    else:
+        evaluated = _evaluate_comments_serial(to_evaluate, references, progress_cb)
+
+    COMMENT_CACHE.put_many((keys[id_], result) for id_, result in evaluated.items())
+
+    # keep the order of the submission
     results = {}
-    for i, (id_, submission) in enumerate(answers.items(), 1):
-        # print(f"[INFO] Processing {id_} ({i}/{total}: {i/total:.2%})...")
-        if id_ not in REFERENCE_MAP:
-            print(f"[WARNING] skipping {id} since it is not present in dataset", file=sys.stderr)
-            continue
-        entry = REFERENCE_MAP[id_]
-        max_score = 0
-        scores = []
-        # print(f"[INFO] Processing paraphrases...")
-        for p in [entry.comments[0].body] + entry.comments[0].paraphrases:
-            score = round(bleu(submission.body, [p]).score, 2)
-            scores.append(score)
-            max_score = max(max_score, score)
-
-        correct_file = submission.path == entry.comments[0].file
-        # print(f"[INFO] Getting distance...")
-        if correct_file:
-            distance = comment_distance(submission, entry.comments[0])
-        else:
-            distance = "NA"
-
-        # print(f"[INFO] Populating result...")
-        results[id_] = {
-            'max_bleu_score': max_score,
-            'bleu_scores': scores,
-            'proposed_comment': submission.__dict__,
-            'correct_file': correct_file,
-            'distance': distance,
-        }
-        percent_cb(int(i / total * 100))
+    for id_ in answers:
+        if id_ in cached:
+            results[id_] = cached[id_]
+        elif id_ in evaluated:
+            results[id_] = evaluated[id_]
 
     # print(f"[INFO] Sending results...")
     complete_cb(results)
     return results
 
 
+class _Progress:
+    """Thread-safe progress over a fixed number of steps, reported as a percentage"""
+
+    def __init__(self, total_steps: int, percent_cb: Callable[[float], None]) -> None:
+        self.total_steps = total_steps
+        self.done_steps = 0
+        self.percent_cb = percent_cb
+        self.lock = threading.Lock()
+
+    def advance(self, n_steps: int = 1) -> None:
+        with self.lock:   # also keeps the reported percentages in order
+            self.done_steps += n_steps
+            self.percent_cb(self.done_steps / self.total_steps * 100)
+
+
+def _refinement_job(id: str, changes: dict[str, str], references: References) -> Optional[BuildJob]:
+    """The build of entry `id`, None if it's not in the dataset"""
+    if id not in references.reference_map:
+        print(f"[WARNING] skipping {id} since it is not present in dataset", file=sys.stderr)
+        return None
+    entry = references.reference_map[id]
+    return BuildJob(
+        id=id,
+        archive_name=entry.metadata.archive_name(ArchiveState.MERGED),
+        changes=changes,
+        label=f"{entry.metadata.repo} #PR {entry.metadata.pr_number}",
+    )
+
+
+def _refinement_cache_key(job: BuildJob) -> str:
+    return ScoreCache.key(job.id, [job.changes, job.archive_name])
+
+
+def _evaluate_refinement_entry(
+    id: str,
+    changes: dict[str, str],
+    references: References,
+    progress: _Progress,
+    log_cb: Callable[[str, list[str]], None] = lambda *_: None,
+) -> Optional[dict]:
+    """
+    Builds and tests entry `id` with the submitted changes injected, passing
+    the lines of the build output to `log_cb(id, lines)` as they come. Always
+    advances `progress` by REFINEMENT_STEPS, whatever happens. Returns None if
+    the entry couldn't be evaluated.
+    """
+    done_steps = 0
+
+    def step():
+        nonlocal done_steps
+        done_steps += 1
+        progress.advance()
+
+    try:
+        job = _refinement_job(id, changes, references)
+        if job is None:
+            return None
+        cache_key = _refinement_cache_key(job)
+        cached = REFINEMENT_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+        with BUILD_SLOTS:
+            result = run_build_job(job, ARCHIVES_ROOT, step, lambda lines: log_cb(id, lines))
+        if not MOCK_BUILD_HANDLER and is_cacheable(result):
+            REFINEMENT_CACHE.put(cache_key, result)
+        # print(f"[INFO] Done with {id}...")
+        return result
+    finally:
+        if done_steps < REFINEMENT_STEPS:
+            progress.advance(REFINEMENT_STEPS - done_steps)
+
+
+def _submit_remote_refinement_entry(
+    id: str,
+    changes: dict[str, str],
+    references: References,
+    progress: _Progress,
+    log_cb: Callable[[str, list[str]], None],
+) -> Future:
+    """Same as _evaluate_refinement_entry, but built by a build worker (see build_broker)"""
+    assert BROKER_CLIENT is not None
+    outcome: Future = Future()
+    job = _refinement_job(id, changes, references)
+    cache_key = _refinement_cache_key(job) if job is not None else None
+    cached = REFINEMENT_CACHE.get(cache_key) if cache_key is not None else None
+    if job is None or cached is not None:
+        progress.advance(REFINEMENT_STEPS)
+        outcome.set_result(cached)
+        return outcome
+
+    done_steps = 0
+    steps_lock = threading.Lock()
+
+    def steps_cb(n_steps: int):
+        nonlocal done_steps
+        with steps_lock:
+            # a job run again (its worker died) reports its steps again
+            n_steps = min(n_steps, REFINEMENT_STEPS - done_steps)
+            done_steps += n_steps
+        if n_steps > 0:
+            progress.advance(n_steps)
+
+    def on_done(build: Future):
+        result = build.result()
+        try:
+            if not MOCK_BUILD_HANDLER and is_cacheable(result):
+                REFINEMENT_CACHE.put(cache_key, result)
+        finally:
+            steps_cb(REFINEMENT_STEPS)
+            outcome.set_result(result)
+
+    build = BROKER_CLIENT.submit(job, steps_cb, lambda lines: log_cb(id, lines))
+    build.add_done_callback(on_done)
+    return outcome
+
+
+def _dispatch_refinement_entry(
+    id: str,
+    changes: dict[str, str],
+    references: References,
+    progress: _Progress,
+    log_cb: Callable[[str, list[str]], None],
+) -> Future:
+    """Evaluates entry `id` on the build executor, or on a build worker if there's a broker"""
+    if BROKER_CLIENT is not None:
+        return _submit_remote_refinement_entry(id, changes, references, progress, log_cb)
+    return BUILD_EXECUTOR.submit(_evaluate_refinement_entry, id, changes, references, progress, log_cb)
+
+
+def _submit_refinement_entry(
+    id: str,
+    changes: dict[str, str],
+    references: References,
+    progress: _Progress,
+    log_cb: Callable[[str, list[str]], None],
+) -> Future:
+    """
+    Evaluates entry `id` (see _dispatch_refinement_entry), once its java files
+    passed the precheck. The precheck runs on its own pool, so that an entry
+    with a broken file never takes a build slot (it fails to compile right
+    away). Its verdict isn't cached: it's only as good as javalang's tokenizer,
+    the cache is left to the builds.
+    """
+    entry = references.reference_map.get(id)
+    if PRECHECK_EXECUTOR is None or entry is None or not any(path.endswith(".java") for path in changes):
+        return _dispatch_refinement_entry(id, changes, references, progress, log_cb)
+
+    archive_name = entry.metadata.archive_name(ArchiveState.MERGED)
+    tree = REPO_CACHE.tree_path(os.path.join(ARCHIVES_ROOT, archive_name))
+    outcome: Future = Future()
+
+    def forward(build: Future):
+        try:
+            outcome.set_result(build.result())
+        except BaseException as e:
+            outcome.set_exception(e)
+
+    def after_precheck(precheck: Future):
+        try:
+            error = precheck.result()
+        except Exception as e:
+            print(f"[WARNING] Couldn't precheck {id} {type(e)}: {e}", file=sys.stderr)
+            error = None
+        try:
+            if error is None:
+                build = _dispatch_refinement_entry(id, changes, references, progress, log_cb)
+                build.add_done_callback(forward)
+                return
+            result = {"compilation": False, "compilation_error_msg": error}
+            log_cb(id, [error])
+            progress.advance(REFINEMENT_STEPS)
+            outcome.set_result(result)
+        except BaseException as e:   # it runs in a callback, nobody else would see it
+            outcome.set_exception(e)
+
+    PRECHECK_EXECUTOR.submit(precheck_changes, changes, tree).add_done_callback(after_precheck)
+    return outcome
+
+
 def evaluate_refinement(
     answers: dict[str, dict[str, str]],
     percent_cb: Callable[[float], None] = lambda _: None,
     complete_cb: Callable[[dict], None] = lambda _: None,
+    log_cb: Callable[[str, list[str]], None] = lambda *_: None,
+    entry_cb: Callable[[str, Optional[dict]], None] = lambda *_: None,
+    done: Optional[dict] = None,
 ):
-    n_answers = len(answers)
-    n_steps = 4   # creating build handler + injecting the files in the repo + compilation + testing
-    total_number_of_steps = n_answers * n_steps
-    current_progress = 0
-    results = {}
-    for i, (id, changes) in enumerate(answers.items()):
-        # print(f"[INFO] Processing {id} ({i}/{n_answers}: {i/n_answers:.2%})...")
-        current_progress = i * n_steps
-        percent_cb(current_progress / total_number_of_steps * 100)
-        if id not in REFERENCE_MAP:
-            print(f"[WARNING] skipping {id} since it is not present in dataset", file=sys.stderr)
-            continue
-        entry = REFERENCE_MAP[id]
-        # print(f"[INFO] {id} info: {entry.metadata.repo} #PR {entry.metadata.pr_number}")
-        try:
-            build_handler = get_build_handler(
-                ARCHIVES_ROOT, entry.metadata.archive_name(ArchiveState.MERGED)
-            )
-            current_progress += 1
-            percent_cb(current_progress / total_number_of_steps * 100)
-        except Exception as e:
-            print(
-                f"[ERROR] {id} ({entry.metadata.repo} #PR {entry.metadata.pr_number}) {type(e)}: {e}",
-                file=sys.stderr,
-            )
-            continue
+    """
+    Evaluates the entries of `answers`, passing the result of each (None if it
+    couldn't be evaluated) to `entry_cb` as soon as it's known. The entries in
+    `done` (their results before a restart) aren't evaluated again.
+    """
+    references = REFERENCES.current()   # kept for the whole evaluation, even if reloaded
+    done = done or {}
+    progress = _Progress(max(1, len(answers) * REFINEMENT_STEPS), percent_cb)
+    progress.advance(sum(REFINEMENT_STEPS for id in answers if id in done))
 
-        results[id] = {}
-        try:
-            build_handler.inject_changes(changes)
-        except Exception as e:
-            results[id]["changes_injection"] = False
-            results[id]["changes_injection_error_msg"] = str(e)
-            print(
-                f"[ERROR] {id} ({entry.metadata.repo} #PR {entry.metadata.pr_number}) {type(e)}: {e}",
-                file=sys.stderr,
-            )
-            continue
+    # the entries are fanned out on the build executor, shared by all the
+    # submissions. Only a window of them is handed over at a time, so that a
+    # spooled submission isn't loaded in memory all at once
+    window = 2 * MAX_CONCURRENT_BUILDS
+    evaluated = {id: result for id, result in done.items() if result is not None}
+    pending: dict[Future, str] = {}
 
-        current_progress += 1
-        percent_cb(current_progress / total_number_of_steps * 100)
-
-        with build_handler:
-            steps = [
-                ("compilation", build_handler.compile_repo),
-                ("test", build_handler.test_repo),
-            ]
-            for task, action in steps:
-                try:
-                    # print(f"[INFO] Executing {task}...")
-                    action()
-                    # print(f"[INFO] {task} executed successfully on {id}")
-                    results[id][task] = True
-                    current_progress += 1
-                    percent_cb(current_progress / total_number_of_steps * 100)
-                except Exception as e:
-                    results[id][task] = False
-                    results[id][task + "_error_msg"] = str(e)
-                    print(
-                        f"[ERROR] {id} ({entry.metadata.repo} #PR {entry.metadata.pr_number}) {type(e)}: {e}",
-                        file=sys.stderr,
-                    )
-                    break
+    def collect(futures):
+        for future in futures:
+            id = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                # e.g. docker or the checkout failed: only this entry isn't evaluated
+                print(f"[ERROR] {id} {type(e)}: {e}", file=sys.stderr)
+                log_cb(id, [f"[CRAB] The entry couldn't be evaluated: {type(e).__name__}: {e}"])
+                result = None
+            entry_cb(id, result)
+            if result is not None:
+                evaluated[id] = result
 
-        # print(f"[INFO] Done with {id}...")
+    for id, changes in answers.items():
+        if id in done:
+            continue
+        # print(f"[INFO] Queueing {id}...")
+        future = _submit_refinement_entry(id, changes, references, progress, log_cb)
+        pending[future] = id
+        if len(pending) >= window:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(finished)
+    collect(list(pending))
 
+    # keep the order of the submission
+    results = {id: evaluated[id] for id in answers if id in evaluated}
     complete_cb(results)
     return results
@@ -1,28 +1,86 @@
+from bisect import bisect_left, insort
 from concurrent.futures import Future, ThreadPoolExecutor
-from collections import deque
+from collections import defaultdict
+import itertools, threading
+from typing import Optional
 from utils.observer import Subject, Status
+from utils.spool import SpooledSubmission
 import traceback
 
+# (virtual start, expected cost, arrival): the order in which the subjects of a lane start
+QueueKey = tuple[float, float, int]
+
+
+class _Lane:
+    def __init__(self, name: str, max_workers: int) -> None:
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"lane-{name}")
+        self.queue: list[QueueKey] = []   # sorted
+        self.waiting: dict[QueueKey, tuple[Subject, tuple, dict]] = {}
+        self.running = 0
+        self.virtual_time = 0.0   # virtual start of the last subject started
+        self.client_finish: dict[str, float] = defaultdict(float)   # virtual finish of their last subject
+
 
 class QueueManager:
     """
-    Manages a queue of Subjects, handling status transitions and allowing position queries:
-      CREATED -> WAITING -> PROCESSING -> COMPLETE
+    Manages the queues of Subjects, handling status transitions and allowing position queries:
+      CREATED -> WAITING -> PROCESSING -> COMPLETE (or FAILED if its task raises)
+
+    Each type of submission has its own lane, with its own number of workers,
+    so that short jobs of a type don't wait behind long jobs of another. In a
+    lane, the clients get a fair share (start-time fair queueing, by expected
+    cost): a subject virtually starts when the previous subject of its client
+    virtually finishes, or now if it's later. The subjects are started in the
+    order of their virtual start, the shortest first when it's the same (e.g.
+    the first subject of each client), then in order of arrival.
     """
 
-    def __init__(self, max_workers: int = 5) -> None:
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)
-        self.wait_queue: deque[str] = deque()
+    def __init__(self, lanes: dict[str, int], default_workers: int = 5) -> None:
+        self.lanes = {name: _Lane(name, max_workers) for name, max_workers in lanes.items()}
+        self.default_workers = default_workers
+        # reentrant: a task that is already done when it's dispatched calls back right away
+        self.lock = threading.RLock()
+        self.keys: dict[str, tuple[_Lane, QueueKey]] = {}   # id of a waiting subject -> where it's queued
+        self.arrivals = itertools.count()
+
+    def _lane(self, type_: str) -> _Lane:
+        if type_ not in self.lanes:
+            self.lanes[type_] = _Lane(type_, self.default_workers)
+        return self.lanes[type_]
+
+    def submit(self, subject: Subject, *args, client: str = "", cost: float = 1, **kwargs) -> None:
+        """`cost` is the expected cost of the subject (e.g. its number of entries)"""
+        with self.lock:
+            subject.status = Status.WAITING
+            lane = self._lane(subject.type)
+            start = max(lane.virtual_time, lane.client_finish[client])
+            lane.client_finish[client] = start + cost
+            key = (start, cost, next(self.arrivals))
+            insort(lane.queue, key)
+            lane.waiting[key] = (subject, args, kwargs)
+            self.keys[subject.id] = (lane, key)
+            self._dispatch(lane)
 
-    def submit(self, subject: Subject, *args, **kwargs) -> None:
-        subject.status = Status.WAITING
-        # Add to waiting queue
-        self.wait_queue.append(subject.id)
-        # Schedule the task on the executor
-        future = self.executor.submit(self._run, subject, *args, **kwargs)
-        future.add_done_callback(self._on_task_done)
+    def _dispatch(self, lane: _Lane) -> None:
+        # with the lock held
+        while lane.queue and lane.running < lane.max_workers:
+            key = lane.queue.pop(0)
+            subject, args, kwargs = lane.waiting.pop(key)
+            del self.keys[subject.id]
+            lane.virtual_time = key[0]
+            lane.running += 1
+            # the executor has as many workers as the lane, it never queues
+            future = lane.executor.submit(self._run, subject, *args, **kwargs)
+            future.add_done_callback(lambda fut, lane=lane: self._on_task_done(lane, fut))
 
-    def _on_task_done(self, fut: Future) -> None:
+    def _on_task_done(self, lane: _Lane, fut: Future) -> None:
+        with self.lock:
+            lane.running -= 1
+            if not lane.queue:
+                # idle: nobody is behind, the clients start over on an equal footing
+                lane.client_finish.clear()
+            self._dispatch(lane)
         exc = fut.exception()
         if exc is not None:
             # print exception and stack
@@ -31,25 +89,52 @@ class QueueManager:
 
     def get_position(self, subject_id: str) -> int:
         """
-        Returns 1-based position in waiting queue, or 0 if not waiting.
+        Returns 1-based position in the queue of its lane, or 0 if not waiting.
         """
-        try:
-            # index returns 0-based, so +1
-            return self.wait_queue.index(subject_id) + 1
-        except ValueError:
-            return 0
+        with self.lock:
+            queued: Optional[tuple[_Lane, QueueKey]] = self.keys.get(subject_id)
+            if queued is None:
+                return 0
+            lane, key = queued
+            return bisect_left(lane.queue, key) + 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                name: {"workers": lane.max_workers, "running": lane.running, "waiting": len(lane.queue)}
+                for name, lane in self.lanes.items()
+            }
 
     def _run(self, subject: Subject, *args, **kwargs) -> None:
-        # Remove from waiting queue as it's now processing
-        try:
-            self.wait_queue.remove(subject.id)
-        except ValueError:
-            pass
         subject.notifyStarted()
         # Execute the user-defined task synchronously in this worker thread
-        subject.task(
-            *args,
-            percent_cb=subject.notifyPercentage,
-            complete_cb=subject.notifyComplete,
-            **kwargs,
-        )
+        try:
+            subject.task(
+                *args,
+                percent_cb=subject.notifyPercentage,
+                complete_cb=subject.notifyComplete,
+                log_cb=subject.notifyLog,
+                entry_cb=subject.notifyEntry,
+                done=subject.done_entries(),
+                **kwargs,
+            )
+        except Exception as e:
+            subject.notifyFailed(f"{type(e).__name__}: {e}")
+            raise   # printed by _on_task_done
+        finally:
+            # the submission was spooled to disk during the upload, it's no longer needed
+            # (if the task failed, it isn't resumed either)
+            for arg in args:
+                if isinstance(arg, SpooledSubmission):
+                    arg.close()
+
+
+def parse_lanes(spec: str) -> dict[str, int]:
+    """Parses the lanes spec, e.g. "comment:2,refinement:3" -> {"comment": 2, "refinement": 3}"""
+    lanes = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, max_workers = part.partition(":")
+        lanes[name.strip()] = int(max_workers)
+    return lanes
@@ -0,0 +1,114 @@
+from collections import Counter, OrderedDict
+import sys, threading
+from typing import List, Mapping, Optional, Tuple
+from sacrebleu import sentence_bleu
+from sacrebleu.metrics.bleu import BLEU
+from utils.dataset import CompactEntry
+
+# the statistics are computed with internals of sacrebleu (pinned in requirements.txt), if they
+# change the references are scored with `sentence_bleu` again
+try:
+    from sacrebleu.metrics.helpers import extract_all_word_ngrams
+
+    PRECOMPUTED = hasattr(BLEU, "_preprocess_segment") and hasattr(BLEU, "_compute_score_from_stats")
+except ImportError:
+    PRECOMPUTED = False
+if not PRECOMPUTED:
+    print("[WARNING] This version of sacrebleu can't score precomputed references", file=sys.stderr)
+
+LAZY_STATS_SIZE = 50_000   # entries whose statistics a lazy index keeps
+
+# (n-gram counts, length) of one tokenized reference
+RefStats = Tuple[Counter, int]
+
+
+class ReferenceIndex:
+    """
+    Precomputed BLEU statistics of the reference comments.
+
+    For every entry, the body and the paraphrases of `comments[0]` are
+    tokenized and their n-grams counted once, so that scoring a submission only
+    needs to tokenize the hypothesis. The scores are the same as the ones given
+    by `sacrebleu.sentence_bleu(hypothesis, [reference])`.
+
+    With `eager=False`, the statistics of an entry are computed the first time
+    it's scored, so that a lazy reference map isn't loaded entirely, and only
+    the LAZY_STATS_SIZE most recently scored entries are kept.
+    """
+
+    def __init__(self, reference_map: Mapping[str, CompactEntry], eager: bool = True) -> None:
+        # same configuration as the one used by `sacrebleu.sentence_bleu`
+        self.metric = BLEU(smooth_method="exp", effective_order=True)
+        self.max_order: int = self.metric.max_ngram_order
+        self.reference_map = reference_map
+        self.max_stats: Optional[int] = None if eager else LAZY_STATS_SIZE
+        self.stats: OrderedDict[str, List[RefStats]] = OrderedDict()
+        self.lock = threading.Lock()
+        if eager and PRECOMPUTED:
+            for id_, entry in reference_map.items():
+                self.stats[id_] = self._build_entry(entry)
+
+    def __getstate__(self) -> dict:
+        # sent to the worker processes of the comment pool, a lock can't be pickled
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def _entry_stats(self, id_: str) -> List[RefStats]:
+        with self.lock:
+            stats = self.stats.get(id_)
+            if stats is not None:
+                self.stats.move_to_end(id_)
+                return stats
+        stats = self._build_entry(self.reference_map[id_])
+        with self.lock:
+            self.stats[id_] = stats
+            while self.max_stats is not None and len(self.stats) > self.max_stats:
+                self.stats.popitem(last=False)
+        return stats
+
+    def _build_entry(self, entry: CompactEntry) -> List[RefStats]:
+        return [self._ref_stats(ref) for ref in self._references(entry)]
+
+    @staticmethod
+    def _references(entry: CompactEntry) -> Tuple[str, ...]:
+        comment = entry.comments[0]
+        return (comment.body, *comment.paraphrases)
+
+    def _ref_stats(self, reference: str) -> RefStats:
+        tokenized = self.metric._preprocess_segment(reference)
+        return extract_all_word_ngrams(tokenized, 1, self.max_order)
+
+    def __contains__(self, id_: str) -> bool:
+        return id_ in self.reference_map
+
+    def bleu_scores(self, id_: str, hypothesis: str) -> List[float]:
+        """
+        Returns the BLEU score (rounded to 2 decimals) of `hypothesis` against
+        the body and each paraphrase of the reference comment of entry `id_`,
+        in that order.
+        """
+        if not PRECOMPUTED:
+            return [
+                round(sentence_bleu(hypothesis, [ref]).score, 2) for ref in self._references(self.reference_map[id_])
+            ]
+        hyp_ngrams, hyp_len = extract_all_word_ngrams(
+            self.metric._preprocess_segment(hypothesis), 1, self.max_order
+        )
+
+        scores = []
+        for ref_ngrams, ref_len in self._entry_stats(id_):
+            correct = [0] * self.max_order
+            total = [0] * self.max_order
+            for ngram, count in hyp_ngrams.items():
+                n = len(ngram) - 1
+                total[n] += count
+                if ngram in ref_ngrams:
+                    correct[n] += min(count, ref_ngrams[ngram])
+            score = self.metric._compute_score_from_stats([hyp_len, ref_len] + correct + total)
+            scores.append(round(score.score, 2))
+        return scores
@@ -0,0 +1,131 @@
+from dataclasses import dataclass
+import os, sys, threading, time, traceback
+from typing import Mapping, Optional, Tuple
+
+from utils.dataset import CompactEntry
+from utils.dataset_store import LazyReferenceMap, load_reference_map
+from utils.errors import DatasetUnavailableError
+from utils.reference_index import ReferenceIndex
+
+
+@dataclass
+class References:
+    """One loaded version of the reference dataset"""
+
+    version: int
+    reference_map: Mapping[str, CompactEntry]
+    index: ReferenceIndex
+    loaded_at: float
+
+
+class ReferenceStore:
+    """
+    Holds the current version of the reference dataset and reloads it in the
+    background (on demand or when the dataset files change), swapping the new
+    version in atomically once it's fully built. An evaluation takes the
+    current version once, with `current()`, and keeps using it until it's done
+    even if a reload happens in the meantime.
+
+    If the first load fails, `current()` raises until the files are fixed
+    (the watcher retries whenever they change) or reloaded on demand.
+    """
+
+    def __init__(self, json_path: str, compiled_path: str) -> None:
+        self.json_path = json_path
+        self.compiled_path = compiled_path
+        self._current: Optional[References] = None
+        self._ready = threading.Event()
+        self._reload_lock = threading.Lock()   # one reload at a time
+        self._attempted = threading.Condition()   # notified at the end of each reload
+        self.loading = False
+        self.last_error: Optional[str] = None
+        self._files_signature: Tuple = ()
+
+    def _signature(self) -> Tuple:
+        signature = []
+        for path in (self.json_path, self.compiled_path):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def reload(self) -> None:
+        """Builds the new version and swaps it in, blocks until it's done"""
+        with self._reload_lock:
+            self.loading = True
+            signature: Tuple = ()
+            try:
+                signature = self._signature()
+                reference_map = load_reference_map(self.json_path, self.compiled_path)
+                index = ReferenceIndex(
+                    reference_map, eager=not isinstance(reference_map, LazyReferenceMap)
+                )
+                version = 1 if self._current is None else self._current.version + 1
+                self._current = References(version, reference_map, index, time.time())
+                self.last_error = None
+                self._ready.set()
+                print(f"[INFO] Reference dataset version {version} loaded ({len(reference_map)} entries)")
+            except Exception as e:
+                # the previous version (if any) keeps being served
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"[ERROR] Couldn't load the reference dataset: {self.last_error}", file=sys.stderr)
+                traceback.print_exc()
+            finally:
+                # the watcher doesn't load the same files again, whether they could be loaded or not
+                self._files_signature = signature
+                with self._attempted:
+                    self.loading = False
+                    self._attempted.notify_all()
+
+    def reload_async(self) -> bool:
+        """Starts a reload in the background, returns False if one is already running"""
+        if self._reload_lock.locked():
+            return False
+        thread = threading.Thread(target=self.reload, daemon=True)
+        thread.start()
+        return True
+
+    def watch(self, interval: float) -> None:
+        """Reloads the dataset whenever its files change, checking every `interval` seconds"""
+
+        def _watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    # also retries a first load that failed, once the files are fixed
+                    if not self.loading and self._signature() != self._files_signature:
+                        print("[INFO] Reference dataset changed on disk, reloading...")
+                        self.reload()
+                except Exception as e:
+                    print(f"[WARNING] Couldn't check the reference dataset files {type(e)}: {e}", file=sys.stderr)
+
+        thread = threading.Thread(target=_watch, daemon=True)
+        thread.start()
+
+    def current(self) -> References:
+        """
+        Returns the current version, waiting for the first one to be loaded.
+        Raises DatasetUnavailableError if it couldn't be.
+        """
+        with self._attempted:
+            while self._current is None:
+                if self.last_error is not None and not self.loading:
+                    raise DatasetUnavailableError(f"The reference dataset couldn't be loaded: {self.last_error}")
+                self._attempted.wait()
+            return self._current
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def status(self) -> dict:
+        current = self._current
+        return {
+            "ready": self.is_ready(),
+            "loading": self.loading,
+            "version": current.version if current else None,
+            "entries": len(current.reference_map) if current else None,
+            "loaded_at": current.loaded_at if current else None,
+            "last_error": self.last_error,
+        }
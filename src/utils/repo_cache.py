@@ -0,0 +1,396 @@
+import json, os, re, shutil, stat, subprocess, sys, tarfile, tempfile, threading, time
+from collections import defaultdict
+from typing import Dict, Iterator, Optional
+
+# directories the builds write into: always really copied in the working copies,
+# so that an in-place write there can't reach the pristine tree
+BUILD_OUTPUT_DIRS = {"target", "build", ".gradle"}
+BUILD_FILES = {"pom.xml", "build.gradle", "build.gradle.kts", "settings.gradle", "settings.gradle.kts"}
+
+COPY_STRATEGIES = ("reflink", "hardlink", "copy")
+
+
+def detach_file(path: str) -> None:
+    """
+    Makes sure `path` can be modified in place without touching any other
+    tree, i.e. replaces it by a private (and writable) copy if it's a hardlink
+    """
+    if not os.path.isfile(path):
+        return
+    st = os.stat(path)
+    if st.st_nlink <= 1 and st.st_mode & stat.S_IWUSR:
+        return
+    tmp_path = f"{path}.crab-detach"
+    shutil.copyfile(path, tmp_path)
+    os.chmod(tmp_path, stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+    os.replace(tmp_path, path)
+
+
+def _copy_tree(src: str, dst: str, link: bool) -> None:
+    """Copies the content of `src` in (the existing) `dst`, hardlinking the files if `link`"""
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        dst_root = os.path.normpath(os.path.join(dst, rel_root))
+        in_build_output = any(part in BUILD_OUTPUT_DIRS for part in rel_root.split(os.sep))
+        for name in dirs:
+            src_dir = os.path.join(root, name)
+            if os.path.islink(src_dir):
+                os.symlink(os.readlink(src_dir), os.path.join(dst_root, name))
+            else:
+                os.mkdir(os.path.join(dst_root, name))
+                shutil.copymode(src_dir, os.path.join(dst_root, name))
+        for name in files:
+            src_file = os.path.join(root, name)
+            dst_file = os.path.join(dst_root, name)
+            if os.path.islink(src_file):
+                os.symlink(os.readlink(src_file), dst_file)
+            elif link and not in_build_output:
+                os.link(src_file, dst_file)
+            else:
+                shutil.copy2(src_file, dst_file)
+                if link:   # the pristine file is read-only (see RepoCache)
+                    os.chmod(dst_file, os.stat(dst_file).st_mode | stat.S_IWUSR)
+
+
+class RepoCache:
+    """
+    Cache of pristine extracted trees of the repo archives, keyed by archive
+    name, mtime and size, bounded to `max_bytes` with LRU eviction.
+
+    `checkout` gives each evaluation its own working copy of the tree, as cheap
+    as the filesystem allows:
+      - reflink: copy-on-write clones of the files (btrfs, xfs, ...),
+      - hardlink: a farm of hardlinks to the pristine files, which are made
+        read-only so that an in-place write fails instead of corrupting the
+        cache (use `detach_file` before writing to a file of a working copy),
+      - copy: a plain copy.
+    The pristine trees must be on the same filesystem as the working copies
+    for reflinks and hardlinks. With `max_bytes` = 0, the archive is extracted
+    directly in the working copy, every time.
+
+    The build outputs of a baseline build of the archive (see
+    `store_baseline`) are kept alongside its tree and added to the working
+    copies, so that the builds of the entries can be incremental.
+    """
+
+    def __init__(self, root: str, max_bytes: int, strategy: str = "auto") -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        if strategy == "auto":
+            strategy = self._detect_strategy()
+        elif strategy not in COPY_STRATEGIES:
+            raise ValueError(f"Unknown copy strategy {strategy!r}, expected one of {COPY_STRATEGIES}")
+        self.strategy = strategy
+
+        self.lock = threading.Lock()
+        self.key_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self.baseline_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self.in_use: Dict[str, int] = defaultdict(int)   # checkouts being copied, per key
+        self.sizes: Dict[str, int] = {}
+        self.archives: Dict[str, str] = {}
+        self._load()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.extract_time = 0.0
+        self.checkout_time = 0.0
+
+    def _detect_strategy(self) -> str:
+        probe_dir = tempfile.mkdtemp(prefix=".probe_", dir=self.root)
+        try:
+            src = os.path.join(probe_dir, "src")
+            with open(src, "w") as f:
+                f.write("probe")
+            reflink = subprocess.run(
+                ["cp", "--reflink=always", src, os.path.join(probe_dir, "reflink")],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            if reflink.returncode == 0:
+                return "reflink"
+            try:
+                os.link(src, os.path.join(probe_dir, "hardlink"))
+                return "hardlink"
+            except OSError:
+                return "copy"
+        except OSError:
+            return "copy"
+        finally:
+            shutil.rmtree(probe_dir, ignore_errors=True)
+
+    def _load(self) -> None:
+        """Picks up the trees extracted by a previous run, drops the incomplete ones"""
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            meta_path = os.path.join(path, "meta.json")
+            if name.startswith("."):
+                shutil.rmtree(path, ignore_errors=True)   # extraction or probe that didn't finish
+                continue
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                self.sizes[name] = meta["size"]
+                self.archives[name] = meta["archive"]
+            except (OSError, ValueError, KeyError):
+                _rmtree(path)
+
+    @staticmethod
+    def key(archive_path: str) -> str:
+        st = os.stat(archive_path)
+        name = re.sub(r"[^\w.-]", "_", os.path.basename(archive_path))
+        return f"{name}-{st.st_mtime_ns}-{st.st_size}"
+
+    def _tree(self, key: str) -> str:
+        return os.path.join(self.root, key, "tree")
+
+    def _outputs(self, key: str) -> str:
+        return os.path.join(self.root, key, "outputs")
+
+    def _read_baseline(self, key: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.root, key, "baseline.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _extract(self, archive_path: str, key: str) -> None:
+        start = time.time()
+        tmp_dir = tempfile.mkdtemp(prefix=".extract_", dir=self.root)
+        try:
+            tree = os.path.join(tmp_dir, "tree")
+            os.mkdir(tree)
+            extract_archive(archive_path, tree)
+            size = _tree_size(tree)
+            if self.strategy == "hardlink":
+                _make_read_only(tree)
+            with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+                json.dump({"archive": os.path.basename(archive_path), "size": size}, f)
+            os.rename(tmp_dir, os.path.join(self.root, key))
+        except BaseException:
+            _rmtree(tmp_dir)
+            raise
+
+        with self.lock:
+            self.sizes[key] = size
+            self.archives[key] = os.path.basename(archive_path)
+            self.extract_time += time.time() - start
+            # older versions of the same archive won't be used anymore
+            stale = [k for k, a in self.archives.items() if a == self.archives[key] and k != key]
+        for stale_key in stale:
+            self._evict(stale_key)
+
+    def _evict(self, key: str) -> bool:
+        with self.lock:
+            if self.in_use[key] > 0 or key not in self.sizes:
+                return False
+            del self.sizes[key]
+            del self.archives[key]
+            self.evictions += 1
+            # renamed first so that it disappears from the cache atomically
+            doomed = os.path.join(self.root, f".evicted_{key}")
+            os.rename(os.path.join(self.root, key), doomed)
+        _rmtree(doomed)
+        return True
+
+    def _evict_lru(self) -> None:
+        while True:
+            with self.lock:
+                if sum(self.sizes.values()) <= self.max_bytes:
+                    return
+                candidates = sorted(
+                    (k for k in self.sizes if self.in_use[k] == 0),
+                    key=lambda k: os.path.getmtime(os.path.join(self.root, k, "meta.json")),
+                )
+            if len(candidates) <= 1:
+                return   # the one just used is kept even if it's bigger than the cache
+            self._evict(candidates[0])
+
+    def checkout(self, archive_path: str, dest: str) -> bool:
+        """
+        Fills the (existing, empty) directory `dest` with a working copy of the
+        archive. Returns whether the outputs of the baseline build were included.
+        """
+        if self.max_bytes <= 0:
+            extract_archive(archive_path, dest)
+            return False
+
+        key = self.key(archive_path)
+        with self.lock:
+            key_lock = self.key_locks[key]
+        with key_lock:   # the same archive is extracted only once
+            with self.lock:
+                hit = key in self.sizes
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if not hit:
+                self._extract(archive_path, key)
+            with self.lock:
+                self.in_use[key] += 1
+            os.utime(os.path.join(self.root, key, "meta.json"))   # LRU timestamp
+            baseline = self._read_baseline(key)
+            with_outputs = baseline is not None and baseline["ok"]
+
+        start = time.time()
+        try:
+            self._copy(self._tree(key), dest)
+            if with_outputs:
+                self._copy(self._outputs(key), dest, link=False)
+        finally:
+            with self.lock:
+                self.in_use[key] -= 1
+                self.checkout_time += time.time() - start
+        self._evict_lru()
+        return with_outputs
+
+    def tree_path(self, archive_path: str) -> Optional[str]:
+        """The pristine tree of the archive if it's cached (don't modify it)"""
+        if self.max_bytes <= 0:
+            return None
+        key = self.key(archive_path)
+        with self.lock:
+            return self._tree(key) if key in self.sizes else None
+
+    def sidecar_path(self, archive_path: str, name: str) -> Optional[str]:
+        """Where to keep data derived from the tree of the archive, evicted along with it"""
+        if self.tree_path(archive_path) is None:
+            return None
+        return os.path.join(self.root, self.key(archive_path), name)
+
+    def baseline_lock(self, archive_path: str) -> threading.Lock:
+        """Held while the baseline of the archive is being built, so it's built only once"""
+        with self.lock:
+            return self.baseline_locks[self.key(archive_path)]
+
+    def baseline(self, archive_path: str) -> Optional[dict]:
+        """The baseline build of the archive ({"ok", "build_system", ...}) if it was attempted"""
+        if self.max_bytes <= 0:
+            return None
+        return self._read_baseline(self.key(archive_path))
+
+    def store_baseline(self, archive_path: str, working_copy: Optional[str], info: dict) -> None:
+        """
+        Records the baseline build of the archive, described by `info` (with at
+        least "ok"). If it succeeded, the build output directories of
+        `working_copy` are kept to be added to the next working copies.
+        """
+        key = self.key(archive_path)
+        with self.lock:
+            if key not in self.sizes:
+                return   # evicted in the meantime
+        tmp_dir = tempfile.mkdtemp(prefix=".outputs_", dir=self.root)
+        try:
+            size = 0
+            if info["ok"] and working_copy is not None:
+                for rel_path in _build_output_dirs(working_copy):
+                    shutil.copytree(
+                        os.path.join(working_copy, rel_path), os.path.join(tmp_dir, rel_path), symlinks=True
+                    )
+                size = _tree_size(tmp_dir)
+                os.rename(tmp_dir, self._outputs(key))
+            with open(os.path.join(self.root, key, "baseline.json.tmp"), "w") as f:
+                json.dump(info, f)
+            os.replace(os.path.join(self.root, key, "baseline.json.tmp"), os.path.join(self.root, key, "baseline.json"))
+        except OSError as e:
+            print(f"[WARNING] couldn't store the baseline of {archive_path}: {e}", file=sys.stderr)
+            return
+        finally:
+            if os.path.exists(tmp_dir):   # not renamed
+                _rmtree(tmp_dir)
+
+        with self.lock:
+            if key not in self.sizes:
+                return
+            self.sizes[key] += size
+            meta = {"archive": self.archives[key], "size": self.sizes[key]}
+        with open(os.path.join(self.root, key, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    def _copy(self, tree: str, dest: str, link: bool = True) -> None:
+        if not link and self.strategy != "reflink":
+            shutil.copytree(tree, dest, symlinks=True, dirs_exist_ok=True)
+        elif self.strategy == "reflink":
+            subprocess.run(
+                ["cp", "-a", "--reflink=always", f"{tree}/.", dest],
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+        else:
+            _copy_tree(tree, dest, link=self.strategy == "hardlink")
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "strategy": self.strategy,
+                "trees": len(self.sizes),
+                "size_bytes": sum(self.sizes.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0,
+                "evictions": self.evictions,
+                "extract_seconds": self.extract_time,
+                "checkout_seconds": self.checkout_time,
+            }
+
+
+def extract_archive(archive_path: str, dest: str) -> None:
+    """
+    Extracts the .tar.gz `archive_path` in `dest`. The decompression is done by
+    an external `pigz`/`gzip` when available (in parallel with the extraction),
+    by the gzip module otherwise.
+    """
+    decompressor = shutil.which("pigz") or shutil.which("gzip")
+    if decompressor is None:
+        with tarfile.open(archive_path, "r:gz") as tar:
+            tar.extractall(dest)
+        return
+
+    proc = subprocess.Popen([decompressor, "-dc", archive_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert proc.stdout is not None
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+            tar.extractall(dest)
+    finally:
+        proc.stdout.close()
+        _, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise tarfile.ReadError(f"{decompressor} failed on {archive_path}: {stderr.decode().strip()}")
+
+
+def _build_output_dirs(path: str) -> Iterator[str]:
+    """Relative paths of the build output directories (next to a build file) in `path`"""
+    for root, dirs, files in os.walk(path):
+        if BUILD_FILES.isdisjoint(files):
+            continue
+        for name in [d for d in dirs if d in BUILD_OUTPUT_DIRS]:
+            dirs.remove(name)
+            yield os.path.relpath(os.path.join(root, name), path)
+
+
+def _tree_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+def _make_read_only(path: str) -> None:
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                os.chmod(file_path, os.stat(file_path).st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _rmtree(path: str) -> None:
+    try:
+        shutil.rmtree(path)
+    except OSError as e:
+        print(f"[WARNING] couldn't remove {path}: {e}", file=sys.stderr)
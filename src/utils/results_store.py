@@ -0,0 +1,149 @@
+"""
+Results of the submissions: one json file per submission, listed in a small
+index (id -> type, status, times) so that the server starts without reading
+them. Their content is read when it's asked for, and the most recently used
+ones are kept in memory, up to a total size.
+"""
+from collections import OrderedDict
+import json, os, threading, time
+from typing import Any, Optional
+
+INDEX_FILE = ".index.json"
+
+
+class ResultsStore:
+    def __init__(self, root: str, max_cached_bytes: int) -> None:
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self.max_cached_bytes = max_cached_bytes
+        self.lock = threading.Lock()
+        # id -> {"type", "status": "pending"|"complete", "created", "completed", "size"}
+        self.index: dict[str, dict] = {}
+        self.cache: OrderedDict[str, tuple[Any, int]] = OrderedDict()   # id -> (results, size of the file)
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, id: str) -> str:
+        return os.path.join(self.root, id)
+
+    def _save_index(self) -> None:
+        # with the lock held
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def scan(self) -> dict[str, dict]:
+        """
+        Loads the index and reconciles it with the results files (only the
+        metadata of the ones missing from the index is read). Returns a copy
+        of the index.
+        """
+        with self.lock:
+            index = {}
+            if os.path.exists(self.index_path):
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+            with os.scandir(self.root) as entries:
+                files = {entry.name: entry for entry in entries if entry.is_file() and not entry.name.startswith(".")}
+            for name, entry in files.items():
+                if name in index:
+                    continue
+                # written before there was an index, or the index wasn't saved
+                stat = entry.stat()
+                _, type_, *_ = name.split("_")
+                index[name] = {
+                    "type": type_,
+                    "status": "complete" if stat.st_size > 0 else "pending",
+                    "created": stat.st_ctime,
+                    "completed": stat.st_ctime if stat.st_size > 0 else None,
+                    "size": stat.st_size,
+                }
+            # the files that were removed by hand
+            self.index = {id: meta for id, meta in index.items() if id in files}
+            self._save_index()
+            return {id: dict(meta) for id, meta in self.index.items()}
+
+    def add(self, id: str, type_: str) -> None:
+        """Indexes the (empty) results file of a new submission"""
+        with self.lock:
+            self.index[id] = {"type": type_, "status": "pending", "created": time.time(), "completed": None, "size": 0}
+            self._save_index()
+
+    def put(self, id: str, results: Any) -> None:
+        path = self._path(id)
+        tmp_path = os.path.join(self.root, f".{id}.tmp")   # the file is complete or not there
+        with open(tmp_path, "w") as f:
+            json.dump(results, f)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self.lock:
+            meta = self.index.setdefault(id, {"type": id.split("_")[1], "created": time.time()})
+            meta.update(status="complete", completed=time.time(), size=size)
+            self._save_index()
+            # it's likely to be asked for right away
+            self._cache(id, results, size)
+
+    def _cache(self, id: str, results: Any, size: int) -> None:
+        # with the lock held
+        if size > self.max_cached_bytes:
+            return
+        if id in self.cache:
+            self.cached_bytes -= self.cache.pop(id)[1]
+        self.cache[id] = (results, size)
+        self.cached_bytes += size
+        while self.cached_bytes > self.max_cached_bytes:
+            _, (_, evicted_size) = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted_size
+
+    def get(self, id: str) -> Optional[Any]:
+        """The results of submission `id`, None if they aren't there (anymore)"""
+        with self.lock:
+            if id in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(id)
+                return self.cache[id][0]
+            meta = self.index.get(id)
+            if meta is None or meta["status"] != "complete":
+                return None
+            self.misses += 1
+        try:
+            # concurrent misses may both read it, the results are the same
+            with open(self._path(id), "r") as f:
+                results = json.load(f)
+        except FileNotFoundError:
+            return None   # removed meanwhile
+        with self.lock:
+            if id in self.index:
+                self._cache(id, results, self.index[id]["size"])
+        return results
+
+    def remove(self, id: str) -> None:
+        with self.lock:
+            self.index.pop(id, None)
+            if id in self.cache:
+                self.cached_bytes -= self.cache.pop(id)[1]
+            self._save_index()
+        if os.path.exists(self._path(id)):
+            os.remove(self._path(id))
+
+    def expired(self, retention: float) -> list[str]:
+        """The ids of the results completed more than `retention` seconds ago"""
+        deadline = time.time() - retention
+        with self.lock:
+            return [
+                id
+                for id, meta in self.index.items()
+                if meta["status"] == "complete" and meta["completed"] < deadline
+            ]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "results": sum(meta["status"] == "complete" for meta in self.index.values()),
+                "cached": len(self.cache),
+                "cached_bytes": self.cached_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,104 @@
+import hashlib, json, os, sqlite3, threading, time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+class ScoreCache:
+    """
+    Bounded, persistent (sqlite) cache of per-entry evaluation results.
+
+    Keys are built with `ScoreCache.key(entry_id, payload)` where `payload` is
+    whatever was submitted for that entry, so the same prediction for the same
+    entry is only evaluated once across submissions. When the cache grows over
+    `max_entries`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int) -> None:
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.conn.commit()
+        self.size: int = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(entry_id: str, payload: Any) -> str:
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        return f"{entry_id}:{digest}"
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, dict]:
+        """Returns the cached values of the given keys, missing keys are left out"""
+        now = time.time()
+        found = {}
+        with self.lock:
+            for key in keys:
+                row = self.conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+                found[key] = json.loads(row[0])
+            self.conn.commit()
+        return found
+
+    def put(self, key: str, value: dict) -> None:
+        self.put_many([(key, value)])
+
+    def put_many(self, items: Iterable[Tuple[str, dict]]) -> None:
+        now = time.time()
+        with self.lock:
+            for key, value in items:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, last_used) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), now),
+                )
+                # over-estimated when a key is replaced, recounted before evicting
+                self.size += 1
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        if self.size <= self.max_entries:
+            return
+        self.size = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        excess = self.size - self.max_entries
+        if excess <= 0:
+            return
+        self.conn.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self.evictions += excess
+        self.size -= excess
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.commit()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self.size,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0,
+            }
@@ -0,0 +1,81 @@
+from collections.abc import Mapping
+import json, os, tempfile, threading
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+
+class SpooledSubmission(Mapping):
+    """
+    Read-only mapping id -> submission backed by a file on disk (one json line
+    per entry), so that a validated submission doesn't have to be held in
+    memory. Only the ids and their offset in the file are kept in memory, the
+    entries are read (and decoded with `decode`) when accessed.
+    """
+
+    def __init__(
+        self, decode: Callable[[Any], Any] = lambda x: x, dir: Optional[str] = None
+    ) -> None:
+        fd, self.path = tempfile.mkstemp(prefix="crab_spool_", suffix=".jsonl", dir=dir)
+        self.file = os.fdopen(fd, "w+b")
+        self.decode = decode
+        self.offsets: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def reopen(cls, path: str, decode: Callable[[Any], Any] = lambda x: x) -> "SpooledSubmission":
+        """The submission spooled in `path` (see `move`), e.g. before a restart"""
+        spool = cls.__new__(cls)
+        spool.path = path
+        spool.file = open(path, "r+b")
+        spool.decode = decode
+        spool.offsets = {}
+        spool.lock = threading.Lock()
+        offset = 0
+        for line in spool.file:
+            spool.offsets[json.loads(line)[0]] = offset
+            offset += len(line)
+        return spool
+
+    def move(self, path: str) -> None:
+        """Moves the file to `path` (on the same filesystem), durably, to be reopened later"""
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            os.replace(self.path, path)
+            self.path = path
+
+    def append(self, id: str, value: Any) -> None:
+        with self.lock:
+            self.file.seek(0, os.SEEK_END)
+            # a duplicated id overrides the previous one, like json.loads does
+            self.offsets[id] = self.file.tell()
+            self.file.write(json.dumps([id, value]).encode() + b"\n")
+
+    def __getitem__(self, id: str) -> Any:
+        offset = self.offsets[id]
+        with self.lock:
+            self.file.seek(offset)
+            line = self.file.readline()
+        return self.decode(json.loads(line)[1])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:   # type: ignore
+        # sequential read of the file instead of one seek per entry
+        with self.lock:
+            self.file.flush()
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                id, value = json.loads(line)
+                if self.offsets.get(id) == offset:
+                    yield id, self.decode(value)
+                offset += len(line)
+
+    def close(self) -> None:
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
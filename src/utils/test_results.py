@@ -0,0 +1,106 @@
+"""
+Test results of a build, read from the JUnit XML reports that Surefire
+(`target/surefire-reports/TEST-*.xml`) and Gradle
+(`build/test-results/<task>/TEST-*.xml`) write for every test class, in all
+the modules of the repo.
+"""
+from dataclasses import dataclass
+import os
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, Optional
+
+from utils.repo_cache import BUILD_OUTPUT_DIRS
+
+REPORT_DIRS = {"surefire-reports", "test-results"}
+
+
+@dataclass
+class TestClassResult:
+    tests: int = 0
+    failures: int = 0
+    errors: int = 0
+    skipped: int = 0
+    time: float = 0.0   # seconds
+
+
+def find_reports(repo_path: str, since: Optional[float] = None) -> Iterator[str]:
+    """
+    The JUnit XML reports in the build output directories of all the modules
+    of the repo, only those written after `since` if given (the reports of an
+    earlier run may still be around)
+    """
+    for root, dirs, files in os.walk(repo_path):
+        # the reports are in the build outputs of the modules, not in their sources
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d != "src"]
+        parts = os.path.relpath(root, repo_path).split(os.sep)
+        if not any(part in REPORT_DIRS for part in parts) or not any(part in BUILD_OUTPUT_DIRS for part in parts):
+            continue
+        for name in files:
+            if not (name.startswith("TEST-") and name.endswith(".xml")):
+                continue
+            path = os.path.join(root, name)
+            if since is not None and os.path.getmtime(path) < since:
+                continue
+            yield path
+
+
+def parse_report(path: str, results: Dict[str, TestClassResult]) -> None:
+    """
+    Adds the test cases of the report at `path` to `results` (test class ->
+    result), streaming it: the elements are dropped once counted, so the size
+    of the captured outputs doesn't matter
+    """
+    current: Optional[TestClassResult] = None
+    outcome: Optional[str] = None
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "testcase":
+                class_name = elem.get("classname") or elem.get("name") or "?"
+                current = results.setdefault(class_name, TestClassResult())
+                outcome = None
+                try:
+                    current.time += float(elem.get("time") or 0)
+                except ValueError:
+                    pass   # e.g. "1,234.5" with some locales
+            elif current is not None and outcome is None and elem.tag in ("failure", "error", "skipped"):
+                outcome = elem.tag   # only the first one counts (reruns add flakyFailure & co)
+            continue
+
+        if elem.tag == "testcase" and current is not None:
+            current.tests += 1
+            if outcome == "failure":
+                current.failures += 1
+            elif outcome == "error":
+                current.errors += 1
+            elif outcome == "skipped":
+                current.skipped += 1
+            current = None
+        elem.clear()   # everything needed was read at its start
+
+
+def collect_results(repo_path: str, since: Optional[float] = None) -> Dict[str, TestClassResult]:
+    """The results per test class, aggregated over all the reports of the repo"""
+    results: Dict[str, TestClassResult] = {}
+    for path in find_reports(repo_path, since):
+        try:
+            parse_report(path, results)
+        except ET.ParseError:
+            continue   # truncated (e.g. the JVM crashed while writing it)
+    return results
+
+
+def totals(results: Dict[str, TestClassResult]) -> dict:
+    """The n_tests* fields of the results"""
+    total = TestClassResult()
+    for result in results.values():
+        total.tests += result.tests
+        total.failures += result.failures
+        total.errors += result.errors
+        total.skipped += result.skipped
+    return {
+        "n_tests": total.tests,
+        "n_tests_passed": total.tests - (total.failures + total.errors),
+        "n_tests_failed": total.failures,
+        "n_tests_errors": total.errors,
+        "n_tests_skipped": total.skipped,
+    }
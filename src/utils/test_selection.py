@@ -0,0 +1,305 @@
+"""
+Selection of the test classes affected by a change, from a static
+class-dependency index of the Java sources of the repo.
+
+A file references another one if it uses (as a token) the simple name of a
+type declared in it, and that type is visible: same package, imported (single
+type, on demand or static import) or written fully qualified. This
+over-approximates the dependencies, so that the selection errs on the side of
+running more tests. What a static index can't see (reflection, dependency
+injection by name, resources, ...) is what the verification mode is for.
+"""
+from collections import OrderedDict, defaultdict, deque
+import json, os, re, sys, threading, time
+from typing import Dict, Iterable, List, Optional, Set
+
+import javalang
+
+from utils.repo_cache import BUILD_OUTPUT_DIRS, RepoCache
+
+MODES = ("off", "on", "verify")
+INDEX_FILE = "test_index.json"
+INDEX_MEMORY_SIZE = 32   # indexes kept in memory (the others are reloaded from the repo cache)
+MAX_SELECTED = 500   # over that, running the whole suite is simpler (and the command line shorter)
+
+# the test classes run by default by Surefire (and the usual names with Gradle)
+TEST_CLASS_NAME = re.compile(r"^(Test\w*|\w*Test|\w*Tests|\w*TestCase)$")
+IDENTIFIER = re.compile(r"[A-Za-z_$][\w$]*")
+
+
+def _tokenize(source: str) -> dict:
+    """Package, declared types, imports and used identifiers of a Java source file"""
+    package = ""
+    types: Set[str] = set()
+    imports: List[str] = []
+    on_demand: List[str] = []
+    identifiers: Set[str] = set()
+    chains: Set[str] = set()
+
+    try:
+        tokens = list(javalang.tokenizer.tokenize(source))
+    except (javalang.tokenizer.LexerError, TypeError, IndexError):
+        # not lexable: every identifier-looking word counts (which over-approximates)
+        words = set(IDENTIFIER.findall(source))
+        return {"package": None, "types": [], "imports": [], "on_demand": [], "identifiers": sorted(words), "chains": []}
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        value = token.value
+        if isinstance(token, javalang.tokenizer.Identifier):
+            identifiers.add(value)
+            # dotted chain a.b.C (possibly a fully qualified name)
+            j, parts = i, [value]
+            while (
+                j + 2 < len(tokens)
+                and tokens[j + 1].value == "."
+                and isinstance(tokens[j + 2], javalang.tokenizer.Identifier)
+            ):
+                parts.append(tokens[j + 2].value)
+                identifiers.add(tokens[j + 2].value)
+                j += 2
+            if len(parts) > 1:
+                chains.add(".".join(parts))
+            i = j + 1
+            continue
+        if isinstance(token, javalang.tokenizer.Keyword) and value in ("package", "import"):
+            j, parts = i + 1, []
+            while j < len(tokens) and tokens[j].value != ";":
+                if isinstance(tokens[j], javalang.tokenizer.Identifier) or tokens[j].value == "*":
+                    parts.append(tokens[j].value)
+                j += 1
+            if value == "package":
+                package = ".".join(parts)
+                i = j + 1
+                continue
+            identifiers.update(part for part in parts if part != "*")
+            if parts and parts[-1] == "*":
+                on_demand.append(".".join(parts[:-1]))
+            else:
+                imports.append(".".join(parts))
+            i = j + 1
+            continue
+        if (
+            value in ("class", "interface", "enum", "record")
+            and i + 1 < len(tokens)
+            and isinstance(tokens[i + 1], javalang.tokenizer.Identifier)
+            and (i == 0 or tokens[i - 1].value != ".")   # not Foo.class
+        ):
+            types.add(tokens[i + 1].value)
+        i += 1
+
+    return {
+        "package": package,
+        "types": sorted(types),
+        "imports": imports,
+        "on_demand": on_demand,
+        "identifiers": sorted(identifiers),
+        "chains": sorted(chains),
+    }
+
+
+def _java_files(repo_path: str) -> Iterable[str]:
+    for root, dirs, files in os.walk(repo_path):
+        dirs[:] = [d for d in dirs if d not in BUILD_OUTPUT_DIRS and not d.startswith(".")]
+        for name in files:
+            if name.endswith(".java"):
+                yield os.path.relpath(os.path.join(root, name), repo_path)
+
+
+def build_index(repo_path: str) -> dict:
+    """
+    Returns {"files": {path: {"class": fully qualified name, "refs": [paths]}}}
+    for the Java files of the repo, `refs` being the files it references
+    """
+    parsed: Dict[str, dict] = {}
+    for path in _java_files(repo_path):
+        try:
+            with open(os.path.join(repo_path, path), encoding="utf-8", errors="replace") as f:
+                parsed[path] = _tokenize(f.read())
+        except OSError:
+            continue
+
+    declared_in: Dict[str, List[str]] = defaultdict(list)   # simple type name -> files
+    for path, info in parsed.items():
+        for type_name in info["types"]:
+            declared_in[type_name].append(path)
+
+    files = {}
+    for path, info in parsed.items():
+        imports = set(info["imports"])
+        on_demand = set(info["on_demand"])
+        refs = set()
+        for name in info["identifiers"]:
+            for other in declared_in.get(name, ()):
+                if other == path:
+                    continue
+                package = parsed[other]["package"]
+                qualified = f"{package}.{name}" if package else name
+                if (
+                    info["package"] is None   # couldn't be tokenized
+                    or package == info["package"]
+                    or qualified in imports
+                    or any(imp.startswith(qualified + ".") for imp in imports)   # nested / static import
+                    or package in on_demand
+                    or qualified in on_demand   # import static a.B.*
+                    or any(chain == qualified or chain.startswith(qualified + ".") for chain in info["chains"])
+                ):
+                    refs.add(other)
+        package = info["package"] or ""
+        class_name = os.path.basename(path)[: -len(".java")]
+        files[path] = {
+            "class": f"{package}.{class_name}" if package else class_name,
+            "refs": sorted(refs),
+        }
+    return {"files": files}
+
+
+def is_test_file(path: str) -> bool:
+    parts = path.split(os.sep)
+    name = os.path.basename(path)[: -len(".java")]
+    return "test" in parts and bool(TEST_CLASS_NAME.match(name))
+
+
+def select_tests(index: dict, changed_files: Iterable[str]) -> Optional[List[str]]:
+    """
+    The fully qualified test classes that (transitively) reference one of the
+    changed files, None when the whole suite should run instead
+    """
+    changed = [os.path.normpath(path) for path in changed_files]
+    if not changed or any(not path.endswith(".java") for path in changed):
+        return None   # build files, resources, ...: anything can be affected
+
+    files = index["files"]
+    referenced_by: Dict[str, List[str]] = defaultdict(list)
+    for path, info in files.items():
+        for ref in info["refs"]:
+            referenced_by[ref].append(path)
+
+    seen = set(changed)
+    queue = deque(changed)
+    while queue:
+        for user in referenced_by.get(queue.popleft(), ()):
+            if user not in seen:
+                seen.add(user)
+                queue.append(user)
+
+    all_tests = [path for path in files if is_test_file(path)]
+    selected = sorted({files[path]["class"] for path in seen if path in files and is_test_file(path)})
+    for path in changed:   # new test files aren't in the index
+        if path not in files and is_test_file(path):
+            package_path = path.split(os.sep + "java" + os.sep)[-1]
+            selected.append(package_path[: -len(".java")].replace(os.sep, "."))
+    if not selected or len(selected) > MAX_SELECTED or len(selected) >= len(all_tests):
+        return None
+    return selected
+
+
+class TestSelector:
+    """
+    Builds (once per archive, stored in the repo cache) the dependency index
+    and selects the tests to run for a change. In "verify" mode, the build
+    handlers run both the selected tests and the whole suite, and the
+    outcomes are compared and logged in `verify_log_path` (jsonl).
+    """
+
+    def __init__(self, mode: str, repo_cache: RepoCache, verify_log_path: str) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown test selection mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.repo_cache = repo_cache
+        self.verify_log_path = verify_log_path
+        self.indexes: OrderedDict[str, dict] = OrderedDict()
+        self.lock = threading.Lock()
+        self.index_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+        self.selected_runs = 0
+        self.full_runs = 0
+        self.verifications = 0
+        self.disagreements = 0
+        self.selected_seconds = 0.0
+        self.full_seconds = 0.0
+
+    def _index(self, archive_path: str, working_copy: str) -> dict:
+        tree = self.repo_cache.tree_path(archive_path)
+        index_path = self.repo_cache.sidecar_path(archive_path, INDEX_FILE)
+        if tree is None or index_path is None:
+            return build_index(working_copy)   # not cached, the changes are in it but it doesn't matter
+
+        key = self.repo_cache.key(archive_path)
+        with self.lock:
+            index_lock = self.index_locks[key]
+        with index_lock:
+            with self.lock:
+                if key in self.indexes:
+                    self.indexes.move_to_end(key)
+                    return self.indexes[key]
+            try:
+                with open(index_path) as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                start = time.time()
+                index = build_index(tree)
+                with open(index_path + ".tmp", "w") as f:
+                    json.dump(index, f)
+                os.replace(index_path + ".tmp", index_path)
+                print(f"[INFO] Test dependency index of {os.path.basename(archive_path)} built in {time.time() - start:.1f}s")
+            with self.lock:
+                self.indexes[key] = index
+                if len(self.indexes) > INDEX_MEMORY_SIZE:
+                    self.indexes.popitem(last=False)
+            return index
+
+    def select(self, archive_path: Optional[str], working_copy: str, changed_files: Iterable[str]) -> Optional[List[str]]:
+        """The test classes to run, None to run them all (or if selection is off)"""
+        if self.mode == "off" or archive_path is None:
+            return None
+        try:
+            return select_tests(self._index(archive_path, working_copy), changed_files)
+        except Exception as e:
+            print(f"[WARNING] Couldn't select the tests of {archive_path} {type(e)}: {e}", file=sys.stderr)
+            return None
+
+    def record_run(self, selected: bool, seconds: float) -> None:
+        with self.lock:
+            if selected:
+                self.selected_runs += 1
+                self.selected_seconds += seconds
+            else:
+                self.full_runs += 1
+                self.full_seconds += seconds
+
+    def record_verification(self, archive: Optional[str], tests: List[str], selected_ok: bool, full_ok: bool) -> None:
+        with self.lock:
+            self.verifications += 1
+            if selected_ok != full_ok:
+                self.disagreements += 1
+                print(
+                    f"[WARNING] Test selection disagrees with the full run on {archive}: "
+                    f"selected {'passed' if selected_ok else 'failed'}, full {'passed' if full_ok else 'failed'}",
+                    file=sys.stderr,
+                )
+            dirname = os.path.dirname(self.verify_log_path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            with open(self.verify_log_path, "a") as f:
+                record = {
+                    "archive": archive,
+                    "time": time.time(),
+                    "tests": tests,
+                    "selected_ok": selected_ok,
+                    "full_ok": full_ok,
+                }
+                f.write(json.dumps(record) + "\n")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "mode": self.mode,
+                "selected_runs": self.selected_runs,
+                "full_runs": self.full_runs,
+                "avg_selected_seconds": self.selected_seconds / self.selected_runs if self.selected_runs else 0,
+                "avg_full_seconds": self.full_seconds / self.full_runs if self.full_runs else 0,
+                "verifications": self.verifications,
+                "disagreements": self.disagreements,
+            }
@@ -0,0 +1,26 @@
+"""
+The modules read their configuration from the environment when they're
+imported: everything they write goes to a temporary directory, and nothing is
+built (the build handler is the mock one).
+"""
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+_ROOT = tempfile.mkdtemp(prefix="crab_tests_")
+os.environ.update(
+    {
+        "DATA_PATH": os.path.join(_ROOT, "data"),
+        "RESULTS_DIR": os.path.join(_ROOT, "results"),
+        "CACHE_DIR": os.path.join(_ROOT, "cache"),
+        "WORKSPACE_ROOT": os.path.join(_ROOT, "workspace"),
+        "MOCK_BUILD_HANDLER": "true",
+        "JAVA_PRECHECK_PROCESSES": "0",
+        "DATASET_WATCH_INTERVAL": "0",
+        "CONTAINER_POOL_SIZE": "0",
+    }
+)
+
+from utils.env_defaults import set_env_defaults
+
+set_env_defaults()
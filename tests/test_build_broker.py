@@ -0,0 +1,130 @@
+import threading, time
+
+import pytest
+
+from utils import build_broker
+from utils.build_broker import MAX_ATTEMPTS, BrokerClient, SqliteBroker
+from utils.build_jobs import BuildJob
+
+LEASE_TIMEOUT = 0.05
+
+
+@pytest.fixture
+def broker(tmp_path) -> SqliteBroker:
+    return SqliteBroker(str(tmp_path / "broker.sqlite"))
+
+
+@pytest.fixture
+def short_lease(monkeypatch):
+    monkeypatch.setattr(build_broker, "LEASE_TIMEOUT", LEASE_TIMEOUT)
+
+
+def job(id: str = "1") -> BuildJob:
+    return BuildJob(id, f"org_repo_{id}_merged.tar.gz", {"A.java": "class A {}"}, f"org/repo #PR {id}")
+
+
+def expire_lease() -> None:
+    time.sleep(2 * LEASE_TIMEOUT)
+
+
+def state(broker: SqliteBroker, job_id: str) -> dict:
+    states, _ = broker.poll([job_id], 0)
+    return states[job_id]
+
+
+def test_a_job_is_claimed_by_one_worker(broker):
+    job_ids = {broker.submit(job(str(i))) for i in range(40)}
+    claimed = {}   # job id -> workers
+    lock = threading.Lock()
+
+    def work(worker: str):
+        while (claim := broker.claim(worker)) is not None:
+            with lock:
+                claimed.setdefault(claim[0], []).append(worker)
+
+    workers = [threading.Thread(target=work, args=(f"worker-{i}",)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert set(claimed) == job_ids
+    assert all(len(workers) == 1 for workers in claimed.values())
+
+
+def test_the_claimed_job_is_the_submitted_one(broker):
+    job_id = broker.submit(job())
+    assert broker.claim("a") == (job_id, job())
+    assert broker.claim("b") is None
+
+
+def test_a_job_is_queued_again_when_its_worker_stops_heartbeating(broker, short_lease):
+    job_id = broker.submit(job())
+    broker.claim("a")
+    assert broker.heartbeat(job_id, "a")
+    expire_lease()
+    assert broker.claim("b")[0] == job_id
+    assert not broker.heartbeat(job_id, "a")   # a stops working on it
+    assert broker.heartbeat(job_id, "b")
+
+
+def test_a_heartbeating_job_isnt_queued_again(broker, short_lease):
+    job_id = broker.submit(job())
+    broker.claim("a")
+    for _ in range(4):
+        time.sleep(LEASE_TIMEOUT / 2)
+        assert broker.heartbeat(job_id, "a")
+    assert broker.claim("b") is None
+
+
+def test_a_job_is_failed_after_max_attempts(broker, short_lease):
+    job_id = broker.submit(job())
+    for attempt in range(MAX_ATTEMPTS):
+        assert broker.claim(f"worker-{attempt}")[0] == job_id
+        expire_lease()
+    assert broker.claim("last") is None
+    assert state(broker, job_id) == {"state": "failed", "result": None, "error": "Its workers kept dying"}
+
+
+def test_the_finish_of_a_worker_that_lost_the_job_is_ignored(broker, short_lease):
+    job_id = broker.submit(job())
+    broker.claim("a")
+    expire_lease()
+    broker.claim("b")
+    broker.finish(job_id, "a", {"compilation": False})
+    assert state(broker, job_id)["state"] == "running"
+    broker.finish(job_id, "b", {"compilation": True})
+    assert state(broker, job_id) == {"state": "done", "result": {"compilation": True}, "error": None}
+
+
+def test_the_progress_and_result_reach_the_client(broker):
+    client = BrokerClient(broker, poll_interval=0.01)
+    steps, logged = [], []
+    future = client.submit(job(), steps.append, logged.extend)
+    job_id, _ = broker.claim("worker")
+    broker.report(job_id, steps=1, lines=["[INFO] Compiling"])
+    broker.report(job_id, steps=2, lines=["[INFO] BUILD SUCCESS"])
+    broker.finish(job_id, "worker", {"compilation": True, "test": True})
+
+    assert future.result(timeout=10) == {"compilation": True, "test": True}
+    assert steps == [1, 2]
+    assert logged == ["[INFO] Compiling", "[INFO] BUILD SUCCESS"]
+    assert client.stats()["pending"] == 0
+
+
+def test_a_failing_callback_doesnt_stop_the_poller(broker):
+    client = BrokerClient(broker, poll_interval=0.01)
+    logged = []
+
+    def steps_cb(n_steps):
+        raise RuntimeError("the socket is closed")
+
+    future = client.submit(job(), steps_cb, logged.extend)
+    # the worker side
+    job_id, _ = broker.claim("worker")
+    broker.report(job_id, steps=1)
+    broker.report(job_id, lines=["BUILD SUCCESS"])
+    broker.finish(job_id, "worker", {"compilation": True})
+
+    assert future.result(timeout=10) == {"compilation": True}
+    assert logged == ["BUILD SUCCESS"]
+    assert client.stats()["pending"] == 0
@@ -0,0 +1,52 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from utils import build_handlers
+from utils.build_handlers import DEPS_CACHE, MavenHandler
+from utils.container_pool import Lease
+
+
+@pytest.fixture
+def repo(tmp_path) -> str:
+    path = tmp_path / "repo"
+    path.mkdir()
+    (path / "pom.xml").write_text("<project/>")
+    return str(path)
+
+
+def test_failed_lease_releases_the_deps_cache(monkeypatch, repo):
+    def lease(image):
+        raise RuntimeError("docker is down")
+
+    monkeypatch.setattr(build_handlers.CONTAINER_POOL, "lease", lease)
+    active = DEPS_CACHE.active
+    with pytest.raises(RuntimeError):
+        with MavenHandler(repo, "pom.xml"):
+            pass
+    assert DEPS_CACHE.active == active
+    assert not os.path.exists(repo)
+
+
+def test_failed_move_gives_back_the_lease(monkeypatch, tmp_path, repo):
+    slot_dir = tmp_path / "slot"
+    slot_dir.mkdir()
+    leased = Lease(SimpleNamespace(id="c"), "crab-maven", str(slot_dir))
+    released = []
+
+    def move(src, dst):
+        os.mkdir(dst)   # cut in the middle
+        raise OSError("no space left on device")
+
+    monkeypatch.setattr(build_handlers.CONTAINER_POOL, "lease", lambda image: leased)
+    monkeypatch.setattr(build_handlers.CONTAINER_POOL, "release", released.append)
+    monkeypatch.setattr(build_handlers, "move", move)
+    active = DEPS_CACHE.active
+    with pytest.raises(OSError):
+        with MavenHandler(repo, "pom.xml"):
+            pass
+    assert released == [leased]
+    assert not os.listdir(slot_dir)
+    assert DEPS_CACHE.active == active
+    assert not os.path.exists(repo)
@@ -0,0 +1,90 @@
+import gzip, re
+
+import pytest
+
+from utils.build_log import LineBatcher, LogCleaner
+
+OUTPUT = "\n".join(
+    [
+        "[INFO] Scanning for projects...",
+        "[INFO] Downloading from central: https://repo/a.pom",
+        "[INFO] Downloaded from central: https://repo/a.pom (2 kB)",
+        "[INFO] Downloading from central: https://repo/b.jar",
+        "[INFO] Compiling 3 source files – ünïcode",
+        "[WARNING] Files with unapproved licenses:",
+        "  ?/.m2/repository/a/LICENSE",
+        "  ?/.m2/repository/b/LICENSE",
+        "[INFO] Downloading from central: https://repo/c.jar",
+        "[INFO] Tests run: 3, Failures: 0, Errors: 0, Skipped: 0",
+        "[INFO] BUILD SUCCESS",
+        "",
+    ]
+).encode()
+
+
+def clean_output(output: bytes) -> str:
+    """How the output was cleaned once the build was over, before it was streamed"""
+    lines = output.decode().split("\n")
+
+    downloading_block = False
+    merged = []
+    for line in lines:
+        if re.match(r"\[INFO\] Download(ing|ed) from", line):
+            if not downloading_block:
+                merged.append("[CRAB] Downloading stuff")
+                downloading_block = True
+        else:
+            merged.append(line)
+            downloading_block = False
+
+    licenses_block = False
+    cleaned = []
+    for line in merged:
+        if re.match(r"\[WARNING\] Files with unapproved licenses:", line):
+            cleaned.append(line)
+            cleaned.append("[CRAB] List of all the unapproved licenses...")
+            licenses_block = True
+        elif licenses_block and not re.match(r"\s+\?\/\.m2\/repository", line):
+            licenses_block = False
+        if not licenses_block:
+            cleaned.append(line)
+    return "\n".join(cleaned)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, len(OUTPUT)])
+def test_same_as_cleaning_the_whole_output(chunk_size):
+    cleaner = LogCleaner(None)
+    for i in range(0, len(OUTPUT), chunk_size):
+        cleaner.feed(OUTPUT[i : i + chunk_size])   # also cuts the multi-byte characters
+    cleaner.close()
+    assert cleaner.text() == clean_output(OUTPUT).rstrip("\n")   # nothing follows the last newline
+
+
+def test_tail_markers_summary_and_spool(tmp_path):
+    spool_path = str(tmp_path / "build.log.gz")
+    lines = []
+    cleaner = LogCleaner(
+        2,
+        markers=["BUILD SUCCESS", "BUILD FAILURE"],
+        line_cb=lines.append,
+        spool_path=spool_path,
+        summary_pattern=re.compile(r"\[INFO\] Tests run: .*"),
+    )
+    cleaner.feed(OUTPUT)
+    cleaner.close()
+    assert cleaner.text() == "[INFO] Tests run: 3, Failures: 0, Errors: 0, Skipped: 0\n[INFO] BUILD SUCCESS"
+    assert cleaner.found == {"BUILD SUCCESS"}
+    assert cleaner.summary == ["[INFO] Tests run: 3, Failures: 0, Errors: 0, Skipped: 0"]
+    assert lines == clean_output(OUTPUT).split("\n")[:-1]
+    with gzip.open(spool_path, "rt", encoding="utf-8") as f:
+        assert f.read() == clean_output(OUTPUT)
+
+
+def test_batches():
+    batches = []
+    batcher = LineBatcher(batches.append, interval=3600, max_lines=2)
+    for line in "abcde":
+        batcher(line)
+    batcher.flush()
+    batcher.flush()
+    assert batches == [["a", "b"], ["c", "d"], ["e"]]
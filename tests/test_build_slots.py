@@ -0,0 +1,125 @@
+import threading, time
+
+import pytest
+
+from utils import build_slots
+from utils.build_slots import BuildSlots
+
+GiB = 2**30
+
+
+def pressure(cpu=0.0, memory=0.0, io=0.0, memory_full=0.0) -> dict:
+    return {
+        "cpu": {"some": cpu},
+        "memory": {"some": memory, "full": memory_full},
+        "io": {"some": io, "full": 0.0},
+    }
+
+
+@pytest.fixture
+def host(monkeypatch):
+    """The readings of the host, as the test sets them"""
+    state = {"pressure": pressure(), "available": 64 * GiB, "containers": {}}
+    monkeypatch.setattr(build_slots, "COOLDOWN", 0)
+    monkeypatch.setattr(build_slots, "read_pressure", lambda: state["pressure"])
+    monkeypatch.setattr(build_slots, "read_available_memory", lambda: state["available"])
+    monkeypatch.setattr(build_slots, "container_memory", lambda id: state["containers"].get(id))
+    return state
+
+
+def waiting_build(slots: BuildSlots) -> threading.Thread:
+    """A build waiting for a slot"""
+    thread = threading.Thread(target=slots.acquire, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if slots.waiting:
+            break
+        time.sleep(0.01)
+    return thread
+
+
+def test_not_adaptive_when_the_bounds_are_the_same():
+    slots = BuildSlots(4, 4)
+    assert not slots.adaptive and slots.limit == 4
+    slots.start()
+    assert slots.controller is None
+
+
+def test_grows_only_when_builds_are_waiting(host):
+    slots = BuildSlots(1, 3)
+    assert slots.limit == 1
+    slots.adjust()
+    assert slots.limit == 1   # no demand
+    slots.acquire()
+    thread = waiting_build(slots)
+    slots.adjust()
+    thread.join(1)
+    assert slots.limit == 2 and slots.in_use == 2 and not thread.is_alive()
+    assert slots.stats()["decisions"][-1]["reason"] == "low pressure"
+
+
+def test_doesnt_grow_without_memory_for_another_build(host):
+    slots = BuildSlots(1, 3)
+    slots.acquire()
+    waiting_build(slots)
+    host["available"] = 2 * GiB   # under the headroom of a build (2 GiB until measured)
+    slots.adjust()
+    assert slots.limit == 1
+    slots.release()
+
+
+def test_the_memory_of_the_builds_is_measured(host):
+    slots = BuildSlots(1, 3, running_containers=lambda: ["c1"])
+    host["containers"]["c1"] = 12 * GiB
+    slots.adjust()
+    assert slots.build_memory > 2 * GiB
+
+
+@pytest.mark.parametrize(
+    "high, reason",
+    [
+        (pressure(cpu=95), "high pressure: cpu 95.0%"),
+        (pressure(io=60), "high pressure: io 60.0%"),
+        (pressure(memory_full=5), "memory thrashing (full 5.0%)"),
+    ],
+)
+def test_shrinks_under_pressure_down_to_the_minimum(host, high, reason):
+    slots = BuildSlots(1, 3)
+    slots.limit = 2
+    host["pressure"] = high
+    slots.adjust()
+    assert slots.limit == 1
+    assert slots.stats()["decisions"][-1]["reason"] == reason
+    slots.adjust()
+    assert slots.limit == 1
+
+
+def test_stays_between_low_and_high_pressure(host):
+    slots = BuildSlots(1, 3)
+    slots.acquire()
+    waiting_build(slots)
+    host["pressure"] = pressure(cpu=65)
+    slots.adjust()
+    assert slots.limit == 1 and not slots.decisions
+    slots.release()
+
+
+def test_cooldown_between_two_changes(host, monkeypatch):
+    monkeypatch.setattr(build_slots, "COOLDOWN", 3600)
+    slots = BuildSlots(1, 3)
+    slots.limit = 3
+    host["pressure"] = pressure(cpu=95)
+    slots.adjust()
+    slots.adjust()
+    assert slots.limit == 2
+
+
+def test_load_average_without_pressure_information(host, monkeypatch):
+    host["pressure"] = None
+    monkeypatch.setattr(build_slots.os, "cpu_count", lambda: 4)
+    monkeypatch.setattr(build_slots.os, "getloadavg", lambda: (8.0, 0.0, 0.0))
+    slots = BuildSlots(1, 3)
+    slots.limit = 3
+    slots.adjust()
+    assert slots.limit == 2
+    assert slots.stats()["decisions"][-1]["reason"] == "high load (2.00 per cpu)"
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from utils import process_data
+from utils.dataset import CommentGenSubmission, CompactComment, CompactEntry, CompactMetadata
+from utils.reference_index import ReferenceIndex
+from utils.references import References
+
+N_ENTRIES = 200
+
+
+@pytest.fixture(scope="module")
+def references() -> References:
+    reference_map = {
+        str(i): CompactEntry(
+            CompactMetadata(str(i), "org/repo", i),
+            (CompactComment(f"comment number {i} about this method", f"F{i % 7}.java", i, i + 2, ("paraphrase",)),),
+        )
+        for i in range(N_ENTRIES)
+    }
+    return References(1, reference_map, ReferenceIndex(reference_map), time.time())
+
+
+@pytest.fixture
+def answers() -> dict:
+    return {
+        str(i): CommentGenSubmission(f"F{i % 7}.java", i + 1, i + 1, f"comment about method {i}")
+        for i in range(N_ENTRIES + 10)   # the last ones aren't in the dataset
+    }
+
+
+@pytest.fixture
+def pool_of(monkeypatch):
+    monkeypatch.setattr(process_data, "COMMENT_EVAL_PROCESSES", 2)
+    yield
+    if process_data._COMMENT_POOL is not None:
+        process_data._discard_comment_pool(process_data._COMMENT_POOL)
+
+
+def test_parallel_scores_are_the_serial_ones(pool_of, references, answers):
+    progress = []
+    parallel = process_data._evaluate_comments_parallel(answers, references, progress.append)
+    serial = process_data._evaluate_comments_serial(answers, references, lambda _: None)
+    assert parallel == serial and len(parallel) == N_ENTRIES
+    assert progress[-1] == len(answers)
+    stats = process_data.comment_pool_stats()
+    assert stats["processes"] == 2 and stats["running"] and stats["dataset_version"] == 1
+
+
+def test_a_broken_pool_is_replaced(pool_of, references, answers):
+    expected = process_data._evaluate_comments_serial(answers, references, lambda _: None)
+    process_data._evaluate_comments_parallel(answers, references, lambda _: None)
+    pool = process_data._COMMENT_POOL
+    breaks = process_data.comment_pool_stats()["breaks"]
+    for worker in list(pool._processes.values()):
+        worker.kill()   # e.g. the OOM killer
+        worker.join()
+
+    progress = []
+    assert process_data._evaluate_comments_parallel(answers, references, progress.append) == expected
+    assert progress[-1] == len(answers)
+    assert process_data._COMMENT_POOL is not pool
+    assert process_data.comment_pool_stats()["breaks"] == breaks + 1
+
+    assert process_data._evaluate_comments_parallel(answers, references, lambda _: None) == expected
+    assert process_data._COMMENT_POOL is not None and process_data._COMMENT_POOL is not pool
@@ -0,0 +1,58 @@
+import os
+
+from utils.coverage_index import index_report, line_coverage, package_of, read_package
+
+REPORT = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<!DOCTYPE report PUBLIC "-//JACOCO//DTD Report 1.1//EN" "report.dtd">
+<report name="repo">
+  <package name="org/example">
+    <class name="org/example/A" sourcefilename="A.java">
+      <method name="f" desc="()V" line="3">
+        <counter type="LINE" missed="9" covered="9"/>
+      </method>
+      <counter type="INSTRUCTION" missed="10" covered="30"/>
+      <counter type="LINE" missed="1" covered="3"/>
+    </class>
+    <class name="org/example/A$Inner" sourcefilename="A.java">
+      <counter type="LINE" missed="0" covered="0"/>
+    </class>
+    <sourcefile name="A.java">
+      <line nr="3" mi="0" ci="3" mb="0" cb="0"/>
+      <counter type="LINE" missed="1" covered="3"/>
+    </sourcefile>
+    <counter type="LINE" missed="1" covered="3"/>
+  </package>
+</report>
+"""
+
+
+def write(path, content: str) -> str:
+    path.write_text(content)
+    return str(path)
+
+
+def test_index_report(tmp_path):
+    report = write(tmp_path / "jacoco.xml", REPORT)
+    assert index_report(report) == {("org/example/A", "A.java"): (1, 3), ("org/example/A$Inner", "A.java"): (0, 0)}
+    assert line_coverage(report, "org/example/A", "A.java") == 75
+    assert line_coverage(report, "org/example/A$Inner", "A.java") == 0
+    assert line_coverage(report, "org/example/B", "B.java") == -1
+
+
+def test_read_package(tmp_path):
+    assert read_package(write(tmp_path / "A.java", "// header\npackage org.example;\n\nclass A {}\n")) == "org.example"
+    assert read_package(write(tmp_path / "B.java", "import java.util.List;\nclass B {}\n")) is None
+    assert read_package(write(tmp_path / "C.java", "/* no package */ public class C {}\n")) is None
+    info = write(tmp_path / "package-info.java", '@Deprecated\n@SuppressWarnings("all")\npackage org.example.c;\n')
+    assert read_package(info) == "org.example.c"
+    info = write(tmp_path / "D.java", "@Generated(by = Gen.class, in = {@Tool(int.class)})\npackage d;\n")
+    assert read_package(info) == "d"
+
+
+def test_package_of_is_read_again_when_the_file_changes(tmp_path):
+    path = tmp_path / "A.java"
+    write(path, "package a;\nclass A {}\n")
+    assert package_of(str(path)) == "a"
+    write(path, "package org.b;\nclass A {}\n")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    assert package_of(str(path)) == "org.b"
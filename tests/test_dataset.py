@@ -0,0 +1,55 @@
+import pytest
+
+from utils.dataset import ArchiveState, CompactEntry, DatasetEntry
+
+ENTRY = {
+    "metadata": {
+        "id": "1",
+        "repo": "org/repo",
+        "pr_number": 42,
+        "pr_title": "title",
+        "pr_body": "body",
+        "merge_commit_sha": "abc",
+        "successful": True,
+        "build_system": "maven",
+        "selection": {"comment_suggests_change": True, "diff_after_address_change": None},
+    },
+    "comments": [
+        {"body": "first", "file": "src/A.java", "from_": 1, "to": 2, "paraphrases": ["1st"]},
+        {"body": "second", "file": "src/A.java", "from_": None, "to": 5},
+    ],
+}
+
+
+def test_same_record_from_a_dict_and_from_an_entry():
+    from_dict = CompactEntry.from_dict(ENTRY)
+    from_entry = CompactEntry.from_entry(DatasetEntry.from_dict(ENTRY))
+    for entry in (from_dict, from_entry):
+        assert (entry.metadata.id, entry.metadata.repo, entry.metadata.pr_number) == ("1", "org/repo", 42)
+        assert (entry.metadata.build_system, entry.metadata.successful) == ("maven", True)
+        assert [(c.body, c.file, c.from_, c.to, c.paraphrases) for c in entry.comments] == [
+            ("first", "src/A.java", 1, 2, ("1st",)),
+            ("second", "src/A.java", None, 5, ()),
+        ]
+        assert entry.metadata.archive_name(ArchiveState.MERGED) == "org_repo_42_merged.tar.gz"
+
+
+def test_records_are_slotted():
+    entry = CompactEntry.from_dict(ENTRY)
+    for record in (entry, entry.metadata, entry.comments[0]):
+        assert not hasattr(record, "__dict__")
+    with pytest.raises(AttributeError):
+        entry.metadata.pr_title = "not kept"
+
+
+def test_repeated_strings_are_interned():
+    # built from different strings, as json.loads would
+    first = CompactEntry.from_dict(ENTRY)
+    second = CompactEntry.from_dict(
+        {
+            "metadata": {**ENTRY["metadata"], "repo": "".join(["org/", "repo"])},
+            "comments": [{**ENTRY["comments"][0], "file": "".join(["src/", "A.java"])}],
+        }
+    )
+    assert first.metadata.repo is second.metadata.repo
+    assert first.comments[0].file is second.comments[0].file
@@ -0,0 +1,77 @@
+import json, os, pickle
+
+import pytest
+
+from utils.dataset import Dataset
+from utils.dataset_store import LazyReferenceMap, compile_dataset, load_reference_map
+
+
+def entry(id: str, repo: str = "org/repo", reason_for_failure: str = "") -> dict:
+    return {
+        "metadata": {
+            "id": id,
+            "repo": repo,
+            "pr_number": int(id),
+            "pr_title": "title",
+            "pr_body": "body",
+            "merge_commit_sha": "abc",
+            "successful": True,
+            "build_system": "maven",
+            "reason_for_failure": reason_for_failure,
+        },
+        "comments": [
+            {"body": f"comment {id} é", "file": "src/A.java", "from_": 1, "to": 2, "paraphrases": ["other"]},
+        ],
+    }
+
+
+@pytest.fixture
+def dataset_json(tmp_path) -> str:
+    path = str(tmp_path / "dataset.json")
+    entries = [entry(str(i)) for i in (10, 2, 33, 4)] + [entry("5", reason_for_failure="Was still being processed")]
+    with open(path, "w") as f:
+        json.dump({"entries": entries}, f)
+    return path
+
+
+def fields(entry) -> tuple:
+    metadata = entry.metadata
+    comments = tuple((c.body, c.file, c.from_, c.to, tuple(c.paraphrases)) for c in entry.comments)
+    return (metadata.id, metadata.repo, metadata.pr_number, metadata.build_system, metadata.successful, comments)
+
+
+def test_round_trip(tmp_path, dataset_json):
+    out_path = str(tmp_path / "dataset.bin")
+    assert compile_dataset(dataset_json, out_path) == 4   # without the one still being processed
+
+    lazy = LazyReferenceMap(out_path)
+    eager = Dataset.from_json(dataset_json).build_compact_reference_map()
+    assert len(lazy) == len(eager) and sorted(lazy) == sorted(eager)
+    for id in eager:
+        assert id in lazy
+        assert fields(lazy[id]) == fields(eager[id])
+    assert "5" not in lazy and "100" not in lazy and 10 not in lazy
+    with pytest.raises(KeyError):
+        lazy["100"]
+
+
+def test_pickled_map_maps_the_file_again(tmp_path, dataset_json):
+    out_path = str(tmp_path / "dataset.bin")
+    compile_dataset(dataset_json, out_path)
+    unpickled = pickle.loads(pickle.dumps(LazyReferenceMap(out_path)))
+    assert fields(unpickled["33"]) == fields(LazyReferenceMap(out_path)["33"])
+
+
+def test_not_a_compiled_dataset(dataset_json):
+    with pytest.raises(ValueError):
+        LazyReferenceMap(dataset_json)
+
+
+def test_the_json_is_used_when_it_is_newer(tmp_path, dataset_json):
+    out_path = str(tmp_path / "dataset.bin")
+    compile_dataset(dataset_json, out_path)
+    assert isinstance(load_reference_map(dataset_json, out_path), LazyReferenceMap)
+
+    stat = os.stat(out_path)
+    os.utime(dataset_json, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert isinstance(load_reference_map(dataset_json, out_path), dict)
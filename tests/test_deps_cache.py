@@ -0,0 +1,45 @@
+import os, threading
+
+from utils.deps_cache import DepsCache
+
+
+def artifact(cache: DepsCache, name: str, size: int, mtime: float) -> str:
+    path = os.path.join(cache.host_path("maven"), "org", name, "1.0")
+    os.makedirs(path)
+    with open(os.path.join(path, f"{name}-1.0.pom"), "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_the_eviction_doesnt_wait_for_the_running_builds(tmp_path):
+    cache = DepsCache(str(tmp_path), 1000)
+    old = artifact(cache, "old", 600, 1)
+    new = artifact(cache, "new", 600, 2)
+    cache.mark_warmed("org_repo_1_merged.tar.gz", "maven")
+    cache.acquire()
+
+    checking = threading.Thread(target=cache.check_size)
+    checking.start()
+    checking.join(5)
+    assert not checking.is_alive()
+    assert os.path.exists(old) and cache.stats()["eviction_pending"]
+    cache.acquire()   # other builds still start
+
+    cache.release(offline=True)
+    assert os.path.exists(old)
+    cache.release(offline=True)   # the last one evicts
+    cache.acquire()   # waits for the eviction
+    assert not os.path.exists(old) and os.path.exists(new)
+    assert cache.warmed() == {}
+    assert cache.stats()["evictions"] == 1 and not cache.stats()["eviction_pending"]
+    cache.release(offline=False)
+
+
+def test_an_idle_cache_is_evicted_right_away(tmp_path):
+    cache = DepsCache(str(tmp_path), 1000)
+    old = artifact(cache, "old", 600, 1)
+    artifact(cache, "new", 600, 2)
+    cache.check_size()
+    assert not os.path.exists(old)
+    assert cache.stats()["size_bytes"]["maven"] == 600
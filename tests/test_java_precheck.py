@@ -0,0 +1,41 @@
+import pytest
+
+from utils.java_precheck import precheck_changes
+
+ORIGINAL = "package a;\n\nclass A {\n    int f() { return 1; }\n}\n"
+
+# valid java that javalang can't parse (it only knows Java 8)
+NEWER_JAVA = {
+    "var": "class A { void f() { var x = 1; } }",
+    "switch expression": "class A { int f(int k) { return switch (k) { case 1 -> 2; default -> 3; }; } }",
+    "text block": 'class A { String s = """\n    hello\n    """; }',
+    "instanceof pattern": "class A { int f(Object o) { return o instanceof String s ? s.length() : 0; } }",
+    "record": "record A(int x) {}",
+}
+
+
+@pytest.fixture
+def tree(tmp_path) -> str:
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "A.java").write_text(ORIGINAL)
+    (tmp_path / "src" / "Broken.java").write_text('class Broken { String s = "unterminated; }')
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize("source", NEWER_JAVA.values(), ids=NEWER_JAVA.keys())
+def test_newer_java_is_left_to_the_build(tree, source):
+    assert precheck_changes({"src/A.java": source}, tree) is None
+
+
+def test_a_file_that_cant_be_tokenized_is_rejected(tree):
+    error = precheck_changes({"README.md": '"', "src/A.java": 'class A { String s = "abc; }'}, tree)
+    assert error is not None and error.startswith("[CRAB] src/A.java can't be tokenized")
+    assert precheck_changes({"src/A.java": "class A { int x = 1 # 2; }"}, tree) is not None
+
+
+def test_the_build_decides_without_a_reference(tree):
+    broken = 'class A { String s = "abc; }'
+    assert precheck_changes({"src/A.java": broken}, None) is None   # the archive isn't cached
+    assert precheck_changes({"src/New.java": broken}, tree) is None
+    assert precheck_changes({"src/Broken.java": broken}, tree) is None   # its original can't be tokenized either
+    assert precheck_changes({"../A.java": broken}, tree) is None
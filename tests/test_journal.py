@@ -0,0 +1,37 @@
+import os
+
+from utils.journal import EntryJournal
+
+
+def test_resume_from_the_journal(tmp_path):
+    path = str(tmp_path / "subject.journal")
+    journal = EntryJournal(path)
+    assert journal.done == {}
+    journal.append("a", {"compilation": True})
+    journal.append("b", None)   # couldn't be evaluated, not retried either
+    journal.file.close()
+
+    resumed = EntryJournal(path)
+    assert resumed.done == {"a": {"compilation": True}, "b": None}
+
+
+def test_a_cut_line_is_dropped(tmp_path):
+    path = str(tmp_path / "subject.journal")
+    journal = EntryJournal(path)
+    journal.append("a", 1)
+    journal.file.close()
+    with open(path, "ab") as f:
+        f.write(b'["b", {"compil')   # the server stopped while it was written
+
+    resumed = EntryJournal(path)
+    assert resumed.done == {"a": 1}
+    resumed.append("c", 3)
+    resumed.file.close()
+    assert EntryJournal(path).done == {"a": 1, "c": 3}
+
+
+def test_remove(tmp_path):
+    journal = EntryJournal(str(tmp_path / "subject.journal"))
+    journal.append("a", 1)
+    journal.remove()
+    assert not os.path.exists(journal.path)
@@ -0,0 +1,59 @@
+import hashlib, io, json
+
+import pytest
+
+from utils import json_stream
+from utils.errors import NotAJsonObjectError, ValueTooLargeError
+from utils.json_stream import HashingReader, iter_object_items
+
+
+def items(data: bytes) -> list:
+    return list(iter_object_items(io.BytesIO(data)))
+
+
+def test_yields_the_items_in_order():
+    doc = {"a": 1, "b": {"x": [1, 2, {"y": None}]}, "c": "text", "d": 1.5e3, "e": True}
+    assert items(json.dumps(doc).encode()) == list(doc.items())
+
+
+def test_empty_object():
+    assert items(b"  { }  ") == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7])
+def test_values_split_across_chunks(monkeypatch, chunk_size):
+    monkeypatch.setattr(json_stream, "CHUNK_SIZE", chunk_size)
+    doc = {"ünïcødé ✓": "🙂 multi-byte", "number": 1234567890, "nested": {"k": [1.25, -3]}, "last": 42}
+    assert items(json.dumps(doc, ensure_ascii=False).encode()) == list(doc.items())
+
+
+def test_not_an_object():
+    with pytest.raises(NotAJsonObjectError):
+        items(b"[1, 2]")
+
+
+@pytest.mark.parametrize("data", [b'{"a": 1', b'{"a" 1}', b'{"a": 1,}', b'{"a": 1} {}', b""])
+def test_invalid_json(data):
+    with pytest.raises(json.JSONDecodeError):
+        items(data)
+
+
+@pytest.mark.parametrize("data", [b'{"a": [1, 2 x', b'{"a": "unterminated', b'{"unterminated'])
+def test_invalid_value_isnt_read_until_eof(data):
+    stream = io.BytesIO(data + b" " * (100 * json_stream.CHUNK_SIZE))
+    with pytest.raises(ValueTooLargeError):
+        list(iter_object_items(stream, max_value_size=json_stream.CHUNK_SIZE))
+    assert stream.tell() <= 4 * json_stream.CHUNK_SIZE
+
+
+def test_a_value_up_to_the_max_size_is_read(monkeypatch):
+    monkeypatch.setattr(json_stream, "CHUNK_SIZE", 16)
+    doc = {"a": "x" * 90, "b": ["y" * 40, "z" * 40]}
+    assert list(iter_object_items(io.BytesIO(json.dumps(doc).encode()), max_value_size=100)) == list(doc.items())
+
+
+def test_hashing_reader_hashes_what_is_read():
+    data = json.dumps({str(i): i for i in range(10_000)}).encode()
+    reader = HashingReader(io.BytesIO(data))
+    assert len(list(iter_object_items(reader))) == 10_000
+    assert reader.hexdigest() == hashlib.sha256(data).hexdigest()
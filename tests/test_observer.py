@@ -0,0 +1,82 @@
+import os, threading, uuid
+
+from utils.observer import RESULTS, RESULTS_DIR, Observer, Status, Subject
+from utils.queue_manager import QueueManager
+
+
+class RegisteringObserver(Observer):
+    """Registers another observer when it's notified, like a status request would meanwhile"""
+
+    def __init__(self, subject: Subject) -> None:
+        self.subject = subject
+        self.percentages = []
+
+    def updateStarted(self):
+        pass
+
+    def updatePercentage(self, percentage: float):
+        self.percentages.append(percentage)
+        self.subject.registerObserver(RecordingObserver())
+
+    def updateComplete(self, results: dict):
+        self.subject.registerObserver(RecordingObserver())
+
+    def updateLog(self, entry_id: str, lines: list[str]):
+        self.subject.registerObserver(RecordingObserver())
+
+    def updateFailed(self, message: str):
+        pass
+
+
+class RecordingObserver(Observer):
+    def __init__(self) -> None:
+        self.failures = []
+        self.failed = threading.Event()
+
+    def updateStarted(self):
+        pass
+
+    def updatePercentage(self, percentage: float):
+        pass
+
+    def updateComplete(self, results: dict):
+        pass
+
+    def updateLog(self, entry_id: str, lines: list[str]):
+        pass
+
+    def updateFailed(self, message: str):
+        self.failures.append(message)
+        self.failed.set()
+
+
+def test_observers_can_register_while_they_are_notified():
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    subject = Subject("refinement", lambda: None)
+    observer = RegisteringObserver(subject)
+    subject.registerObserver(observer)
+    subject.notifyPercentage(10)
+    subject.notifyLog("1", ["line"])
+    subject.notifyComplete({"1": {"compilation": True}})
+    assert observer.percentages == [10]
+    assert subject.results == {"1": {"compilation": True}}
+
+
+def test_a_submission_whose_task_fails_is_evaluated_again():
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+
+    def task(*args, **kwargs):
+        raise RuntimeError("docker is down")
+
+    digest = uuid.uuid4().hex
+    subject, created = Subject.get_or_create("refinement", task, digest)
+    observer = RecordingObserver()
+    subject.registerObserver(observer)
+    QueueManager({"refinement": 1}).submit(subject)
+    assert observer.failed.wait(5)
+    assert observer.failures == ["RuntimeError: docker is down"]
+    assert subject.status == Status.FAILED and subject.error == observer.failures[0]
+    assert subject.id not in RESULTS.scan()   # not resumed after a restart
+
+    again, created = Subject.get_or_create("refinement", task, digest)
+    assert created and again is not subject
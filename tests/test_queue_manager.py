@@ -0,0 +1,101 @@
+import threading
+
+from utils.observer import Status
+from utils.queue_manager import QueueManager, parse_lanes
+
+
+class FakeSubject:
+    """What the queue manager needs of a Subject"""
+
+    def __init__(self, id: str, type_: str, run_order: list, release: threading.Event = None) -> None:
+        self.id = id
+        self.type = type_
+        self.status = Status.CREATED
+        self.done = threading.Event()
+
+        def task(*args, **kwargs):
+            run_order.append(id)
+            if release is not None:
+                release.wait(5)
+            self.done.set()
+
+        self.task = task
+
+    def notifyStarted(self):
+        self.status = Status.PROCESSING
+
+    def notifyPercentage(self, percentage):
+        pass
+
+    def notifyComplete(self, results):
+        pass
+
+    def notifyLog(self, entry_id, lines):
+        pass
+
+    def notifyEntry(self, entry_id, result):
+        pass
+
+    def done_entries(self):
+        return {}
+
+
+def test_parse_lanes():
+    assert parse_lanes("comment:2, refinement:3,") == {"comment": 2, "refinement": 3}
+
+
+def test_clients_share_a_lane_fairly():
+    queue = QueueManager({"refinement": 1})
+    order: list = []
+    release = threading.Event()
+    blocker = FakeSubject("blocker", "refinement", order, release)
+    queue.submit(blocker, client="a")
+    a = [FakeSubject(f"a{i}", "refinement", order) for i in range(3)]
+    for subject in a:
+        queue.submit(subject, client="a")
+    b = FakeSubject("b0", "refinement", order)
+    queue.submit(b, client="b")
+
+    # b's first submission goes before a's backlog
+    assert [queue.get_position(s.id) for s in (b, *a)] == [1, 2, 3, 4]
+    assert queue.get_position("blocker") == 0
+    assert queue.stats()["refinement"] == {"workers": 1, "running": 1, "waiting": 4}
+
+    release.set()
+    for subject in (b, *a):
+        assert subject.done.wait(5)
+    assert order == ["blocker", "b0", "a0", "a1", "a2"]
+
+
+def test_cheaper_first_at_the_same_virtual_start():
+    queue = QueueManager({"refinement": 1})
+    order: list = []
+    release = threading.Event()
+    queue.submit(FakeSubject("blocker", "refinement", order, release), client="x")
+    big = FakeSubject("big", "refinement", order)
+    small = FakeSubject("small", "refinement", order)
+    queue.submit(big, client="a", cost=100)
+    queue.submit(small, client="b", cost=1)
+    assert queue.get_position("small") == 1
+    release.set()
+    assert big.done.wait(5) and small.done.wait(5)
+    assert order == ["blocker", "small", "big"]
+
+
+def test_lanes_dont_wait_for_each_other():
+    queue = QueueManager({"refinement": 1, "comment": 1})
+    order: list = []
+    release = threading.Event()
+    queue.submit(FakeSubject("build", "refinement", order, release))
+    comment = FakeSubject("comment", "comment", order)
+    queue.submit(comment)
+    assert comment.done.wait(5)
+    release.set()
+
+
+def test_unknown_types_get_their_own_lane():
+    queue = QueueManager({}, default_workers=2)
+    subject = FakeSubject("s", "other", [])
+    queue.submit(subject)
+    assert subject.done.wait(5)
+    assert queue.stats()["other"]["workers"] == 2
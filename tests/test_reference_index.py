@@ -0,0 +1,70 @@
+import pickle
+
+import pytest
+from sacrebleu import sentence_bleu
+
+from utils import reference_index
+from utils.dataset import CompactComment, CompactEntry, CompactMetadata
+from utils.reference_index import ReferenceIndex
+
+REFERENCES = {
+    "1": ("This method should return null when the list is empty.", ("Return null for an empty list.",)),
+    "2": ("Rename this variable", ()),
+    "3": ("", ("Missing a test case for the error path",)),
+}
+
+HYPOTHESES = [
+    "This method should return null when the list is empty.",
+    "return null if the list is empty",
+    "please rename the variable",
+    "",
+    "completely unrelated words here",
+]
+
+
+def reference_map() -> dict:
+    return {
+        id_: CompactEntry(
+            CompactMetadata(id_, "org/repo", int(id_)),
+            (CompactComment(body, "A.java", 1, 2, paraphrases),),
+        )
+        for id_, (body, paraphrases) in REFERENCES.items()
+    }
+
+
+@pytest.mark.parametrize("eager", [True, False])
+@pytest.mark.parametrize("hypothesis", HYPOTHESES)
+def test_same_scores_as_sacrebleu(eager, hypothesis):
+    index = ReferenceIndex(reference_map(), eager=eager)
+    for id_, (body, paraphrases) in REFERENCES.items():
+        expected = [round(sentence_bleu(hypothesis, [ref]).score, 2) for ref in (body, *paraphrases)]
+        assert index.bleu_scores(id_, hypothesis) == expected
+
+
+def test_lazy_index_computes_the_entries_when_scored():
+    index = ReferenceIndex(reference_map(), eager=False)
+    assert index.stats == {}
+    index.bleu_scores("2", "rename it")
+    assert list(index.stats) == ["2"]
+    assert "3" in index and "4" not in index
+
+
+def test_lazy_index_keeps_the_most_recently_scored_entries(monkeypatch):
+    monkeypatch.setattr(reference_index, "LAZY_STATS_SIZE", 2)
+    index = ReferenceIndex(reference_map(), eager=False)
+    for id_ in ["1", "2", "1", "3"]:
+        index.bleu_scores(id_, "rename it")
+    assert list(index.stats) == ["1", "3"]
+
+
+def test_without_the_sacrebleu_internals_the_scores_are_the_same(monkeypatch):
+    expected = ReferenceIndex(reference_map()).bleu_scores("1", HYPOTHESES[1])
+    monkeypatch.setattr(reference_index, "PRECOMPUTED", False)
+    index = ReferenceIndex(reference_map())
+    assert index.bleu_scores("1", HYPOTHESES[1]) == expected
+    assert index.stats == {}
+
+
+def test_the_index_can_be_sent_to_the_workers():
+    index = pickle.loads(pickle.dumps(ReferenceIndex(reference_map())))
+    assert index.bleu_scores("2", "rename it") == ReferenceIndex(reference_map()).bleu_scores("2", "rename it")
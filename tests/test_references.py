@@ -0,0 +1,90 @@
+import json, threading, time
+
+import pytest
+
+from utils.errors import DatasetUnavailableError
+from utils.references import ReferenceStore
+
+DATASET = {
+    "entries": [
+        {
+            "metadata": {
+                "id": "1",
+                "repo": "org/repo",
+                "pr_number": 1,
+                "pr_title": "title",
+                "pr_body": "body",
+                "merge_commit_sha": "abc",
+                "successful": True,
+            },
+            "comments": [{"body": "Rename this variable", "file": "A.java", "from_": 1, "to": 2}],
+        }
+    ]
+}
+
+
+@pytest.fixture
+def store(tmp_path) -> ReferenceStore:
+    return ReferenceStore(str(tmp_path / "dataset.json"), str(tmp_path / "dataset.bin"))
+
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_current_raises_when_the_first_load_failed(store):
+    store.reload()   # there's no dataset
+    assert not store.is_ready() and "FileNotFoundError" in store.last_error
+    with pytest.raises(DatasetUnavailableError):
+        store.current()
+
+
+def test_current_waits_for_the_first_load(store):
+    with open(store.json_path, "w") as f:
+        json.dump(DATASET, f)
+    got = []
+    waiting = threading.Thread(target=lambda: got.append(store.current()))
+    waiting.start()
+    time.sleep(0.05)
+    store.reload()
+    waiting.join(5)
+    assert got and list(got[0].reference_map) == ["1"]
+
+
+def test_the_watcher_retries_once_the_dataset_is_fixed(store):
+    with open(store.json_path, "w") as f:
+        f.write('{"entries": [')   # cut while it was copied
+    store.reload()
+    assert not store.is_ready()
+
+    store.watch(0.01)
+    time.sleep(0.05)
+    assert store.status()["version"] is None   # the same files aren't loaded again
+    with open(store.json_path, "w") as f:
+        json.dump(DATASET, f)
+    assert wait_until(store.is_ready)
+    assert store.current().version == 1 and store.last_error is None
+
+
+def test_the_watcher_survives_an_error(store, monkeypatch):
+    store.reload()
+    signature = store._signature
+    calls = []
+
+    def flaky_signature():
+        calls.append(None)
+        if len(calls) == 1:
+            raise FileNotFoundError("removed between exists and stat")
+        return signature()
+
+    monkeypatch.setattr(store, "_signature", flaky_signature)
+    store.watch(0.01)
+    with open(store.json_path, "w") as f:
+        json.dump(DATASET, f)
+    assert wait_until(store.is_ready)
+    assert len(calls) > 1
@@ -0,0 +1,166 @@
+import os, subprocess, sys, threading, time, uuid
+
+import pytest
+
+from utils import process_data
+from utils.build_jobs import REFINEMENT_STEPS
+from utils.dataset import CompactComment, CompactEntry, CompactMetadata
+from utils.reference_index import ReferenceIndex
+from utils.references import References
+
+N_ENTRIES = 20
+
+
+class FakeReferenceStore:
+    def __init__(self, references: References) -> None:
+        self.references = references
+
+    def current(self) -> References:
+        return self.references
+
+
+@pytest.fixture
+def references(monkeypatch) -> References:
+    reference_map = {
+        str(i): CompactEntry(CompactMetadata(str(i), "org/repo", i), (CompactComment("body", "A.java", 1, 2),))
+        for i in range(N_ENTRIES)
+    }
+    references = References(1, reference_map, ReferenceIndex(reference_map, eager=False), time.time())
+    monkeypatch.setattr(process_data, "REFERENCES", FakeReferenceStore(references))
+    return references
+
+
+@pytest.fixture
+def builds(monkeypatch) -> list:
+    """The ids of the entries built, by a fake build that always succeeds"""
+    built = []
+    lock = threading.Lock()
+
+    def run_build_job(job, archives_root, step, log_cb):
+        with lock:
+            built.append(job.id)
+        for _ in range(REFINEMENT_STEPS):
+            step()
+        return {"compilation": True, "test": True}
+
+    monkeypatch.setattr(process_data, "run_build_job", run_build_job)
+    return built
+
+
+def answers() -> dict:
+    # unique changes, so that nothing comes from the outcome cache of another test
+    run = uuid.uuid4().hex
+    return {str(i): {"A.java": f"class A {{}} // {run} {i}"} for i in range(N_ENTRIES)}
+
+
+def test_the_mock_handler_is_off_by_default():
+    env = {key: value for key, value in os.environ.items() if key != "MOCK_BUILD_HANDLER"}
+    code = "from utils.env_defaults import set_env_defaults; set_env_defaults(); " \
+        "import utils.build_handlers as b; print(b.MOCK_BUILD_HANDLER)"
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+    out = subprocess.run([sys.executable, "-c", code], cwd=src, env=env, capture_output=True, text=True, timeout=60)
+    assert out.stdout.strip().splitlines()[-1] == "False"
+
+
+def test_outcomes_are_cached(monkeypatch, references, builds):
+    monkeypatch.setattr(process_data, "MOCK_BUILD_HANDLER", False)
+    submission = answers()
+    first = process_data.evaluate_refinement(submission)
+    second = process_data.evaluate_refinement(submission)
+    assert first == second and len(first) == N_ENTRIES
+    assert sorted(builds) == sorted(submission)   # built once
+
+
+class UnusableHandler:
+    """A build handler whose container can't be set up"""
+
+    def __init__(self) -> None:
+        self.log_cb = None
+        self.discarded = False
+
+    def inject_changes(self, changes):
+        pass
+
+    def discard(self):
+        self.discarded = True
+
+    def __enter__(self):
+        raise RuntimeError("docker is down")
+
+    def __exit__(self, *args):
+        raise AssertionError("never entered")
+
+
+def test_an_entry_whose_build_cant_be_set_up_isnt_evaluated(monkeypatch, references):
+    from utils import build_jobs
+
+    handlers = []
+
+    def get_build_handler(root, archive_name):
+        handlers.append(UnusableHandler())
+        return handlers[-1]
+
+    monkeypatch.setattr(build_jobs, "get_build_handler", get_build_handler)
+    percentages, completed = [], []
+    results = process_data.evaluate_refinement(answers(), percentages.append, completed.append)
+    assert results == {} and completed == [{}]
+    assert percentages[-1] == 100
+    assert len(handlers) == N_ENTRIES and all(handler.discarded for handler in handlers)
+
+
+def test_a_failed_precheck_isnt_cached(monkeypatch, references, builds):
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.setattr(process_data, "MOCK_BUILD_HANDLER", False)
+    monkeypatch.setattr(process_data, "PRECHECK_EXECUTOR", ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(process_data, "precheck_changes", lambda changes, tree: "A.java:1: error")
+    monkeypatch.setattr(process_data.REPO_CACHE, "tree_path", lambda archive_path: None)
+    submission = answers()
+    prechecked = process_data.evaluate_refinement(submission)
+    assert all(result["compilation"] is False for result in prechecked.values())
+    assert builds == []
+
+    # the builds decide what's cached
+    monkeypatch.setattr(process_data, "PRECHECK_EXECUTOR", None)
+    assert all(result["compilation"] for result in process_data.evaluate_refinement(submission).values())
+    assert sorted(builds) == sorted(submission)
+
+
+def test_an_interrupted_evaluation_resumes_from_the_journaled_entries(monkeypatch, references, builds):
+    monkeypatch.setattr(process_data, "MAX_CONCURRENT_BUILDS", 2)   # the window is smaller than what's left
+    submission = answers()
+    journaled = list(submission)[1::2]   # also after the first wait for a build
+    done = {id: {"compilation": True, "test": False} for id in journaled}
+    percentages, evaluated = [], []
+    results = process_data.evaluate_refinement(
+        submission, percentages.append, entry_cb=lambda id, result: evaluated.append(id), done=done
+    )
+    assert sorted(builds) == sorted(set(submission) - set(journaled))
+    assert sorted(evaluated) == sorted(builds)
+    assert list(results) == list(submission)
+    assert all(results[id] == done[id] for id in journaled)
+    assert percentages == sorted(percentages) and percentages[-1] == 100
+
+
+def test_an_entry_whose_build_raises_isnt_evaluated(monkeypatch, references):
+    def run_build_job(job, archives_root, step, log_cb):
+        if job.id == "3":
+            raise OSError("No space left on device")
+        for _ in range(REFINEMENT_STEPS):
+            step()
+        return {"compilation": True, "test": True}
+
+    monkeypatch.setattr(process_data, "run_build_job", run_build_job)
+    percentages, completed, entries, logs = [], [], {}, {}
+    results = process_data.evaluate_refinement(
+        answers(),
+        percentages.append,
+        completed.append,
+        log_cb=lambda id, lines: logs.setdefault(id, lines),
+        entry_cb=entries.__setitem__,
+    )
+    assert len(results) == N_ENTRIES - 1 and "3" not in results
+    assert completed == [results]
+    assert entries["3"] is None and len(entries) == N_ENTRIES
+    assert "No space left on device" in logs["3"][0]
+    assert percentages[-1] == 100
@@ -0,0 +1,88 @@
+import os, tarfile, time
+
+import pytest
+
+from utils.repo_cache import RepoCache, detach_file
+
+
+@pytest.fixture
+def archive(tmp_path) -> str:
+    src = tmp_path / "src"
+    (src / "repo" / "src").mkdir(parents=True)
+    (src / "repo" / "pom.xml").write_text("<project/>")
+    (src / "repo" / "src" / "A.java").write_text("class A {}")
+    path = str(tmp_path / "org_repo_1_merged.tar.gz")
+    with tarfile.open(path, "w:gz") as tar:
+        tar.add(str(src / "repo"), arcname="repo")
+    return path
+
+
+def read(path) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("strategy", ["hardlink", "copy"])
+def test_checkout(tmp_path, archive, strategy):
+    cache = RepoCache(str(tmp_path / "cache"), 10**9, strategy)
+    first, second, third = tmp_path / "first", tmp_path / "second", tmp_path / "third"
+    for dest in (first, second, third):
+        dest.mkdir()
+    assert cache.checkout(archive, str(first)) is False   # no baseline
+    cache.checkout(archive, str(second))
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    java = str(first / "repo" / "src" / "A.java")
+    assert (os.stat(java).st_nlink > 1) == (strategy == "hardlink")
+    detach_file(java)
+    assert os.stat(java).st_nlink == 1
+    with open(java, "w") as f:
+        f.write("class A { int changed; }")
+    assert read(second / "repo" / "src" / "A.java") == "class A {}"
+    cache.checkout(archive, str(third))   # from the pristine tree
+    assert read(third / "repo" / "src" / "A.java") == "class A {}"
+
+
+def test_the_outputs_of_the_baseline_are_added(tmp_path, archive):
+    cache = RepoCache(str(tmp_path / "cache"), 10**9, "hardlink")
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    cache.checkout(archive, str(first))
+    (first / "repo" / "target" / "classes").mkdir(parents=True)
+    (first / "repo" / "target" / "classes" / "A.class").write_text("bytecode")
+    cache.store_baseline(archive, str(first), {"ok": True, "build_system": "maven"})
+    assert cache.baseline(archive) == {"ok": True, "build_system": "maven"}
+
+    assert cache.checkout(archive, str(second)) is True
+    output = second / "repo" / "target" / "classes" / "A.class"
+    assert read(output) == "bytecode"
+    assert os.stat(output).st_nlink == 1   # written by the next build
+
+
+def test_trees_of_a_previous_run_are_kept(tmp_path, archive):
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    RepoCache(str(tmp_path / "cache"), 10**9, "copy").checkout(archive, str(dest))
+    cache = RepoCache(str(tmp_path / "cache"), 10**9, "copy")
+    assert cache.stats()["trees"] == 1
+
+
+def test_a_new_version_of_the_archive_replaces_the_old_one(tmp_path, archive):
+    cache = RepoCache(str(tmp_path / "cache"), 10**9, "copy")
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    cache.checkout(archive, str(first))
+    os.utime(archive, (time.time() + 10, time.time() + 10))
+    cache.checkout(archive, str(second))
+    assert cache.stats()["trees"] == 1 and cache.stats()["evictions"] == 1
+
+
+def test_without_cache_the_archive_is_extracted(tmp_path, archive):
+    cache = RepoCache(str(tmp_path / "cache"), 0)
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    cache.checkout(archive, str(dest))
+    assert os.path.exists(dest / "repo" / "pom.xml")
+    assert cache.stats()["trees"] == 0
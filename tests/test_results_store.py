@@ -0,0 +1,77 @@
+import json, os, time
+
+from utils.results_store import INDEX_FILE, ResultsStore
+
+
+def results_of_size(size: int) -> dict:
+    return {"x": "." * (size - len('{"x": ""}'))}
+
+
+def test_put_and_get(tmp_path):
+    store = ResultsStore(str(tmp_path), 1000)
+    store.scan()
+    store.add("crab_refinement_1", "refinement")
+    assert store.get("crab_refinement_1") is None   # not complete yet
+    store.put("crab_refinement_1", {"e": {"compilation": True}})
+    assert store.get("crab_refinement_1") == {"e": {"compilation": True}}
+    with open(tmp_path / "crab_refinement_1") as f:
+        assert json.load(f) == {"e": {"compilation": True}}
+    assert store.stats()["hits"] == 1
+
+
+def test_lru_bounded_by_size(tmp_path):
+    store = ResultsStore(str(tmp_path), 250)
+    store.scan()
+    for i in range(3):
+        store.put(f"crab_comment_{i}", results_of_size(100))
+    # the first one was evicted to make room for the third
+    assert list(store.cache) == ["crab_comment_1", "crab_comment_2"]
+    assert store.cached_bytes == 200
+
+    assert store.get("crab_comment_0") == results_of_size(100)   # read from its file
+    assert list(store.cache) == ["crab_comment_2", "crab_comment_0"]
+    assert store.stats()["misses"] == 1
+
+    store.get("crab_comment_2")
+    store.put("crab_comment_3", results_of_size(100))
+    assert list(store.cache) == ["crab_comment_2", "crab_comment_3"]
+
+
+def test_results_larger_than_the_cache_are_not_kept(tmp_path):
+    store = ResultsStore(str(tmp_path), 50)
+    store.scan()
+    store.put("crab_comment_big", results_of_size(100))
+    assert store.get("crab_comment_big") == results_of_size(100)
+    assert store.cached_bytes == 0 and not store.cache
+
+
+def test_scan_reconciles_the_index_with_the_files(tmp_path):
+    store = ResultsStore(str(tmp_path), 1000)
+    store.scan()
+    store.put("crab_comment_kept", {"a": 1})
+    store.put("crab_comment_deleted", {"b": 2})
+    os.remove(tmp_path / "crab_comment_deleted")
+    # written before there was an index
+    (tmp_path / "crab_refinement_old").write_text('{"c": 3}')
+    (tmp_path / "crab_refinement_inflight").write_text("")
+
+    index = ResultsStore(str(tmp_path), 1000).scan()
+    assert sorted(index) == ["crab_comment_kept", "crab_refinement_inflight", "crab_refinement_old"]
+    assert index["crab_refinement_old"]["status"] == "complete"
+    assert index["crab_refinement_old"]["type"] == "refinement"
+    assert index["crab_refinement_inflight"]["status"] == "pending"
+    with open(tmp_path / INDEX_FILE) as f:
+        assert sorted(json.load(f)) == sorted(index)
+
+
+def test_expired_and_remove(tmp_path):
+    store = ResultsStore(str(tmp_path), 1000)
+    store.scan()
+    store.put("crab_comment_old", {"a": 1})
+    store.put("crab_comment_new", {"b": 2})
+    store.index["crab_comment_old"]["completed"] = time.time() - 3600
+    assert store.expired(60) == ["crab_comment_old"]
+    store.remove("crab_comment_old")
+    assert store.get("crab_comment_old") is None
+    assert not os.path.exists(tmp_path / "crab_comment_old")
+    assert store.expired(60) == []
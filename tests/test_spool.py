@@ -0,0 +1,38 @@
+import os
+
+from utils.spool import SpooledSubmission
+
+
+def test_mapping(tmp_path):
+    spool = SpooledSubmission(dir=str(tmp_path))
+    spool.append("a", {"A.java": "1"})
+    spool.append("b", {"B.java": "2"})
+    spool.append("a", {"A.java": "3"})   # overrides, like json.loads
+    assert len(spool) == 2
+    assert list(spool) == ["a", "b"]
+    assert spool["a"] == {"A.java": "3"}
+    assert dict(spool.items()) == {"a": {"A.java": "3"}, "b": {"B.java": "2"}}
+    spool.close()
+    assert not os.path.exists(spool.path)
+
+
+def test_decode():
+    spool = SpooledSubmission(lambda value: value * 2)
+    spool.append("a", 21)
+    assert spool["a"] == 42 and dict(spool.items()) == {"a": 42}
+    spool.close()
+
+
+def test_move_and_reopen(tmp_path):
+    spool = SpooledSubmission(dir=str(tmp_path))
+    for i in range(3):
+        spool.append(str(i), {"i": i})
+    path = str(tmp_path / "kept.jsonl")
+    spool.move(path)
+    assert spool.path == path and spool["2"] == {"i": 2}
+
+    reopened = SpooledSubmission.reopen(path, lambda value: value["i"])
+    assert dict(reopened.items()) == {"0": 0, "1": 1, "2": 2}
+    assert reopened["1"] == 1
+    reopened.close()
+    assert not os.path.exists(path)
@@ -0,0 +1,60 @@
+import os, time
+
+from utils import test_results
+from utils.test_results import collect_results, totals
+
+REPORT = """<?xml version="1.0" encoding="UTF-8"?>
+<testsuite name="{name}" tests="4">
+  <testcase classname="{name}" name="passes" time="0.5"/>
+  <testcase classname="{name}" name="fails" time="1.5">
+    <failure message="expected">stack</failure>
+    <system-out>{output}</system-out>
+  </testcase>
+  <testcase classname="{name}" name="errors" time="1,234.5">
+    <error message="boom"/>
+    <flakyFailure message="reran"/>
+  </testcase>
+  <testcase classname="{name}" name="skipped">
+    <skipped/>
+  </testcase>
+</testsuite>
+"""
+
+
+def write_report(path: str, name: str, output: str = "") -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(REPORT.format(name=name, output=output))
+
+
+def test_reports_of_all_the_modules(tmp_path):
+    repo = str(tmp_path)
+    write_report(os.path.join(repo, "core/target/surefire-reports/TEST-a.ATest.xml"), "a.ATest", "x" * 100_000)
+    write_report(os.path.join(repo, "app/build/test-results/test/TEST-b.BTest.xml"), "b.BTest")
+    # not reports of the build
+    write_report(os.path.join(repo, "app/src/test/resources/surefire-reports/TEST-c.CTest.xml"), "c.CTest")
+    write_report(os.path.join(repo, "core/target/surefire-reports/other.xml"), "d.DTest")
+    with open(os.path.join(repo, "core/target/surefire-reports/TEST-e.ETest.xml"), "w") as f:
+        f.write('<testsuite><testcase classname="e.ETest"')   # the JVM crashed while writing it
+
+    results = collect_results(repo)
+    assert results == {
+        "a.ATest": test_results.TestClassResult(tests=4, failures=1, errors=1, skipped=1, time=2.0),
+        "b.BTest": test_results.TestClassResult(tests=4, failures=1, errors=1, skipped=1, time=2.0),
+    }
+    assert totals(results) == {
+        "n_tests": 8,
+        "n_tests_passed": 4,
+        "n_tests_failed": 2,
+        "n_tests_errors": 2,
+        "n_tests_skipped": 2,
+    }
+
+
+def test_reports_of_an_earlier_run_are_ignored(tmp_path):
+    repo = str(tmp_path)
+    old = os.path.join(repo, "target/surefire-reports/TEST-a.ATest.xml")
+    write_report(old, "a.ATest")
+    os.utime(old, (time.time() - 60, time.time() - 60))
+    write_report(os.path.join(repo, "target/surefire-reports/TEST-b.BTest.xml"), "b.BTest")
+    assert list(collect_results(repo, since=time.time() - 30)) == ["b.BTest"]
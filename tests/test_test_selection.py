@@ -0,0 +1,65 @@
+import os
+
+from utils.test_selection import build_index, select_tests
+
+MAIN = os.path.join("src", "main", "java", "org", "x")
+TEST = os.path.join("src", "test", "java", "org", "x")
+
+
+def index(files: dict) -> dict:
+    """{path: refs} -> index, the class being derived from the path"""
+    return {
+        "files": {
+            path: {"class": "org.x." + os.path.basename(path)[: -len(".java")], "refs": refs}
+            for path, refs in files.items()
+        }
+    }
+
+
+A = os.path.join(MAIN, "A.java")
+B = os.path.join(MAIN, "B.java")
+C = os.path.join(MAIN, "C.java")
+A_TEST = os.path.join(TEST, "ATest.java")
+B_TEST = os.path.join(TEST, "BTest.java")
+C_TEST = os.path.join(TEST, "CTest.java")
+INDEX = index({A: [], B: [A], C: [], A_TEST: [A], B_TEST: [B], C_TEST: [C]})
+
+
+def test_selects_the_tests_that_transitively_reference_the_change():
+    assert select_tests(INDEX, [B]) == ["org.x.BTest"]
+    assert select_tests(INDEX, [A]) == ["org.x.ATest", "org.x.BTest"]
+
+
+def test_a_changed_test_is_selected():
+    assert select_tests(INDEX, [C_TEST]) == ["org.x.CTest"]
+
+
+def test_a_new_test_file_is_selected():
+    assert select_tests(INDEX, [os.path.join(TEST, "NewTest.java")]) == ["org.x.NewTest"]
+
+
+def test_the_whole_suite_when_the_selection_cant_be_trusted():
+    assert select_tests(INDEX, []) is None
+    assert select_tests(INDEX, [A, "pom.xml"]) is None   # not only java files
+    assert select_tests(INDEX, [A, C]) is None   # every test is selected
+    assert select_tests(INDEX, [os.path.join(MAIN, "Unused.java")]) is None   # no test at all
+
+
+def test_build_index(tmp_path):
+    sources = {
+        A: "package org.x; public class A {}",
+        B: "package org.x; class B { A a; }",
+        os.path.join("src", "main", "java", "org", "y", "D.java"): "package org.y; import org.x.B; class D { B b; }",
+        os.path.join("src", "main", "java", "org", "y", "E.java"): "package org.y; class E { org.x.A a; }",
+        A_TEST: "package org.x; class ATest { void t() { new A(); } }",
+    }
+    for path, source in sources.items():
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(source)
+    files = build_index(str(tmp_path))["files"]
+    refs = {path: info["refs"] for path, info in files.items()}
+    assert refs[B] == [A]
+    assert refs[os.path.join("src", "main", "java", "org", "y", "D.java")] == [B]
+    assert refs[os.path.join("src", "main", "java", "org", "y", "E.java")] == [A]
+    assert refs[A_TEST] == [A]
+    assert files[A_TEST]["class"] == "org.x.ATest"